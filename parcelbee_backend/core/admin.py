@@ -2,12 +2,92 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from core.models import User, DeliveryRequest
+from django.core.paginator import InvalidPage
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.db.models import prefetch_related_objects
+from core.models import User, DeliveryRequest, DeliveryShard, TariffZone, TariffRule, SurgeWindow, WeightSlab, Task, Trip
+from core.paginators import CappedCount, EstimatedCountPaginator
+from core.search import get_backend
+from core.sharding import database_for_delivery, delivery_databases, is_sharded, scatter
+
+
+class EstimatedCountMixin:
+    """Changelists paginated by EstimatedCountPaginator, which counts onward from the requested page"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page=request.GET.get(PAGE_VAR))
+
+
+class ShardedChangeList(ChangeList):
+    """
+    Delivery changelist over every delivery database. Each database returns its rows up to
+    the end of the current page in changelist order; the rows are merged, sorted again in
+    Python and the page is cut from the merge. Region databases hold no users, so
+    list_select_related is loaded from 'default' by prefetch instead of a join.
+    """
+    def _sort(self, rows):
+        opts = self.lookup_opts
+        ordering = [name for name in self.queryset.query.order_by if isinstance(name, str)]
+        # Stable sorts from the last key to the first; NULLs first ascending, as SQLite orders them
+        for name in reversed(ordering):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            attname = opts.pk.attname if name == 'pk' else opts.get_field(name).attname
+            rows.sort(key=lambda row: (getattr(row, attname) is not None, getattr(row, attname)), reverse=descending)
+        return rows
+
+    def _count(self, request, queryset):
+        page = request.GET.get(PAGE_VAR)
+        if not queryset.query.where:
+            # Delivery ids come from the directory, so its size is the total across databases
+            return EstimatedCountPaginator(DeliveryShard.objects.using('default').order_by('id'), self.list_per_page,
+                                           page=page).count
+        counts = scatter(lambda alias: EstimatedCountPaginator(queryset.using(alias), self.list_per_page,
+                                                               page=page).count)
+        total = sum(counts)
+        return CappedCount(total) if any(isinstance(count, CappedCount) for count in counts) else total
+
+    def get_results(self, request):
+        queryset = self.queryset.select_related(None)
+        result_count = self._count(request, queryset)
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        paginator = self.model_admin.get_paginator(request, queryset, self.list_per_page)
+        paginator.count = result_count
+        if (self.show_all and can_show_all) or not multi_page:
+            start, stop = 0, self.list_max_show_all
+        else:
+            try:
+                paginator.validate_number(self.page_num)
+            except InvalidPage:
+                raise IncorrectLookupParameters
+            start = (self.page_num - 1) * self.list_per_page
+            stop = start + self.list_per_page
+
+        rows = [row for part in scatter(lambda alias: list(queryset.using(alias)[:stop]), delivery_databases())
+                for row in part]
+        result_list = self._sort(rows)[start:stop]
+        related = self.list_select_related
+        if related and related is not True:
+            prefetch_related_objects(result_list, *related)
+
+        self.result_count = result_count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(EstimatedCountMixin, BaseUserAdmin):
     list_display = ('email', 'name', 'role', 'is_active', 'date_joined')
     list_filter = ('role', 'is_active', 'is_staff')
     search_fields = ('email', 'name', 'phone')
@@ -29,11 +109,14 @@ class UserAdmin(BaseUserAdmin):
 
 
 @admin.register(DeliveryRequest)
-class DeliveryRequestAdmin(admin.ModelAdmin):
+class DeliveryRequestAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ('id', 'customer', 'partner', 'status', 'weight', 'created_at')
-    list_filter = ('status', 'created_at', 'updated_at')
+    list_select_related = ('customer', 'partner')
+    list_filter = ('status',)
+    date_hierarchy = 'created_at'
     search_fields = ('customer__name', 'partner__name', 'pickup_address', 'drop_address', 'description')
     readonly_fields = ('created_at', 'updated_at', 'accepted_at', 'delivered_at')
+    autocomplete_fields = ('customer', 'partner')
     
     fieldsets = (
         ('Customer & Partner', {
@@ -53,4 +136,67 @@ class DeliveryRequestAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         if obj:  # Editing existing object
             return self.readonly_fields + ('customer',)
-        return self.readonly_fields
\ No newline at end of file
+        return self.readonly_fields
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of LIKE '%term%' across five columns
+        if not search_term:
+            return queryset, False
+        return get_backend().filter(queryset, search_term), False
+
+    def get_changelist(self, request, **kwargs):
+        if is_sharded():
+            return ShardedChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_object(self, request, object_id, from_field=None):
+        if not is_sharded() or from_field is not None:
+            return super().get_object(request, object_id, from_field)
+        # Look the delivery up where the directory says it lives
+        try:
+            delivery_id = int(object_id)
+        except (TypeError, ValueError):
+            return None
+        return self.get_queryset(request).using(database_for_delivery(delivery_id)).filter(pk=delivery_id).first()
+
+
+@admin.register(TariffZone)
+class TariffZoneAdmin(admin.ModelAdmin):
+    list_display = ('name', 'priority', 'min_lat', 'min_lng', 'max_lat', 'max_lng', 'is_active', 'updated_at')
+    list_filter = ('is_active',)
+    search_fields = ('name',)
+
+
+@admin.register(TariffRule)
+class TariffRuleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'pickup_zone', 'drop_zone', 'base_fee', 'per_km', 'updated_at')
+    list_select_related = ('pickup_zone', 'drop_zone')
+
+
+@admin.register(SurgeWindow)
+class SurgeWindowAdmin(admin.ModelAdmin):
+    list_display = ('id', 'zone', 'start_hour', 'end_hour', 'multiplier', 'updated_at')
+    list_select_related = ('zone',)
+
+
+@admin.register(WeightSlab)
+class WeightSlabAdmin(admin.ModelAdmin):
+    list_display = ('max_weight', 'fee', 'updated_at')
+
+
+
+@admin.register(Task)
+class TaskAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at', 'wait_ms', 'duration_ms', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('name',)
+    readonly_fields = ('started_at', 'finished_at', 'wait_ms', 'duration_ms', 'locked_by', 'locked_at', 'last_error')
+
+
+@admin.register(Trip)
+class TripAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'parcel_count', 'total_weight', 'region', 'partner', 'created_at')
+    list_filter = ('status', 'region')
+    list_select_related = ('partner',)
+    autocomplete_fields = ('partner',)
+    readonly_fields = ('delivery_ids', 'accepted_at')
@@ -0,0 +1,165 @@
+import threading
+import time
+
+from django.conf import settings
+
+from core.utils import json_response
+
+
+class RouteGate:
+    """
+    At most `concurrency` requests inside a route at once; up to `queue` more may wait
+    for a slot, each for at most `queue_timeout` seconds. Counters are per process.
+    """
+    def __init__(self, concurrency, queue=0, queue_timeout=0.0):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        # Metrics
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.degraded = 0
+        self.peak_active = 0
+        self.peak_waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self):
+        """Take a slot, waiting if allowed. Returns None when admitted, else 'full' or 'timeout'"""
+        with self._cond:
+            if self.active < self.concurrency and not self.waiting:
+                self._admit()
+                return None
+            if self.waiting >= self.queue:
+                self.rejected_full += 1
+                return 'full'
+
+            self.waiting += 1
+            self.queued += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        return 'timeout'
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+                waited = time.monotonic() - started
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            self._admit()
+            return None
+
+    def _admit(self):
+        self.active += 1
+        self.admitted += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+    def record_degraded(self):
+        with self._cond:
+            self.degraded += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'queue': self.queue,
+                'queue_timeout': self.queue_timeout,
+                'active': self.active,
+                'waiting': self.waiting,
+                'occupancy': round(self.active / self.concurrency, 3) if self.concurrency else None,
+                'peak_active': self.peak_active,
+                'peak_waiting': self.peak_waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected_full': self.rejected_full,
+                'rejected_timeout': self.rejected_timeout,
+                'degraded': self.degraded,
+                'queue_wait_avg_ms': round(self.wait_total / self.queued * 1000, 3) if self.queued else 0.0,
+                'queue_wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+
+_gates = None
+_gates_lock = threading.Lock()
+
+
+def gates():
+    """{url name: RouteGate} for PARCELBEE_ADMISSION, built once per process"""
+    global _gates
+    if _gates is None:
+        with _gates_lock:
+            if _gates is None:
+                _gates = {
+                    route: RouteGate(rule['concurrency'], rule.get('queue', 0), rule.get('queue_timeout', 0.0))
+                    for route, rule in getattr(settings, 'PARCELBEE_ADMISSION', {}).items()
+                }
+    return _gates
+
+
+def admission_metrics():
+    return {route: gate.snapshot() for route, gate in gates().items()}
+
+
+def is_degraded(request):
+    """True when admission control let this request through without a slot; serve a cheap answer"""
+    return getattr(request, 'admission_degraded', False)
+
+
+class AdmissionMiddleware:
+    """
+    Per-route concurrency limits from PARCELBEE_ADMISSION, keyed by URL name:
+        {'price-estimate': {'concurrency': 4, 'queue': 8, 'queue_timeout': 0.25,
+                            'retry_after': 2, 'degrade': True}}
+    A request finding the route busy waits in a bounded queue; when the queue is full or its
+    wait passes queue_timeout it gets 503 with Retry-After at once, so a slow dependency can
+    only tie up `concurrency + queue` worker threads. Routes with 'degrade' serve the overflow
+    without a slot instead, marked for the view through is_degraded(request).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = getattr(settings, 'PARCELBEE_ADMISSION', {})
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            # process_view runs inside get_response; hold the slot until the view has answered
+            gate = getattr(request, '_admission_gate', None)
+            if gate is not None:
+                gate.release()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        rule = self.rules.get(match.url_name) if match else None
+        if not rule:
+            return None
+
+        gate = gates()[match.url_name]
+        refused = gate.acquire()
+        if refused is None:
+            request._admission_gate = gate
+            return None
+        if rule.get('degrade'):
+            gate.record_degraded()
+            request.admission_degraded = True
+            return None
+
+        retry_after = rule.get('retry_after', 1)
+        response = json_response({'error': 'Service busy, retry shortly', 'retry_after': retry_after}, status=503)
+        response['Retry-After'] = str(retry_after)
+        return response
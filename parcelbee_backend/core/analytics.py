@@ -0,0 +1,273 @@
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import pre_delete
+from django.utils import timezone
+
+from core.models import DailyDeliveryRollup, DeliveryRequest, User
+from core.sharding import delivery_databases
+
+
+COUNTER_FIELDS = (
+    'created_count',
+    'accepted_count',
+    'delivered_count',
+    'cancelled_count',
+    'accept_latency_total',
+    'delivery_duration_total',
+    'delivery_duration_count',
+    'revenue',
+)
+
+
+def _seconds_between(start, end):
+    if not start or not end:
+        return None
+    return max((end - start).total_seconds(), 0.0)
+
+
+def transition_increments(delivery, new_status, at=None):
+    """
+    Work out which rollup row and counters a status transition touches.
+    Returns (day, partner_id, increments) or None if the status is not tracked.
+    """
+    at = at or timezone.now()
+
+    if new_status == 'pending':
+        return timezone.localdate(delivery.created_at), None, {'created_count': 1}
+
+    if new_status == 'accepted':
+        increments = {'accepted_count': 1}
+        latency = _seconds_between(delivery.created_at, delivery.accepted_at or at)
+        if latency is not None:
+            increments['accept_latency_total'] = latency
+        return timezone.localdate(delivery.accepted_at or at), delivery.partner_id, increments
+
+    if new_status == 'delivered':
+        delivered_at = delivery.delivered_at or at
+        increments = {'delivered_count': 1}
+        duration = _seconds_between(delivery.accepted_at, delivered_at)
+        if duration is not None:
+            increments['delivery_duration_total'] = duration
+            increments['delivery_duration_count'] = 1
+        if delivery.estimated_price:
+            increments['revenue'] = Decimal(str(delivery.estimated_price))
+        return timezone.localdate(delivered_at), delivery.partner_id, increments
+
+    if new_status == 'cancelled':
+        return timezone.localdate(at), delivery.partner_id, {'cancelled_count': 1}
+
+    return None
+
+
+def bump_rollup(day, partner_id, increments):
+    """Add increments to a rollup row with a single UPDATE, creating the row the first time"""
+    updates = {field: F(field) + value for field, value in increments.items()}
+    if DailyDeliveryRollup.objects.filter(day=day, partner_id=partner_id).update(**updates):
+        return
+
+    try:
+        with transaction.atomic():
+            DailyDeliveryRollup.objects.create(day=day, partner_id=partner_id, **increments)
+    except IntegrityError:
+        # Another worker created the row between our UPDATE and INSERT
+        DailyDeliveryRollup.objects.filter(day=day, partner_id=partner_id).update(**updates)
+
+
+TERMINAL_STATUSES = ('delivered', 'cancelled')
+
+
+def status_change_increments(delivery, previous_status, previous_at, at=None):
+    """
+    Rollup changes for a partner status update, from previous_status (entered at previous_at,
+    the row's updated_at before the update) to delivery.status. Only terminal statuses count here,
+    acceptance is counted when the delivery is accepted. Leaving a terminal status takes its
+    counters back, so a delivery that is delivered, reopened and delivered again counts once,
+    as rebuild_rollups counts it.
+    """
+    results = []
+    if previous_status in TERMINAL_STATUSES:
+        day, partner_id, increments = transition_increments(delivery, previous_status, at=previous_at)
+        results.append((day, partner_id, {field: -value for field, value in increments.items()}))
+    if delivery.status in TERMINAL_STATUSES:
+        results.append(transition_increments(delivery, delivery.status, at=at))
+    return results
+
+
+def _bump_merged(results):
+    """Merge (day, partner_id, increments) per rollup row, then bump each row once"""
+    merged = defaultdict(lambda: defaultdict(int))
+    for result in results:
+        if result is None:
+            continue
+        day, partner_id, increments = result
+        bucket = merged[(day, partner_id)]
+        for field, value in increments.items():
+            bucket[field] += value
+
+    for (day, partner_id), increments in merged.items():
+        increments = {field: value for field, value in increments.items() if value}
+        if increments:
+            bump_rollup(day, partner_id, increments)
+
+
+def fold_partner_rollups(sender, instance, **kwargs):
+    """
+    Move a partner's rollup rows into the unassigned rows of the same days before the partner
+    is deleted, where rebuild_rollups counts deliveries that lost their partner. The unassigned
+    row of a day is unique, so SET_NULL alone would collide with it.
+    """
+    rows = DailyDeliveryRollup.objects.filter(partner=instance)
+    for row in rows:
+        bump_rollup(row.day, None, {field: getattr(row, field) for field in COUNTER_FIELDS if getattr(row, field)})
+    rows.delete()
+
+
+pre_delete.connect(fold_partner_rollups, sender=User, dispatch_uid='fold_partner_rollups')
+
+def record_transition(delivery, new_status, at=None):
+    """Keep the daily rollups current after a delivery changes status"""
+    result = transition_increments(delivery, new_status, at=at)
+    if result is None:
+        return
+    day, partner_id, increments = result
+    bump_rollup(day, partner_id, increments)
+
+
+def record_transitions(transitions):
+    """
+    Batched record_transition for (delivery, new_status) pairs.
+    Increments are merged per rollup row first, so a 40-item batch is one UPDATE per day/partner.
+    """
+    _bump_merged(transition_increments(delivery, new_status) for delivery, new_status in transitions)
+
+
+def record_status_changes(changes, at=None):
+    """
+    Keep the daily rollups current after partner status updates, given as
+    (delivery, previous_status, previous_at) with delivery.status already the new status.
+    """
+    _bump_merged(itertools.chain.from_iterable(
+        status_change_increments(delivery, previous_status, previous_at, at=at)
+        for delivery, previous_status, previous_at in changes
+    ))
+
+
+def rebuild_rollups(date_from=None, date_to=None, chunk_size=2000):
+    """
+    Recompute rollups from delivery_requests, streaming the history in chunks.
+    Only days in [date_from, date_to] are replaced when a range is given.
+    Returns (deliveries_scanned, rollup_rows_written).
+    """
+    columns = ('status', 'partner_id', 'estimated_price', 'created_at', 'updated_at', 'accepted_at', 'delivered_at')
+    rows = itertools.chain.from_iterable(
+        DeliveryRequest.objects.using(alias).order_by('id').values_list(*columns).iterator(chunk_size=chunk_size)
+        for alias in delivery_databases()
+    )
+
+    totals = defaultdict(lambda: defaultdict(int))
+
+    def in_range(day):
+        return (date_from is None or day >= date_from) and (date_to is None or day <= date_to)
+
+    def add(day, partner_id, increments):
+        if in_range(day):
+            bucket = totals[(day, partner_id)]
+            for field, value in increments.items():
+                bucket[field] += value
+
+    scanned = 0
+    for status, partner_id, price, created_at, updated_at, accepted_at, delivered_at in rows:
+        scanned += 1
+        add(timezone.localdate(created_at), None, {'created_count': 1})
+
+        if accepted_at:
+            add(timezone.localdate(accepted_at), partner_id, {
+                'accepted_count': 1,
+                'accept_latency_total': _seconds_between(created_at, accepted_at),
+            })
+
+        if status == 'delivered' and delivered_at:
+            increments = {'delivered_count': 1}
+            duration = _seconds_between(accepted_at, delivered_at)
+            if duration is not None:
+                increments['delivery_duration_total'] = duration
+                increments['delivery_duration_count'] = 1
+            if price:
+                increments['revenue'] = price
+            add(timezone.localdate(delivered_at), partner_id, increments)
+        elif status == 'cancelled':
+            # No cancelled_at column, the last update is the cancellation
+            add(timezone.localdate(updated_at), partner_id, {'cancelled_count': 1})
+
+    existing = DailyDeliveryRollup.objects.all()
+    if date_from:
+        existing = existing.filter(day__gte=date_from)
+    if date_to:
+        existing = existing.filter(day__lte=date_to)
+
+    with transaction.atomic():
+        existing.delete()
+        DailyDeliveryRollup.objects.bulk_create(
+            [DailyDeliveryRollup(day=day, partner_id=partner_id, **counters)
+             for (day, partner_id), counters in totals.items()],
+            batch_size=500
+        )
+
+    return scanned, len(totals)
+
+
+def _summarize(row):
+    """Turn summed rollup counters into the API's metrics"""
+    accepted = row['accepted_count'] or 0
+    duration_count = row['delivery_duration_count'] or 0
+    return {
+        'created': row['created_count'] or 0,
+        'accepted': accepted,
+        'delivered': row['delivered_count'] or 0,
+        'cancelled': row['cancelled_count'] or 0,
+        'avg_accept_latency_seconds': round(row['accept_latency_total'] / accepted, 1) if accepted else None,
+        'avg_delivery_duration_seconds': round(row['delivery_duration_total'] / duration_count, 1) if duration_count else None,
+        'revenue': float(row['revenue'] or 0),
+    }
+
+
+def query_rollups(date_from=None, date_to=None, group_by='day', partner=None):
+    """Aggregate rollup rows by day or partner; never touches delivery_requests"""
+    rollups = DailyDeliveryRollup.objects.all()
+    if date_from:
+        rollups = rollups.filter(day__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(day__lte=date_to)
+    if partner:
+        rollups = rollups.filter(partner_id=partner)
+
+    sums = {field: Sum(field) for field in COUNTER_FIELDS}
+
+    if group_by == 'partner':
+        grouped = (rollups.filter(partner__isnull=False)
+                   .values('partner_id', 'partner__name')
+                   .annotate(**sums)
+                   .order_by('partner_id'))
+        return [
+            {'partner_id': row['partner_id'], 'partner_name': row['partner__name'], **_summarize(row)}
+            for row in grouped
+        ]
+
+    grouped = rollups.values('day').annotate(**sums).order_by('day')
+    return [{'day': row['day'].isoformat(), **_summarize(row)} for row in grouped]
+
+
+def rollup_totals(date_from=None, date_to=None, partner=None):
+    """Totals across the whole range"""
+    rollups = DailyDeliveryRollup.objects.all()
+    if date_from:
+        rollups = rollups.filter(day__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(day__lte=date_to)
+    if partner:
+        rollups = rollups.filter(partner_id=partner)
+    return _summarize(rollups.aggregate(**{field: Sum(field) for field in COUNTER_FIELDS}))
@@ -0,0 +1,72 @@
+from django.conf import settings
+
+from rest_framework.views import APIView
+from rest_framework.response import Response
+
+from .serializers import PriceEstimateSerializer
+from .utils import geocode_nominatim
+from .roads import trip_distance_km
+from .pricing import engine as tariff_engine
+from .admission import is_degraded
+
+
+class PriceEstimateView(APIView):
+    """
+    POST /api/price/estimate/
+    payload: { pickup_address, drop_address, weight }
+    response: { distance_km, distance_source, estimated_price, breakdown, pickup_lat, pickup_lng, drop_lat, drop_lng }
+    When admission control finds the pricing pool saturated the quote skips geocoding and
+    uses the fallback distance (distance_source "fallback", degraded true).
+    """
+    permission_classes = []  # keep public or add IsAuthenticated if you want auth
+
+    def post(self, request):
+        serializer = PriceEstimateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        # try to geocode; if it fails, fall back to a conservative distance so UI can continue
+        try:
+           if is_degraded(request):
+               raise RuntimeError("Pricing is busy; quoted with the fallback distance")
+           p_lat, p_lng = geocode_nominatim(data["pickup_address"])
+           d_lat, d_lng = geocode_nominatim(data["drop_address"])
+           geocoding_used = True
+           geocode_note = None
+        except Exception as e:
+    # Geocoding failed for one or both addresses.
+           geocoding_used = False
+           geocode_error = str(e)
+            # Do NOT call haversine when coords are None
+           p_lat = p_lng = d_lat = d_lng = None
+            
+            # fallback: assume a small city delivery distance. tune this if you want.
+           distance_km = getattr(settings, "PARCELBEE_FALLBACK_KM", 5.0)
+           distance_source = "fallback"
+        else:
+           # Road-network distance when PARCELBEE_ROAD_GRAPH covers both points, else straight line.
+           # Outside the try: a routing bug must not be reported as a geocoding failure.
+           distance_km, distance_source = trip_distance_km(p_lat, p_lng, d_lat, d_lng)
+
+        # Zone rates, surge and weight slabs come from the compiled tariff table;
+        # without any tariff rules this is the global PARCELBEE_BASE_FEE/PER_KM/PER_KG formula
+        breakdown = tariff_engine.quote(
+            distance_km, data["weight"],
+            pickup=(p_lat, p_lng), drop=(d_lat, d_lng)
+        )
+        estimated_price = round(breakdown["subtotal"])
+
+        return Response({
+            "distance_km": round(distance_km, 3),
+            "distance_source": distance_source,
+            "estimated_price": estimated_price,
+            "breakdown": breakdown,
+            "pickup_lat": p_lat,
+            "pickup_lng": p_lng,
+            "drop_lat": d_lat,
+            "drop_lng": d_lng,
+            "geocoding_used": geocoding_used,
+            "geocode_error": geocode_error if not geocoding_used else None,
+            "degraded": is_degraded(request),
+            # "note": geocode_note
+        })
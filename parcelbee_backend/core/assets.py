@@ -0,0 +1,204 @@
+import gzip
+import hashlib
+import json
+import posixpath
+import re
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+
+from core.compression import brotli
+
+
+MANIFEST = 'manifest.json'
+FINGERPRINTED = ('.js', '.css', '.png', '.jpg', '.jpeg', '.svg', '.webp', '.woff', '.woff2', '.ico')
+PRECOMPRESSED = ('.html', '.js', '.css', '.svg', '.json')
+ASSET_REFERENCE = re.compile(r'''(\b(?:src|href)=)(["'])([^"'#?:]+)\2''')
+
+
+def source_dir():
+    return Path(getattr(settings, 'PARCELBEE_FRONTEND_SRC', settings.BASE_DIR.parent / 'parcelbee_frontend' / 'src'))
+
+
+def build_dir():
+    return Path(getattr(settings, 'PARCELBEE_FRONTEND_BUILD', settings.BASE_DIR / 'frontend_build'))
+
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    # ':' only inside declaration blocks; in a selector "div :first-child" is not "div:first-child"
+    text = re.sub(r'\{[^{}]*\}', lambda block: re.sub(r'\s*:\s*', ':', block.group(0)), text)
+    return text.replace(';}', '}').strip()
+
+
+def _scan_js_line(line, stack):
+    """
+    Advance the JS lexer state over one line. stack holds what is still open at the
+    end of it: 'template' (a `...` literal), '{' (a brace inside a ${} substitution)
+    and 'comment' (a /* */ block). Quoted strings cannot span lines, so they are not kept.
+    """
+    i, quote = 0, None
+    while i < len(line):
+        top = stack[-1] if stack else None
+        char = line[i]
+        if top == 'comment':
+            end = line.find('*/', i)
+            if end < 0:
+                return
+            stack.pop()
+            i = end + 2
+            continue
+        if top == 'template':
+            if char == '\\':
+                i += 1
+            elif char == '`':
+                stack.pop()
+            elif line.startswith('${', i):
+                stack.append('{')
+                i += 1
+            i += 1
+            continue
+        if quote:
+            if char == '\\':
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char == '`':
+            stack.append('template')
+        elif line.startswith('//', i):
+            return
+        elif line.startswith('/*', i):
+            stack.append('comment')
+            i += 1
+        elif char == '{' and stack:
+            stack.append('{')
+        elif char == '}' and top == '{':
+            stack.pop()
+        i += 1
+
+
+def minify_js(text):
+    """
+    Conservative line-based minification: drops indentation, blank lines, whole-line
+    // comments and comment blocks that start a line. Code inside a line is untouched,
+    so strings and regexes containing // or /* are safe. Lines inside template literals
+    are kept as they are, whitespace included.
+    """
+    lines = []
+    stack = []
+    for line in text.splitlines():
+        opened = stack[-1] if stack else None
+        _scan_js_line(line, stack)
+        if opened == 'template':
+            lines.append(line)
+            continue
+        if opened == 'comment':
+            if stack and stack[-1] == 'comment':
+                continue
+            line = line[line.index('*/') + 2:]
+        # Whitespace before the line break belongs to a template literal left open
+        stripped = line.lstrip() if stack and stack[-1] == 'template' else line.strip()
+        if not stripped or stripped.startswith('//'):
+            continue
+        if stripped.startswith('/*'):
+            end = stripped.find('*/')
+            if end < 0 or not stripped[end + 2:].strip():
+                continue
+        lines.append(stripped)
+    return '\n'.join(lines) + '\n'
+
+
+def minify_html(text):
+    text = re.sub(r'<!--(?!\[if).*?-->', '', text, flags=re.S)
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip()) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js, '.html': minify_html}
+
+
+def fingerprinted_name(relative, content):
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    path = Path(relative)
+    return str(path.with_name(f'{path.stem}.{digest}{path.suffix}')).replace('\\', '/')
+
+
+def _rewrite_references(html, html_path, manifest):
+    """Point src/href attributes at the fingerprinted file names"""
+    base = posixpath.dirname(html_path)
+
+    def replace(match):
+        prefix, quote, target = match.groups()
+        resolved = posixpath.normpath(posixpath.join(base, target))
+        hashed = manifest.get(resolved)
+        if hashed is None:
+            return match.group(0)
+        return f'{prefix}{quote}{posixpath.relpath(hashed, base or ".")}{quote}'
+
+    return ASSET_REFERENCE.sub(replace, html)
+
+
+def _precompress(path):
+    data = path.read_bytes()
+    written = []
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        path.with_name(path.name + '.gz').write_bytes(compressed)
+        written.append('gz')
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            path.with_name(path.name + '.br').write_bytes(compressed)
+            written.append('br')
+    return written
+
+
+def build(source=None, output=None):
+    """
+    Minify, fingerprint and precompress the frontend. HTML pages keep their names
+    (they are entry points) and have their asset references rewritten.
+    Returns the manifest: source path -> fingerprinted path, relative to the output dir.
+    """
+    source = Path(source or source_dir())
+    output = Path(output or build_dir())
+    if output.exists():
+        shutil.rmtree(output)
+    output.mkdir(parents=True)
+
+    files = sorted(p for p in source.rglob('*') if p.is_file())
+    manifest = {}
+    pages = []
+
+    for path in files:
+        relative = path.relative_to(source).as_posix()
+        if path.suffix == '.html':
+            pages.append((relative, path))
+            continue
+        content = path.read_bytes()
+        minify = MINIFIERS.get(path.suffix)
+        if minify:
+            content = minify(content.decode('utf-8')).encode('utf-8')
+        target = fingerprinted_name(relative, content) if path.suffix in FINGERPRINTED else relative
+        manifest[relative] = target
+        (output / target).parent.mkdir(parents=True, exist_ok=True)
+        (output / target).write_bytes(content)
+
+    for relative, path in pages:
+        html = _rewrite_references(path.read_text(encoding='utf-8'), relative, manifest)
+        (output / relative).parent.mkdir(parents=True, exist_ok=True)
+        (output / relative).write_text(minify_html(html), encoding='utf-8')
+
+    for path in list(output.rglob('*')):
+        if path.is_file() and path.suffix in PRECOMPRESSED:
+            _precompress(path)
+
+    (output / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding='utf-8')
+    return manifest
+
+
+def is_fingerprinted(name):
+    return re.search(r'\.[0-9a-f]{10}\.[A-Za-z0-9]+$', name) is not None
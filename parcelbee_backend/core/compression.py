@@ -0,0 +1,85 @@
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+
+def accepted_encodings(request):
+    """Encodings the client accepts, ignoring q=0 entries"""
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.strip().partition(';')
+        if name and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            accepted.add(name.lower())
+    return accepted
+
+
+def choose_encoding(request):
+    accepted = accepted_encodings(request)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Compress API responses with brotli (when installed) or gzip, as negotiated by
+    Accept-Encoding. Bodies under PARCELBEE_COMPRESS_MIN_BYTES are sent as-is since
+    compressing them costs more CPU than the bytes saved. Streaming responses are gzipped.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_bytes = getattr(settings, 'PARCELBEE_COMPRESS_MIN_BYTES', 1024)
+        self.gzip_level = getattr(settings, 'PARCELBEE_GZIP_LEVEL', 6)
+        self.brotli_quality = getattr(settings, 'PARCELBEE_BROTLI_QUALITY', 5)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if 'gzip' not in accepted_encodings(request):
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content)
+            response['Content-Encoding'] = 'gzip'
+            del response['Content-Length']
+            return response
+
+        if len(response.content) < self.min_bytes:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(response.content, compresslevel=self.gzip_level, mtime=0)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # A strong ETag describes the uncompressed bytes
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
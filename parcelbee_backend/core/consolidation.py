@@ -0,0 +1,206 @@
+import math
+from array import array
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.analytics import record_transitions
+from core.coordinates import load_coordinates
+from core.events import build_event, record_events
+from core.models import DeliveryRequest, Trip
+from core.sharding import databases_for_deliveries, delivery_databases, region_for
+
+
+class PendingJobs:
+    """Column arrays of pending deliveries: compact to hold and fast to scan"""
+    def __init__(self):
+        self.ids = array('q')
+        self.p_lat = array('d')
+        self.p_lng = array('d')
+        self.d_lat = array('d')
+        self.d_lng = array('d')
+        self.weight = array('d')
+        self.price = array('d')
+
+    def append(self, delivery_id, p_lat, p_lng, d_lat, d_lng, weight, price):
+        self.ids.append(delivery_id)
+        self.p_lat.append(float(p_lat))
+        self.p_lng.append(float(p_lng))
+        self.d_lat.append(float(d_lat))
+        self.d_lng.append(float(d_lng))
+        self.weight.append(float(weight))
+        self.price.append(float(price) if price is not None else math.nan)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Adopt the columns returned by load_coordinates (numpy arrays are copied into array buffers)"""
+        def column(typecode, values):
+            return values if isinstance(values, array) else array(typecode, values.tobytes())
+
+        jobs = cls()
+        jobs.ids = column('q', columns['id'])
+        jobs.p_lat = column('d', columns['pickup_lat'])
+        jobs.p_lng = column('d', columns['pickup_lng'])
+        jobs.d_lat = column('d', columns['drop_lat'])
+        jobs.d_lng = column('d', columns['drop_lng'])
+        jobs.weight = column('d', columns['weight'])
+        jobs.price = column('d', columns['estimated_price'])
+        return jobs
+
+
+def load_pending(using='default', chunk_size=5000):
+    """Pending, unassigned deliveries with coordinates at both ends"""
+    queryset = (
+        DeliveryRequest.objects.using(using)
+        .filter(status='pending', partner__isnull=True,
+                pickup_lat__isnull=False, pickup_lng__isnull=False,
+                drop_lat__isnull=False, drop_lng__isnull=False)
+        .order_by('id')
+    )
+    columns = load_coordinates(queryset, values=('weight', 'estimated_price'), chunk_size=chunk_size)
+    return PendingJobs.from_columns(columns)
+
+
+def _sector(jobs, i, sectors):
+    """Compass sector of the drop as seen from the pickup"""
+    dy = jobs.d_lat[i] - jobs.p_lat[i]
+    dx = (jobs.d_lng[i] - jobs.p_lng[i]) * math.cos(math.radians(jobs.p_lat[i]))
+    return int((math.atan2(dx, dy) % math.tau) / math.tau * sectors) % sectors, dx * dx + dy * dy
+
+
+def _pack(jobs, indexes, cell_deg, sectors, max_weight, max_parcels, offset=0.0):
+    """
+    Bucket jobs by pickup grid cell (the grid shifted by offset degrees) and drop sector, then
+    cut each bucket, walked in order of drop distance, into trips under the caps.
+    Returns (trips, leftover indexes).
+    """
+    buckets = defaultdict(list)
+    for i in indexes:
+        sector, reach = _sector(jobs, i, sectors)
+        key = (math.floor((jobs.p_lat[i] + offset) / cell_deg), math.floor((jobs.p_lng[i] + offset) / cell_deg), sector)
+        buckets[key].append((reach, i))
+
+    trips, leftover = [], []
+    for members in buckets.values():
+        if len(members) < 2:
+            leftover.append(members[0][1])
+            continue
+        members.sort()
+        current, load = [], 0.0
+        for _, i in members:
+            if current and (load + jobs.weight[i] > max_weight or len(current) >= max_parcels):
+                if len(current) > 1:
+                    trips.append(current)
+                else:
+                    leftover.extend(current)
+                current, load = [], 0.0
+            current.append(i)
+            load += jobs.weight[i]
+        if len(current) > 1:
+            trips.append(current)
+        else:
+            leftover.extend(current)
+    return trips, leftover
+
+
+def cluster(jobs, max_weight, max_parcels, cell_deg=0.01, sectors=8):
+    """
+    Group pending jobs into trips of at least two parcels. A fine grid pass groups pickups
+    in the same cell whose drops lie in the same direction; jobs it leaves alone get a second
+    pass on a grid twice as coarse and shifted by half a fine cell. No coarse boundary then
+    lies within half a cell of a fine one, so neighbours split by any fine boundary meet again.
+    Jobs heavier than max_weight are never consolidated. Returns lists of indexes into jobs.
+    """
+    candidates = [i for i in range(len(jobs)) if jobs.weight[i] <= max_weight]
+    trips, leftover = _pack(jobs, candidates, cell_deg, sectors, max_weight, max_parcels)
+    more, _ = _pack(jobs, leftover, cell_deg * 2, sectors, max_weight, max_parcels, offset=cell_deg / 2)
+    return trips + more
+
+
+def build_trip(jobs, members, sectors):
+    count = len(members)
+    prices = [jobs.price[i] for i in members]
+    sector, _ = _sector(jobs, members[0], sectors)
+    return Trip(
+        delivery_ids=[jobs.ids[i] for i in members],
+        parcel_count=count,
+        total_weight=Decimal(str(round(sum(jobs.weight[i] for i in members), 2))),
+        estimated_price=None if any(math.isnan(p) for p in prices) else Decimal(str(round(sum(prices), 2))),
+        pickup_lat=Decimal(str(round(sum(jobs.p_lat[i] for i in members) / count, 6))),
+        pickup_lng=Decimal(str(round(sum(jobs.p_lng[i] for i in members) / count, 6))),
+        # Middle of the sector the drops fall in
+        bearing=int((sector + 0.5) * 360 / sectors) % 360,
+        region=region_for(jobs.p_lat[members[0]], jobs.p_lng[members[0]]),
+    )
+
+
+def consolidate(max_weight=None, max_parcels=None, cell_deg=None, sectors=None):
+    """
+    Replace the open trip offers with a fresh clustering of pending deliveries, one region
+    database at a time so a trip never spans databases. Returns (trips_offered, parcels_in_trips).
+    """
+    max_weight = max_weight or getattr(settings, 'PARCELBEE_TRIP_MAX_WEIGHT', 20.0)
+    max_parcels = max_parcels or getattr(settings, 'PARCELBEE_TRIP_MAX_PARCELS', 8)
+    cell_deg = cell_deg or getattr(settings, 'PARCELBEE_TRIP_CELL_DEG', 0.01)
+    sectors = sectors or getattr(settings, 'PARCELBEE_TRIP_SECTORS', 8)
+
+    trips = []
+    for alias in delivery_databases():
+        jobs = load_pending(alias)
+        for members in cluster(jobs, max_weight, max_parcels, cell_deg, sectors):
+            trips.append(build_trip(jobs, members, sectors))
+
+    with transaction.atomic():
+        Trip.objects.filter(status='offered').delete()
+        Trip.objects.bulk_create(trips, batch_size=500)
+    return len(trips), sum(trip.parcel_count for trip in trips)
+
+
+def accept_trip(trip_id, partner):
+    """
+    Assign every delivery of an offered trip to partner, or none of them. Returns the trip and
+    its accepted deliveries; (trip, None) when a delivery was taken meanwhile, in which case the
+    offer is withdrawn. Raises Trip.DoesNotExist when the trip is not on offer.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        trip = Trip.objects.select_for_update().get(id=trip_id, status='offered')
+        located = databases_for_deliveries(trip.delivery_ids)
+        deliveries = None
+        if len(located) == 1:
+            alias, ids = located.popitem()
+            with transaction.atomic(using=alias):
+                found = DeliveryRequest.objects.using(alias).select_for_update().only(
+                    'id', 'partner_id', 'status', 'created_at', 'accepted_at', 'estimated_price'
+                ).in_bulk(ids)
+                if len(found) == len(ids) and all(d.status == 'pending' and d.partner_id is None for d in found.values()):
+                    deliveries = [found[i] for i in ids]
+                    for delivery in deliveries:
+                        delivery.partner = partner
+                        delivery.status = 'accepted'
+                        delivery.accepted_at = now
+                        delivery.updated_at = now
+                    DeliveryRequest.objects.using(alias).bulk_update(
+                        deliveries, ['partner', 'status', 'accepted_at', 'updated_at']
+                    )
+                    record_events([build_event(delivery, 'accepted', actor=partner, at=now) for delivery in deliveries],
+                                  using=alias)
+                    # Rollups commit with the trip, in the outer transaction on 'default'
+                    record_transitions([(delivery, 'accepted') for delivery in deliveries])
+
+        if deliveries is None:
+            trip.status = 'withdrawn'
+            trip.save(update_fields=['status'])
+            return trip, None
+
+        trip.status = 'accepted'
+        trip.partner = partner
+        trip.accepted_at = now
+        trip.save(update_fields=['status', 'partner', 'accepted_at'])
+    return trip, deliveries
@@ -0,0 +1,54 @@
+import math
+from array import array
+
+from django.db import connections
+
+from core.models import MicrodegreeField
+from core.utils import optional_numpy
+
+
+COORDINATE_FIELDS = ('pickup_lat', 'pickup_lng', 'drop_lat', 'drop_lng')
+# Stands in for NULL in the integer columns while reading
+_NULL = -2 ** 63
+
+
+def load_coordinates(queryset, fields=COORDINATE_FIELDS, values=(), chunk_size=5000):
+    """
+    Read the id and coordinate columns of a delivery queryset in bulk, bypassing model
+    instances and per-value conversion: the raw microdegree integers are copied into
+    int64 buffers and scaled once. values names extra numeric columns (weight, price)
+    read alongside as floats. Returns {'id': ..., field: ...} as numpy arrays when numpy
+    is installed, else array('q') ids and array('d') floats. Missing values come back
+    as NaN. Point the queryset at a region database with .using().
+    """
+    columns = ('id',) + tuple(fields) + tuple(values)
+    raw = [array('q') for _ in ('id',) + tuple(fields)] + [array('d') for _ in values]
+    sql, params = queryset.values_list(*columns).query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for buffer, column in zip(raw, zip(*rows)):
+                if buffer.typecode == 'd':
+                    buffer.extend(math.nan if value is None else float(value) for value in column)
+                else:
+                    buffer.extend(_NULL if value is None else value for value in column)
+
+    ids, raw, extra = raw[0], raw[1:len(fields) + 1], raw[len(fields) + 1:]
+    scale = MicrodegreeField.SCALE
+    np = optional_numpy()
+    if np is not None:
+        result = {'id': np.frombuffer(ids, dtype=np.int64)}
+        for field, buffer in zip(fields, raw):
+            column = np.frombuffer(buffer, dtype=np.int64)
+            result[field] = np.where(column == _NULL, np.nan, column / scale)
+        for field, buffer in zip(values, extra):
+            result[field] = np.frombuffer(buffer, dtype=np.float64)
+        return result
+    result = {'id': ids}
+    for field, buffer in zip(fields, raw):
+        result[field] = array('d', (math.nan if value == _NULL else value / scale for value in buffer))
+    result.update(zip(values, extra))
+    return result
@@ -0,0 +1,293 @@
+import json
+import logging
+import math
+import threading
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.coordinates import load_coordinates
+from core.models import DeliveryRequest
+from core.sharding import delivery_databases
+from core.utils import haversine_km, optional_numpy
+
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ('bias', 'distance_km', 'sqrt_distance', 'weight', 'hour_sin', 'hour_cos', 'hour2_sin', 'hour2_cos', 'weekend')
+# Stage -> (start field, end field). The ETA of an open delivery is the sum of the stages still ahead.
+STAGES = {
+    'accept': ('created_at', 'accepted_at'),
+    'transit': ('accepted_at', 'delivered_at'),
+}
+FORMAT_VERSION = 1
+# Predictions are capped at 30 days per stage; a wild model can otherwise overflow timedelta
+MAX_LOG_SECONDS = math.log1p(30 * 24 * 3600)
+
+
+def features(distance_km, weight, moment):
+    """Feature vector for a stage starting at moment (hour of day as two harmonics)"""
+    local = timezone.localtime(moment)
+    angle = (local.hour + local.minute / 60) / 24 * math.tau
+    return [
+        1.0, distance_km, math.sqrt(distance_km), weight,
+        math.sin(angle), math.cos(angle), math.sin(2 * angle), math.cos(2 * angle),
+        1.0 if local.weekday() >= 5 else 0.0,
+    ]
+
+
+def trip_km(p_lat, p_lng, d_lat, d_lng):
+    if None in (p_lat, p_lng, d_lat, d_lng):
+        return getattr(settings, 'PARCELBEE_FALLBACK_KM', 5.0)
+    return haversine_km(float(p_lat), float(p_lng), float(d_lat), float(d_lng))
+
+
+def _solve(a, b):
+    """Solve a x = b for a small symmetric positive definite a (Gaussian elimination with pivoting)"""
+    n = len(b)
+    m = [list(map(float, a[i])) + [float(b[i])] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            continue
+        for r in range(col + 1, n):
+            factor = m[r][col] / m[col][col]
+            if factor:
+                for c in range(col, n + 1):
+                    m[r][c] -= factor * m[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        if abs(m[r][r]) >= 1e-12:
+            x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+class StageFit:
+    """
+    Streaming ridge regression on log(1 + seconds). Accumulates the normal equations and
+    per-partner sums in one pass, so history never has to fit in memory; partner offsets
+    are the partner's mean residual shrunk towards zero.
+    """
+    def __init__(self, ridge=1.0, shrinkage=20.0):
+        size = len(FEATURES)
+        self.ridge = ridge
+        self.shrinkage = shrinkage
+        self.xtx = [[0.0] * size for _ in range(size)]
+        self.xty = [0.0] * size
+        self.partners = {}  # partner_id -> [count, sum_y, sum_x]
+        self.count = 0
+        self._pending = []
+
+    def add(self, x, seconds, partner_id=None):
+        y = math.log1p(max(seconds, 0.0))
+        self._pending.append((x, y))
+        if partner_id is not None:
+            entry = self.partners.setdefault(partner_id, [0, 0.0, [0.0] * len(x)])
+            entry[0] += 1
+            entry[1] += y
+            for i, value in enumerate(x):
+                entry[2][i] += value
+        if len(self._pending) >= 5000:
+            self._flush()
+
+    def _flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        self.count += len(rows)
+        np = optional_numpy()
+        if np is not None:
+            x = np.array([row[0] for row in rows])
+            y = np.array([row[1] for row in rows])
+            xtx = x.T @ x
+            xty = x.T @ y
+            for i in range(len(self.xty)):
+                self.xty[i] += float(xty[i])
+                for j in range(len(self.xty)):
+                    self.xtx[i][j] += float(xtx[i][j])
+            return
+        for x, y in rows:
+            for i, xi in enumerate(x):
+                self.xty[i] += xi * y
+                row = self.xtx[i]
+                for j, xj in enumerate(x):
+                    row[j] += xi * xj
+
+    def solve(self):
+        self._flush()
+        a = [row[:] for row in self.xtx]
+        for i in range(1, len(a)):  # the bias is not penalised
+            a[i][i] += self.ridge
+        np = optional_numpy()
+        coef = list(np.linalg.solve(np.array(a), np.array(self.xty))) if np is not None else _solve(a, self.xty)
+        coef = [float(c) for c in coef]
+        offsets = {}
+        for partner_id, (count, sum_y, sum_x) in self.partners.items():
+            residual = sum_y - sum(c * s for c, s in zip(coef, sum_x))
+            offset = residual / (count + self.shrinkage)
+            if abs(offset) > 1e-3:
+                offsets[str(partner_id)] = round(offset, 4)
+        return {'coef': [round(c, 6) for c in coef], 'partners': offsets, 'samples': self.count}
+
+
+def iter_history(chunk_size=2000):
+    """
+    Completed deliveries from every region database. Coordinates and weights are bulk
+    loaded per region with load_coordinates; the timestamps are streamed in chunks and
+    matched to them by id (rows delivered in between the two reads are skipped).
+    """
+    for alias in delivery_databases():
+        queryset = (
+            DeliveryRequest.objects.using(alias)
+            .filter(status='delivered', accepted_at__isnull=False, delivered_at__isnull=False)
+            .order_by('id')
+        )
+        columns = load_coordinates(queryset, values=('weight',), chunk_size=chunk_size)
+        ids = columns['id'].tolist()
+        i = 0
+        rows = queryset.values_list('id', 'partner_id', 'created_at', 'accepted_at', 'delivered_at')
+        for delivery_id, partner_id, created_at, accepted_at, delivered_at in rows.iterator(chunk_size=chunk_size):
+            while i < len(ids) and ids[i] < delivery_id:
+                i += 1
+            if i == len(ids) or ids[i] != delivery_id:
+                continue
+            p_lat, p_lng, d_lat, d_lng = (
+                None if math.isnan(value) else float(value)
+                for value in (columns[field][i] for field in ('pickup_lat', 'pickup_lng', 'drop_lat', 'drop_lng'))
+            )
+            yield (delivery_id, partner_id, p_lat, p_lng, d_lat, d_lng, float(columns['weight'][i]),
+                   created_at, accepted_at, delivered_at)
+
+
+def train(holdout_every=10, chunk_size=2000):
+    """
+    Fit both stages from history. Every holdout_every-th delivery is kept out of the fit and
+    scored afterwards. Returns (model, report) where report has samples and holdout MAE in minutes.
+    """
+    fits = {stage: StageFit() for stage in STAGES}
+    holdout = []
+    for row in iter_history(chunk_size):
+        delivery_id, partner_id, p_lat, p_lng, d_lat, d_lng, weight, created_at, accepted_at, delivered_at = row
+        km = trip_km(p_lat, p_lng, d_lat, d_lng)
+        if holdout_every and delivery_id % holdout_every == 0:
+            holdout.append((km, float(weight), partner_id, created_at, accepted_at, delivered_at))
+            continue
+        fits['accept'].add(features(km, float(weight), created_at), (accepted_at - created_at).total_seconds())
+        fits['transit'].add(features(km, float(weight), accepted_at), (delivered_at - accepted_at).total_seconds(),
+                            partner_id)
+
+    model = EtaModel({stage: fit.solve() for stage, fit in fits.items()}, trained_at=timezone.now().isoformat())
+
+    errors = []
+    for km, weight, partner_id, created_at, accepted_at, delivered_at in holdout:
+        predicted = (model.predict_seconds('accept', features(km, weight, created_at))
+                     + model.predict_seconds('transit', features(km, weight, accepted_at), partner_id))
+        errors.append(abs(predicted - (delivered_at - created_at).total_seconds()) / 60)
+    report = {
+        'samples': {stage: fit.count for stage, fit in fits.items()},
+        'holdout': len(errors),
+        'holdout_mae_minutes': sum(errors) / len(errors) if errors else None,
+    }
+    return model, report
+
+
+class EtaModel:
+    """Per-stage linear models on log seconds, plus per-partner offsets for the transit stage"""
+    def __init__(self, stages, trained_at=None):
+        self.stages = stages
+        self.trained_at = trained_at
+        self._coef = {stage: data['coef'] for stage, data in stages.items()}
+        self._partners = {stage: {int(k): v for k, v in data.get('partners', {}).items()} for stage, data in stages.items()}
+
+    def predict_seconds(self, stage, x, partner_id=None):
+        z = sum(c * v for c, v in zip(self._coef[stage], x))
+        if partner_id is not None:
+            z += self._partners[stage].get(partner_id, 0.0)
+        return math.expm1(min(max(z, 0.0), MAX_LOG_SECONDS))
+
+    def predict_many(self, stage, rows, partner_ids=None):
+        """Seconds for a batch of feature rows"""
+        partner_ids = partner_ids or [None] * len(rows)
+        offsets = [self._partners[stage].get(p, 0.0) if p is not None else 0.0 for p in partner_ids]
+        np = optional_numpy()
+        if np is not None:
+            z = np.array(rows) @ np.array(self._coef[stage]) + np.array(offsets)
+            return np.expm1(np.clip(z, 0.0, MAX_LOG_SECONDS)).tolist()
+        coef = self._coef[stage]
+        return [math.expm1(min(max(sum(c * v for c, v in zip(coef, x)) + offset, 0.0), MAX_LOG_SECONDS))
+                for x, offset in zip(rows, offsets)]
+
+    def estimate(self, delivery, now=None):
+        """Expected delivered_at for an open delivery, from fields already on the instance; None when closed"""
+        if delivery.status not in ('pending', 'accepted', 'in_transit'):
+            return None
+        now = now or timezone.now()
+        km = trip_km(delivery.pickup_lat, delivery.pickup_lng, delivery.drop_lat, delivery.drop_lng)
+        weight = float(delivery.weight)
+        if delivery.status == 'pending' or delivery.accepted_at is None:
+            accepted = delivery.created_at + timedelta(seconds=self.predict_seconds('accept', features(km, weight, delivery.created_at)))
+            accepted = max(accepted, now)
+            partner_id = None
+        else:
+            accepted = delivery.accepted_at
+            partner_id = delivery.partner_id
+        transit = self.predict_seconds('transit', features(km, weight, accepted), partner_id)
+        return max(accepted + timedelta(seconds=transit), now)
+
+    def to_dict(self):
+        return {'version': FORMAT_VERSION, 'features': FEATURES, 'trained_at': self.trained_at, 'stages': self.stages}
+
+    def save(self, path):
+        Path(path).write_text(json.dumps(self.to_dict(), separators=(',', ':')), encoding='utf-8')
+
+    @classmethod
+    def load(cls, path):
+        data = json.loads(Path(path).read_text(encoding='utf-8'))
+        if data.get('version') != FORMAT_VERSION or tuple(data.get('features', ())) != FEATURES:
+            raise ValueError(f'{path} was trained with a different feature set; retrain it')
+        return cls(data['stages'], trained_at=data.get('trained_at'))
+
+
+def model_path():
+    return Path(getattr(settings, 'PARCELBEE_ETA_MODEL', settings.BASE_DIR / 'eta_model.json'))
+
+
+_model = None
+_model_lock = threading.Lock()
+_model_missing = False
+
+
+def get_model():
+    """The trained model, loaded once per worker; None until train_eta_model has been run"""
+    global _model, _model_missing
+    if _model is not None or _model_missing:
+        return _model
+    with _model_lock:
+        if _model is None and not _model_missing:
+            try:
+                _model = EtaModel.load(model_path())
+            except FileNotFoundError:
+                _model_missing = True
+            except (OSError, ValueError, KeyError):
+                logger.exception('Could not load ETA model %s', model_path())
+                _model_missing = True
+    return _model
+
+
+def estimated_delivery(delivery):
+    """
+    ISO timestamp of the expected delivery, or None without a model or for closed deliveries.
+    Also None when scoring fails: the ETA is an extra on the detail response, never a reason to fail it.
+    """
+    model = get_model()
+    if model is None:
+        return None
+    try:
+        eta = model.estimate(delivery)
+    except Exception:
+        logger.exception('Could not estimate delivery #%s', delivery.id)
+        return None
+    return eta.isoformat() if eta else None
@@ -0,0 +1,141 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from core.models import DeliveryEvent, DeliveryRequest
+from core.sharding import database_for_delivery, databases_for_deliveries, delivery_databases
+
+
+# Events are stamped with the delivery's own timestamps, give or take the time between
+# taking them and saving the row
+LOG_CLOCK_SLACK = timedelta(seconds=1)
+
+
+def _coordinate(value):
+    if value in (None, ''):
+        return None
+    return round(float(value), 6)
+
+
+def build_event(delivery, status, actor=None, lat=None, lng=None, at=None):
+    return DeliveryEvent(
+        delivery_id=delivery.id if isinstance(delivery, DeliveryRequest) else delivery,
+        status=status,
+        actor_id=actor.id if actor is not None else None,
+        lat=_coordinate(lat),
+        lng=_coordinate(lng),
+        created_at=at or timezone.now(),
+    )
+
+
+def record_event(delivery, status, actor=None, lat=None, lng=None, at=None):
+    """
+    Write one status event to the delivery's database. Call it inside the transaction that
+    changes the delivery so the event commits, or rolls back, with the change.
+    """
+    record_events([build_event(delivery, status, actor, lat, lng, at)],
+                  using=delivery._state.db if isinstance(delivery, DeliveryRequest) else None)
+
+
+def record_events(events, using=None):
+    """Write events built with build_event; using is their deliveries' database if known"""
+    if not events:
+        return
+    if using is not None:
+        DeliveryEvent.objects.using(using).bulk_create(events)
+        return
+    # Events are stored in the same region database as their delivery
+    located = databases_for_deliveries(list({event.delivery_id for event in events}))
+    database = {delivery_id: alias for alias, ids in located.items() for delivery_id in ids}
+    by_database = {}
+    for event in events:
+        by_database.setdefault(database[event.delivery_id], []).append(event)
+    for alias, batch in by_database.items():
+        DeliveryEvent.objects.using(alias).bulk_create(batch)
+
+
+def delivery_history(delivery_id, using=None):
+    """Status history for one delivery, oldest first; using is the delivery's database if known"""
+    return list(
+        DeliveryEvent.objects.using(using or database_for_delivery(delivery_id)).filter(delivery_id=delivery_id)
+        .values_list('status', 'actor_id', 'lat', 'lng', 'created_at')
+    )
+
+
+def replay_state(events):
+    """
+    Fold (status, actor_id, created_at) events into the delivery's current state.
+    Returns a dict with status, partner_id, accepted_at, delivered_at and last_event_at.
+    """
+    state = {'status': 'pending', 'partner_id': None, 'accepted_at': None, 'delivered_at': None,
+             'last_event_at': None}
+    for status, actor_id, created_at in events:
+        state['status'] = status
+        state['last_event_at'] = created_at
+        if status == 'accepted' and state['accepted_at'] is None:
+            state['accepted_at'] = created_at
+            state['partner_id'] = actor_id
+        elif status == 'delivered':
+            state['delivered_at'] = created_at
+    return state
+
+
+def _apply_states(states, apply, using='default', skipped=None):
+    """
+    Compare replayed states with stored rows and bulk_update the ones that drifted.
+    A row modified after the last event the log holds for it was changed by a write the
+    log never saw (the admin, or events lost before they were written transactionally);
+    it is left alone and its id added to skipped instead.
+    """
+    fields = ['status', 'partner_id', 'accepted_at', 'delivered_at']
+    stored = DeliveryRequest.objects.using(using).only('id', 'updated_at', *fields).in_bulk(list(states))
+    changed = []
+    for delivery_id, state in states.items():
+        delivery = stored.get(delivery_id)
+        if delivery is None:
+            continue
+        if any(getattr(delivery, field) != state[field] for field in fields):
+            if delivery.updated_at > state['last_event_at'] + LOG_CLOCK_SLACK:
+                if skipped is not None:
+                    skipped.append(delivery_id)
+                continue
+            for field in fields:
+                setattr(delivery, field, state[field])
+            changed.append(delivery)
+    if apply and changed:
+        DeliveryRequest.objects.using(using).bulk_update(changed, fields, batch_size=500)
+    return [delivery.id for delivery in changed]
+
+
+def rebuild_state(delivery_ids=None, chunk_size=2000, apply=True, skipped=None):
+    """
+    Rebuild DeliveryRequest status columns from the event log.
+    Events are streamed in delivery order and compared against stored rows a chunk at a time,
+    one region database after another. Rows changed after their last logged event are never
+    overwritten; their ids go to skipped when a list is given.
+    Returns the ids of deliveries whose stored state disagreed with the log.
+    """
+    changed = []
+    for alias in delivery_databases():
+        events = DeliveryEvent.objects.using(alias).order_by('delivery_id', 'created_at', 'id')
+        if delivery_ids is not None:
+            events = events.filter(delivery_id__in=delivery_ids)
+        rows = events.values_list('delivery_id', 'status', 'actor_id', 'created_at').iterator(chunk_size=chunk_size)
+
+        states = {}
+        current_id, history = None, []
+        for delivery_id, status, actor_id, created_at in rows:
+            if delivery_id != current_id and history:
+                states[current_id] = replay_state(history)
+                history = []
+                if len(states) >= chunk_size:
+                    changed.extend(_apply_states(states, apply, alias, skipped))
+                    states = {}
+            current_id = delivery_id
+            history.append((status, actor_id, created_at))
+        if history:
+            states[current_id] = replay_state(history)
+        if states:
+            changed.extend(_apply_states(states, apply, alias, skipped))
+
+    return changed
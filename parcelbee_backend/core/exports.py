@@ -0,0 +1,145 @@
+import csv
+import heapq
+import itertools
+import json
+from datetime import datetime, time
+
+from django.utils import timezone
+
+from core.models import DeliveryRequest, User
+from core.sharding import delivery_databases
+
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+EXPORT_COLUMNS = (
+    'id',
+    'customer_id',
+    'customer__name',
+    'partner_id',
+    'partner__name',
+    'pickup_address',
+    'pickup_lat',
+    'pickup_lng',
+    'drop_address',
+    'drop_lat',
+    'drop_lng',
+    'description',
+    'weight',
+    'estimated_price',
+    'status',
+    'created_at',
+    'updated_at',
+    'accepted_at',
+    'delivered_at',
+)
+
+# Columns stored in the delivery row itself, readable from any region database
+LOCAL_COLUMNS = tuple(column for column in EXPORT_COLUMNS if '__' not in column)
+
+# Header names used in the exported file (customer__name -> customer_name)
+EXPORT_HEADERS = tuple(column.replace('__', '_') for column in EXPORT_COLUMNS)
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object that returns what is written, for streaming csv.writer output"""
+    def write(self, value):
+        return value
+
+
+def _parse_date(value, end_of_day=False):
+    """Parse YYYY-MM-DD into an aware datetime at the start (or end) of that day"""
+    day = datetime.strptime(value, '%Y-%m-%d').date()
+    moment = datetime.combine(day, time.max if end_of_day else time.min)
+    return timezone.make_aware(moment)
+
+
+def filter_deliveries(status=None, date_from=None, date_to=None, partner=None):
+    """
+    Build the export queryset. Dates are YYYY-MM-DD strings matched against created_at.
+    Raises ValueError on malformed filters.
+    """
+    deliveries = DeliveryRequest.objects.all()
+
+    if status:
+        valid_statuses = [choice[0] for choice in DeliveryRequest.STATUS_CHOICES]
+        statuses = [s.strip() for s in status.split(',') if s.strip()]
+        for s in statuses:
+            if s not in valid_statuses:
+                raise ValueError(f'Invalid status: {s}')
+        deliveries = deliveries.filter(status__in=statuses)
+
+    if date_from:
+        deliveries = deliveries.filter(created_at__gte=_parse_date(date_from))
+    if date_to:
+        deliveries = deliveries.filter(created_at__lte=_parse_date(date_to, end_of_day=True))
+
+    if partner:
+        try:
+            deliveries = deliveries.filter(partner_id=int(partner))
+        except (TypeError, ValueError):
+            raise ValueError('partner must be a user id')
+
+    # Ordering by primary key lets the database walk the index instead of sorting
+    return deliveries.order_by('id')
+
+
+def _iter_shard_rows(queryset, chunk_size):
+    """Export rows from one region database; user names come from 'default' a chunk at a time"""
+    rows = queryset.values_list(*LOCAL_COLUMNS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = [dict(zip(LOCAL_COLUMNS, row)) for row in itertools.islice(rows, chunk_size)]
+        if not chunk:
+            return
+        user_ids = {row['customer_id'] for row in chunk} | {row['partner_id'] for row in chunk if row['partner_id']}
+        names = dict(User.objects.filter(id__in=user_ids).values_list('id', 'name'))
+        for row in chunk:
+            row['customer__name'] = names.get(row['customer_id'])
+            row['partner__name'] = names.get(row['partner_id'])
+            yield tuple(row[column] for column in EXPORT_COLUMNS)
+
+
+def iter_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield export rows as tuples, fetched through a server-side cursor in chunks.
+    With region sharding every database is read and the rows merged in id order.
+    """
+    databases = delivery_databases()
+    if len(databases) == 1:
+        return queryset.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+    return heapq.merge(*(_iter_shard_rows(queryset.using(alias), chunk_size) for alias in databases))
+
+
+def _format_value(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (int, str)):
+        return value
+    # Decimal columns
+    return float(value)
+
+
+def iter_csv(rows):
+    """Encode rows as CSV lines, header first"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_HEADERS)
+    for row in rows:
+        yield writer.writerow(['' if v is None else v for v in map(_format_value, row)])
+
+
+def iter_ndjson(rows):
+    """Encode rows as newline-delimited JSON objects"""
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_HEADERS, map(_format_value, row)))) + '\n'
+
+
+def stream_deliveries(queryset, export_format='csv', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Generator pipeline: queryset -> chunked rows -> encoded lines"""
+    rows = iter_rows(queryset, chunk_size=chunk_size)
+    if export_format == 'ndjson':
+        return iter_ndjson(rows)
+    return iter_csv(rows)
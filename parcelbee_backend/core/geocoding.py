@@ -0,0 +1,140 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from core.models import DeliveryRequest, GeocodedAddress
+from core.sharding import delivery_databases
+
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_FIELDS = ['pickup_lat', 'pickup_lng', 'drop_lat', 'drop_lng']
+
+
+def normalize_address(address):
+    return ' '.join(address.lower().split())
+
+
+def get_geocoder():
+    """Callable address -> (lat, lng), configurable through PARCELBEE_GEOCODER"""
+    return import_string(getattr(settings, 'PARCELBEE_GEOCODER', 'core.utils.geocode_nominatim'))
+
+
+class RateLimiter:
+    """Blocks so that calls are at least 1 / rate seconds apart (Nominatim allows 1 per second)"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+def missing_coordinates(using='default'):
+    """Deliveries where either end has no coordinates"""
+    return DeliveryRequest.objects.using(using).filter(
+        Q(pickup_lat__isnull=True) | Q(pickup_lng__isnull=True) |
+        Q(drop_lat__isnull=True) | Q(drop_lng__isnull=True)
+    )
+
+
+def resolve_addresses(addresses, geocoder, limiter, max_attempts=3):
+    """
+    Map normalized address -> (lat, lng) or None, geocoding only what the cache lacks.
+    Each result is saved as soon as it arrives so a crash loses at most one lookup.
+    """
+    cached = {row.address: row for row in GeocodedAddress.objects.filter(address__in=addresses)}
+    results = {}
+    for address in addresses:
+        row = cached.get(address)
+        if row is not None and (row.status == 'ok' or row.attempts >= max_attempts):
+            results[address] = (row.lat, row.lng) if row.status == 'ok' else None
+            continue
+
+        limiter.wait()
+        try:
+            lat, lng = geocoder(address)
+            values = {'lat': round(lat, 6), 'lng': round(lng, 6), 'status': 'ok', 'error': ''}
+            results[address] = (values['lat'], values['lng'])
+        except Exception as e:
+            values = {'lat': None, 'lng': None, 'status': 'failed', 'error': str(e)[:500]}
+            results[address] = None
+            logger.warning('Geocoding failed for %r: %s', address, e)
+
+        if row is None:
+            GeocodedAddress.objects.create(address=address, **values)
+        else:
+            for field, value in values.items():
+                setattr(row, field, value)
+            row.attempts += 1
+            row.save(update_fields=list(values) + ['attempts', 'updated_at'])
+    return results
+
+
+def _missing_batches(batch_size, limit):
+    """Batches of deliveries lacking coordinates, in id order, one region database after another"""
+    seen = 0
+    for alias in delivery_databases():
+        last_id = 0
+        while limit is None or seen < limit:
+            size = batch_size if limit is None else min(batch_size, limit - seen)
+            batch = list(
+                missing_coordinates(alias).filter(id__gt=last_id).order_by('id')
+                .only('id', 'pickup_address', 'drop_address', *COORDINATE_FIELDS)[:size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            seen += len(batch)
+            yield alias, batch
+
+
+def geocode_missing(batch_size=100, limit=None, rate=None, max_attempts=3, geocoder=None):
+    """
+    Fill in missing delivery coordinates. Deliveries are walked in id order in batches;
+    the unique addresses of each batch are geocoded and written back with bulk_update.
+    Returns (deliveries_updated, addresses_unresolved).
+    """
+    geocoder = geocoder or get_geocoder()
+    limiter = RateLimiter(rate if rate is not None else getattr(settings, 'PARCELBEE_GEOCODE_RATE', 1.0))
+
+    updated = 0
+    unresolved = set()
+    for alias, batch in _missing_batches(batch_size, limit):
+        addresses = set()
+        for delivery in batch:
+            if delivery.pickup_lat is None or delivery.pickup_lng is None:
+                addresses.add(normalize_address(delivery.pickup_address))
+            if delivery.drop_lat is None or delivery.drop_lng is None:
+                addresses.add(normalize_address(delivery.drop_address))
+        resolved = resolve_addresses(sorted(addresses), geocoder, limiter, max_attempts)
+
+        changed = []
+        for delivery in batch:
+            touched = False
+            for end in ('pickup', 'drop'):
+                if getattr(delivery, f'{end}_lat') is not None and getattr(delivery, f'{end}_lng') is not None:
+                    continue
+                address = normalize_address(getattr(delivery, f'{end}_address'))
+                coordinates = resolved.get(address)
+                if coordinates is None:
+                    unresolved.add(address)
+                    continue
+                setattr(delivery, f'{end}_lat', coordinates[0])
+                setattr(delivery, f'{end}_lng', coordinates[1])
+                touched = True
+            if touched:
+                changed.append(delivery)
+
+        if changed:
+            DeliveryRequest.objects.using(alias).bulk_update(changed, COORDINATE_FIELDS)
+            updated += len(changed)
+
+    return updated, len(unresolved)
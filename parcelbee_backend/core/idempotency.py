@@ -0,0 +1,143 @@
+import hashlib
+import threading
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from core.models import IdempotencyKey
+from core.utils import json_response
+
+
+HEADER = 'Idempotency-Key'
+
+
+def _fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(b'\0')
+    digest.update(request.path.encode())
+    digest.update(b'\0')
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = HttpResponse(
+        bytes(record.response_body or b''),
+        status=record.response_status,
+        content_type=record.response_content_type or 'application/json',
+    )
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def lock_seconds():
+    return getattr(settings, 'PARCELBEE_IDEMPOTENCY_LOCK_SECONDS', 60)
+
+
+def _claim(user, key, fingerprint, ttl):
+    """
+    Insert an in-progress record for (user, key). Returns (record, created);
+    expired and abandoned records are replaced as if they never existed.
+    """
+    now = timezone.now()
+    lock_timeout = lock_seconds()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint,
+                    created_at=now, locked_at=now, expires_at=now + timedelta(seconds=ttl)
+                ), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:
+                continue
+            # A request that crashed its worker leaves an in-progress record behind; a live one keeps
+            # refreshing locked_at (see _hold_lock), and the delete only wins if it has not since
+            abandoned = record.in_progress and record.locked_at <= now - timedelta(seconds=lock_timeout)
+            if record.expires_at > now and not abandoned:
+                return record, False
+            IdempotencyKey.objects.filter(id=record.id, locked_at=record.locked_at).delete()
+    return IdempotencyKey.objects.get(user=user, key=key), False
+
+
+def _refresh_lock(record_id):
+    return IdempotencyKey.objects.filter(id=record_id, in_progress=True).update(locked_at=timezone.now())
+
+
+def _hold_lock(record_id, stop, interval):
+    """Refresh the record's lock every interval until stop is set, so a slow request keeps its key"""
+    try:
+        while not stop.wait(interval):
+            _refresh_lock(record_id)
+    finally:
+        connection.close()
+
+
+def idempotent(view_func):
+    """
+    Honour the Idempotency-Key header on a view behind auth_required.
+    The first request runs the view and stores its response bytes; repeats with the same key
+    replay them without running the view. A repeat that arrives while the first is still
+    running gets 409 (however long it runs: the lock is refreshed meanwhile), and reusing a
+    key for a different request gets 422.
+    Server errors are not stored so the client can retry them.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_func(request, *args, **kwargs)
+        if len(key) > 255:
+            return json_response({'error': f'{HEADER} must be at most 255 characters'}, status=400)
+
+        ttl = getattr(settings, 'PARCELBEE_IDEMPOTENCY_TTL_SECONDS', 24 * 3600)
+        fingerprint = _fingerprint(request)
+        record, created = _claim(request.user, key, fingerprint, ttl)
+
+        if not created:
+            if record.fingerprint != fingerprint:
+                return json_response({'error': f'{HEADER} was already used for a different request'}, status=422)
+            if record.in_progress:
+                response = json_response({'error': 'A request with this key is still being processed'}, status=409)
+                response['Retry-After'] = '1'
+                return response
+            return _replay(record)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_hold_lock, args=(record.id, stop, lock_seconds() / 3),
+                                     name=f'idempotency-lock-{record.id}', daemon=True)
+        heartbeat.start()
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if response.status_code >= 500 or getattr(response, 'streaming', False):
+            record.delete()
+            return response
+
+        # A request whose key was taken over after all finds its record gone and stores nothing
+        IdempotencyKey.objects.filter(id=record.id).update(
+            in_progress=False,
+            response_status=response.status_code,
+            response_content_type=response.get('Content-Type', ''),
+            response_body=response.content,
+        )
+        return response
+    return wrapper
+
+
+def purge_expired():
+    """Delete records past their TTL"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,134 @@
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import PartnerLocation
+
+
+class LocationStore:
+    """
+    Latest known position per partner, kept in parallel typed arrays.
+    Each partner owns one slot; a dict maps partner id -> slot index.
+    Positions are persisted at most once per persist_interval seconds per partner.
+    """
+    def __init__(self, persist_interval=30.0):
+        self.persist_interval = persist_interval
+        self._slots = {}
+        self._partner_ids = array('q')
+        self._lat = array('d')
+        self._lng = array('d')
+        self._ts = array('d')          # fix time, unix seconds
+        self._persisted_ts = array('d')  # fix time of the last persisted sample
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _slot(self, partner_id):
+        slot = self._slots.get(partner_id)
+        if slot is None:
+            slot = len(self._partner_ids)
+            self._slots[partner_id] = slot
+            self._partner_ids.append(partner_id)
+            self._lat.append(0.0)
+            self._lng.append(0.0)
+            self._ts.append(0.0)
+            self._persisted_ts.append(0.0)
+        return slot
+
+    def update(self, partner_id, lat, lng, ts):
+        """Record a fix; older fixes than the stored one are ignored. Returns True if stored."""
+        with self._lock:
+            slot = self._slot(partner_id)
+            if ts < self._ts[slot]:
+                return False
+            self._lat[slot] = lat
+            self._lng[slot] = lng
+            self._ts[slot] = ts
+        return True
+
+    def get(self, partner_id):
+        """(lat, lng, ts) of the partner's latest fix, or None"""
+        slot = self._slots.get(partner_id)
+        if slot is None or self._ts[slot] == 0.0:
+            return None
+        return self._lat[slot], self._lng[slot], self._ts[slot]
+
+    def flush_due(self):
+        return time.monotonic() - self._last_flush >= self.persist_interval
+
+    def collect_samples(self):
+        """Positions that moved on since their last persisted sample by at least persist_interval"""
+        samples = []
+        with self._lock:
+            self._last_flush = time.monotonic()
+            for partner_id, slot in self._slots.items():
+                ts = self._ts[slot]
+                if ts and ts - self._persisted_ts[slot] >= self.persist_interval:
+                    samples.append((partner_id, self._lat[slot], self._lng[slot], ts))
+                    self._persisted_ts[slot] = ts
+        return samples
+
+    def __len__(self):
+        return len(self._slots)
+
+
+store = LocationStore(persist_interval=getattr(settings, 'PARCELBEE_LOCATION_PERSIST_SECONDS', 30.0))
+
+
+def _to_datetime(ts):
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+
+
+def persist_locations():
+    """Write the downsampled positions to partner_locations with one bulk insert"""
+    samples = store.collect_samples()
+    if samples:
+        PartnerLocation.objects.bulk_create([
+            PartnerLocation(partner_id=partner_id, lat=round(lat, 6), lng=round(lng, 6), recorded_at=_to_datetime(ts))
+            for partner_id, lat, lng, ts in samples
+        ], batch_size=500)
+    return len(samples)
+
+
+def ingest_fixes(partner_id, fixes):
+    """
+    Apply a batch of (lat, lng, ts) fixes for one partner.
+    Only the newest fix reaches the store; persistence piggybacks on ingestion when due.
+    """
+    if not fixes:
+        return 0
+    lat, lng, ts = max(fixes, key=lambda fix: fix[2])
+    store.update(partner_id, lat, lng, ts)
+    if store.flush_due():
+        persist_locations()
+    return len(fixes)
+
+
+def latest_location(partner_id):
+    """
+    Latest known position as a dict: this worker's in-memory fix, unless another worker
+    has since persisted a newer sample for the partner.
+    """
+    sample = (PartnerLocation.objects.filter(partner_id=partner_id)
+              .values_list('lat', 'lng', 'recorded_at').first())
+    position = store.get(partner_id)
+    if position is not None:
+        lat, lng, ts = position
+        if sample is None or _to_datetime(ts) >= sample[2]:
+            return {'lat': lat, 'lng': lng, 'recorded_at': _to_datetime(ts).isoformat(), 'source': 'live'}
+
+    if sample is None:
+        return None
+    lat, lng, recorded_at = sample
+    return {'lat': float(lat), 'lng': float(lng), 'recorded_at': recorded_at.isoformat(), 'source': 'persisted'}
+
+
+def purge_expired(days=None):
+    """Delete persisted samples older than PARCELBEE_LOCATION_RETENTION_DAYS"""
+    days = days if days is not None else getattr(settings, 'PARCELBEE_LOCATION_RETENTION_DAYS', 30)
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = PartnerLocation.objects.filter(recorded_at__lt=cutoff).delete()
+    return deleted
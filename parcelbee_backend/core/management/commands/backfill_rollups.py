@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily delivery rollups from delivery history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Last day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date() if options['date_from'] else None
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date() if options['date_to'] else None
+        except ValueError:
+            raise CommandError('Dates must be YYYY-MM-DD')
+
+        scanned, written = rebuild_rollups(date_from, date_to, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Scanned {scanned} deliveries, wrote {written} rollup rows'))
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.consolidation import PendingJobs, cluster
+
+
+class Command(BaseCommand):
+    help = 'Time the clustering pass on synthetic pending deliveries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=50_000)
+        parser.add_argument('--hotspots', type=int, default=200, help='Pickup clusters (shops, warehouses)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # A city roughly 40 km across
+        centre_lat, centre_lng = 12.97, 77.59
+        hotspots = [(centre_lat + rng.uniform(-0.18, 0.18), centre_lng + rng.uniform(-0.18, 0.18))
+                    for _ in range(options['hotspots'])]
+
+        jobs = PendingJobs()
+        for n in range(options['jobs']):
+            if rng.random() < 0.7:
+                base_lat, base_lng = rng.choice(hotspots)
+                p_lat, p_lng = base_lat + rng.gauss(0, 0.004), base_lng + rng.gauss(0, 0.004)
+            else:
+                p_lat, p_lng = centre_lat + rng.uniform(-0.18, 0.18), centre_lng + rng.uniform(-0.18, 0.18)
+            d_lat, d_lng = centre_lat + rng.uniform(-0.18, 0.18), centre_lng + rng.uniform(-0.18, 0.18)
+            weight = min(rng.lognormvariate(0.7, 0.8), 40.0)
+            jobs.append(n, p_lat, p_lng, d_lat, d_lng, weight, 100.0)
+
+        max_weight = getattr(settings, 'PARCELBEE_TRIP_MAX_WEIGHT', 20.0)
+        max_parcels = getattr(settings, 'PARCELBEE_TRIP_MAX_PARCELS', 8)
+        cell_deg = getattr(settings, 'PARCELBEE_TRIP_CELL_DEG', 0.01)
+        sectors = getattr(settings, 'PARCELBEE_TRIP_SECTORS', 8)
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            trips = cluster(jobs, max_weight, max_parcels, cell_deg, sectors)
+            timings.append(time.perf_counter() - started)
+
+        consolidated = sum(len(trip) for trip in trips)
+        heaviest = max((sum(jobs.weight[i] for i in trip) for trip in trips), default=0)
+        total_trips = len(trips) + len(jobs) - consolidated
+        self.stdout.write(f'{len(jobs)} pending jobs clustered in {min(timings) * 1000:.0f} ms (best of {len(timings)})')
+        self.stdout.write(f'{len(trips)} trips covering {consolidated} jobs '
+                          f'({consolidated / max(len(trips), 1):.2f} parcels per trip, heaviest {heaviest:.1f} kg)')
+        self.stdout.write(f'Trips needed: {total_trips} instead of {len(jobs)} '
+                          f'({total_trips / len(jobs):.2f} trips per parcel)')
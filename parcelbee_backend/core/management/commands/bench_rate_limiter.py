@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.urls import resolve
+
+from core.ratelimit import RateLimitMiddleware
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of RateLimitMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200_000)
+        parser.add_argument('--clients', type=int, default=1000, help='Distinct client IPs')
+        parser.add_argument('--path', default='/api/login/', help='Route to benchmark (should have a rule)')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        # Effectively unlimited so every request takes the full counting path
+        middleware.rules = {name: [dict(rule, limit=10 ** 12) for rule in rules]
+                            for name, rules in middleware.rules.items()}
+
+        match = resolve(options['path'])
+        requests = []
+        for n in range(options['clients']):
+            request = factory.post(options['path'], REMOTE_ADDR=f'10.0.{n // 256}.{n % 256}')
+            request.resolver_match = match
+            requests.append(request)
+
+        total = options['requests']
+        count = len(requests)
+        process_view = middleware.process_view
+
+        started = time.perf_counter()
+        for i in range(total):
+            requests[i % count]
+        baseline = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for i in range(total):
+            process_view(requests[i % count], None, (), {})
+        elapsed = time.perf_counter() - started - baseline
+
+        per_request_us = elapsed / total * 1e6
+        self.stdout.write(f'{total} requests, {count} clients, route {match.url_name}: '
+                          f'{per_request_us:.2f} us per request')
+        if per_request_us < 50:
+            self.stdout.write(self.style.SUCCESS('Within the 50 us budget'))
+        else:
+            self.stdout.write(self.style.ERROR('Over the 50 us budget'))
@@ -0,0 +1,74 @@
+import time
+
+import jwt
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from core.models import User
+from core.tokens import cache, token_digest
+from core.utils import authenticate_request, decode_jwt, generate_jwt
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the per-request cost of token authentication: full HS256 verification against '
+        'the verified-token cache and revocation check, alone and inside authenticate_request '
+        '(which adds the user lookup). Runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100_000)
+        parser.add_argument('--tokens', type=int, default=1000, help='Distinct tokens cycled through')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user(email='bench-token-auth@bench.invalid', password=None,
+                                            name='Token bench', role='customer')
+            self.run(user, options['requests'], options['tokens'])
+            transaction.set_rollback(True)
+        cache.clear()
+
+    def time_per_call(self, func, args, total):
+        count = len(args)
+        started = time.perf_counter()
+        for i in range(total):
+            args[i % count]
+        baseline = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for i in range(total):
+            func(args[i % count])
+        return (time.perf_counter() - started - baseline) / total * 1e6
+
+    def run(self, user, total, count):
+        tokens = [generate_jwt(user) for _ in range(count)]
+        secret = settings.SECRET_KEY
+
+        verify_us = self.time_per_call(lambda token: jwt.decode(token, secret, algorithms=['HS256']), tokens, total)
+        digest_us = self.time_per_call(token_digest, tokens, total)
+        cache.clear()
+        for token in tokens:
+            decode_jwt(token)
+        cached_us = self.time_per_call(decode_jwt, tokens, total)
+
+        factory = RequestFactory()
+        requests = [factory.get('/api/delivery/list/', HTTP_AUTHORIZATION=f'Bearer {token}') for token in tokens]
+        # The user query dominates here; fewer rounds keep the run short
+        rounds = max(total // 10, count)
+        cached_request_us = self.time_per_call(authenticate_request, requests, rounds)
+        max_entries, cache.max_entries = cache.max_entries, 0
+        cache.clear()
+        try:
+            uncached_request_us = self.time_per_call(authenticate_request, requests, rounds)
+        finally:
+            cache.max_entries = max_entries
+
+        self.stdout.write(f'{total} calls over {count} tokens')
+        self.stdout.write(f'  jwt.decode (HS256 + JSON)           {verify_us:8.2f} us')
+        self.stdout.write(f'  token digest                        {digest_us:8.2f} us')
+        self.stdout.write(f'  decode_jwt, cached + revocation     {cached_us:8.2f} us  ({verify_us / cached_us:.1f}x)')
+        self.stdout.write(f'  authenticate_request, uncached      {uncached_request_us:8.2f} us')
+        self.stdout.write(f'  authenticate_request, cached        {cached_request_us:8.2f} us  '
+                          f'(saves {uncached_request_us - cached_request_us:.2f} us per request)')
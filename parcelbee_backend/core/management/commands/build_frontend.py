@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.assets import build, build_dir, source_dir
+
+
+class Command(BaseCommand):
+    help = 'Minify, fingerprint and precompress the frontend into PARCELBEE_FRONTEND_BUILD'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='Frontend source directory (default PARCELBEE_FRONTEND_SRC)')
+        parser.add_argument('--output', help='Build directory (default PARCELBEE_FRONTEND_BUILD)')
+
+    def handle(self, *args, **options):
+        source = options['source'] or source_dir()
+        output = options['output'] or build_dir()
+        manifest = build(source, output)
+        for original, hashed in sorted(manifest.items()):
+            self.stdout.write(f'  {original} -> {hashed}')
+        self.stdout.write(self.style.SUCCESS(f'Built {len(manifest)} assets into {output}'))
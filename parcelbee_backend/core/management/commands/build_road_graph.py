@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.roads import RoadGraph
+
+
+class Command(BaseCommand):
+    help = 'Compile a CSV road edge list into the graph file PARCELBEE_ROAD_GRAPH points at'
+
+    def add_arguments(self, parser):
+        parser.add_argument('edges', help='CSV with header u,v,u_lat,u_lng,v_lat,v_lng[,length_m][,oneway]')
+        parser.add_argument('output', help='Compiled graph file to write')
+        parser.add_argument('--landmarks', type=int, default=16, help='ALT landmarks to precompute')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--check', type=int, default=0, help='Time this many random point-to-point queries')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            graph = RoadGraph.from_edge_list(options['edges'], landmarks=options['landmarks'], seed=options['seed'])
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f'Could not read {options["edges"]}: {e}')
+        graph.save(options['output'])
+        edges = len(graph.forward[1])
+        self.stdout.write(
+            f'{graph.node_count} nodes, {edges} directed edges, {len(graph.landmarks)} landmarks '
+            f'in {time.perf_counter() - started:.1f}s -> {options["output"]}'
+        )
+
+        if options['check'] and graph.node_count:
+            import random
+            rng = random.Random(options['seed'])
+            pairs = [(rng.randrange(graph.node_count), rng.randrange(graph.node_count)) for _ in range(options['check'])]
+            started = time.perf_counter()
+            reachable = sum(graph.node_distance(s, t) != float('inf') for s, t in pairs)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{len(pairs)} queries, {reachable} reachable, {elapsed / len(pairs) * 1000:.2f}ms each')
@@ -0,0 +1,350 @@
+import itertools
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+import zlib
+from contextlib import ExitStack
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+
+from core import urls as core_urls
+from core.consolidation import consolidate
+from core.events import build_event, record_events
+from core.locations import ingest_fixes
+from core.models import DeliveryRequest, Trip, User
+from core.tokens import revocations
+from core.utils import generate_jwt, generate_reset_token_payload
+
+
+PASSWORD = 'budget-pass-1'
+_numbers = itertools.count()
+CENTRE = (12.97, 77.59)
+STATUSES = ('pending', 'pending', 'accepted', 'in_transit', 'delivered')
+
+
+def fake_geocode(address):
+    """Deterministic stand-in for Nominatim so pricing is measured without the network"""
+    h = zlib.crc32(address.encode())
+    return CENTRE[0] + (h % 1000) / 20000, CENTRE[1] + (h // 1000 % 1000) / 20000
+
+
+class Dataset:
+    """Users, `size` deliveries spread over the lifecycle, their events, a partner fix and trip offers"""
+    def __init__(self, size):
+        self.size = size
+        self.customer = User.objects.create_user(email='customer@budget.invalid', password=PASSWORD,
+                                                 name='Budget Customer', role='customer')
+        self.partner = User.objects.create_user(email='partner@budget.invalid', password=PASSWORD,
+                                                name='Budget Partner', role='partner')
+        self.admin = User.objects.create_user(email='admin@budget.invalid', password=PASSWORD,
+                                              name='Budget Admin', role='admin')
+        self.staff = User.objects.create_superuser(email='staff@budget.invalid', password=PASSWORD, name='Budget Staff')
+        others = [User.objects.create_user(email=f'customer{n}@budget.invalid', password=None,
+                                           name=f'Customer {n}', role='customer') for n in range(5)]
+        self.tokens = {user.role: generate_jwt(user) for user in (self.customer, self.partner, self.admin)}
+        self.counter = 0
+
+        events = []
+        for n in range(size):
+            status = STATUSES[n % len(STATUSES)]
+            customer = self.customer if n % 2 == 0 else others[n % len(others)]
+            delivery = self.delivery(customer, status)
+            events.append(build_event(delivery, 'pending', actor=customer))
+            if status != 'pending':
+                events.append(build_event(delivery, status, actor=self.partner))
+        record_events(events)
+        self.shown = self.delivery(self.customer, 'in_transit')
+        record_events([build_event(self.shown, 'pending', actor=self.customer),
+                       build_event(self.shown, 'in_transit', actor=self.partner)])
+        ingest_fixes(self.partner.id, [(CENTRE[0], CENTRE[1], time.time())])
+        consolidate()
+
+    def delivery(self, customer, status='pending'):
+        self.counter += 1
+        n = self.counter
+        taken = status != 'pending'
+        return DeliveryRequest.objects.create(
+            customer=customer, partner=self.partner if taken else None, status=status,
+            pickup_address=f'{n} Budget Road', drop_address=f'{n} Limit Street',
+            description=f'Budget parcel {n}', weight=1 + n % 7, estimated_price=100 + n % 50,
+            pickup_lat=CENTRE[0] + (n % 11) * 0.0003, pickup_lng=CENTRE[1] + (n % 13) * 0.0003,
+            drop_lat=CENTRE[0] + 0.03 + (n % 7) * 0.001, drop_lng=CENTRE[1] + 0.02,
+        )
+
+    def throwaway(self):
+        """A customer of its own, for routes that revoke the user's tokens"""
+        return User.objects.create_user(email=f'reset{next(_numbers)}@budget.invalid', password=None,
+                                        name='Budget Reset', role='customer')
+
+    def trip(self):
+        deliveries = [self.delivery(self.customer) for _ in range(2)]
+        return Trip.objects.create(
+            delivery_ids=[d.id for d in deliveries], parcel_count=2, total_weight=4,
+            pickup_lat=CENTRE[0], pickup_lng=CENTRE[1], bearing=45, region=deliveries[0].region,
+        )
+
+
+def _profile_id(dataset, client):
+    response = client.get('/api/admin/overview/', HTTP_AUTHORIZATION=f"Bearer {dataset.tokens['admin']}",
+                          HTTP_X_PARCELBEE_PROFILE='1')
+    return response['X-Profile-Id']
+
+
+# One entry per scenario; every URL name in core/urls.py needs at least one. prepare(dataset, client)
+# runs outside the measurement and gives mutating routes a fresh target each time. Scenarios with
+# session=True are Django admin pages, requested logged in as the staff user instead of with a token.
+SCENARIOS = {
+    'register': dict(method='POST', path='/api/register/', prepare=lambda d, c: f'new{next(_numbers)}@budget.invalid',
+                     body=lambda d, email: {'name': 'New', 'email': email, 'password': PASSWORD, 'role': 'customer'}),
+    'login': dict(method='POST', path='/api/login/', body=lambda d, _: {'email': d.customer.email, 'password': PASSWORD}),
+    'logout': dict(method='POST', path='/api/logout/', prepare=lambda d, c: generate_jwt(d.customer),
+                   token=lambda d, token: token),
+    'forgot_password': dict(method='POST', path='/api/password/forgot/', body=lambda d, _: {'email': d.customer.email}),
+    'reset_password': dict(method='POST', path='/api/password/reset/',
+                           prepare=lambda d, c: generate_reset_token_payload(d.throwaway().email),
+                           body=lambda d, token: {'token': token, 'new_password': PASSWORD}),
+    'create_delivery': dict(method='POST', path='/api/delivery/create/', role='customer',
+                            body=lambda d, _: {'pickup_address': '1 Budget Road', 'drop_address': '2 Limit Street',
+                                               'description': 'Budget parcel', 'weight': 2, 'estimated_price': 120,
+                                               'pickup_lat': CENTRE[0], 'pickup_lng': CENTRE[1],
+                                               'drop_lat': CENTRE[0] + 0.02, 'drop_lng': CENTRE[1] + 0.02}),
+    'list_deliveries[customer]': dict(path='/api/delivery/list/', role='customer'),
+    'list_deliveries[partner]': dict(path='/api/delivery/list/', role='partner'),
+    'list_deliveries[admin]': dict(path='/api/delivery/list/', role='admin'),
+    'bulk_update_delivery_status': dict(method='PATCH', path='/api/delivery/bulk-update-status/', role='partner',
+                                        prepare=lambda d, c: [d.delivery(d.customer, 'accepted').id for _ in range(5)],
+                                        body=lambda d, ids: {'updates': [{'delivery_id': i, 'status': 'in_transit'} for i in ids]}),
+    'delivery_detail': dict(path=lambda d, _: f'/api/delivery/{d.shown.id}/', role='customer'),
+    'delivery_history': dict(path=lambda d, _: f'/api/delivery/{d.shown.id}/history/', role='customer'),
+    'delivery_location': dict(path=lambda d, _: f'/api/delivery/{d.shown.id}/location/', role='customer'),
+    'accept_delivery': dict(method='POST', path=lambda d, delivery: f'/api/delivery/{delivery.id}/accept/', role='partner',
+                            prepare=lambda d, c: d.delivery(d.customer)),
+    'update_delivery_status': dict(method='PUT', path=lambda d, delivery: f'/api/delivery/{delivery.id}/update-status/',
+                                   role='partner', prepare=lambda d, c: d.delivery(d.customer, 'accepted'),
+                                   body=lambda d, _: {'status': 'in_transit'}),
+    'trip_offers': dict(path='/api/trips/', role='partner'),
+    'accept_trip': dict(method='POST', path=lambda d, trip: f'/api/trips/{trip.id}/accept/', role='partner',
+                        prepare=lambda d, c: d.trip()),
+    'partner_location': dict(method='POST', path='/api/partner/location/', role='partner',
+                             body=lambda d, _: {'fixes': [{'lat': CENTRE[0], 'lng': CENTRE[1]}]}),
+    'admin_overview': dict(path='/api/admin/overview/', role='admin'),
+    'admin_analytics': dict(path='/api/admin/analytics/?group_by=day', role='admin'),
+    'search_deliveries': dict(path='/api/admin/search/?q=budget', role='admin'),
+    'export_deliveries': dict(path='/api/admin/deliveries/export/?format=csv', role='admin'),
+    'admission_metrics': dict(path='/api/admin/admission/', role='admin'),
+    'profiles': dict(path='/api/admin/profiles/', role='admin'),
+    'profile_detail': dict(path=lambda d, profile_id: f'/api/admin/profiles/{profile_id}/', role='admin',
+                           prepare=_profile_id),
+    'price-estimate': dict(method='POST', path='/api/price/estimate/',
+                           body=lambda d, _: {'pickup_address': '1 Budget Road', 'drop_address': '2 Limit Street', 'weight': 2}),
+    'admin:core_deliveryrequest_changelist': dict(path=lambda d, _: reverse('admin:core_deliveryrequest_changelist'),
+                                                  session=True),
+    'admin:core_deliveryrequest_change': dict(path=lambda d, _: reverse('admin:core_deliveryrequest_change', args=[d.shown.id]),
+                                              session=True),
+    'admin:core_user_changelist': dict(path=lambda d, _: reverse('admin:core_user_changelist'), session=True),
+}
+
+
+def route_names():
+    """URL names defined in core/urls.py"""
+    return [pattern.name for pattern in core_urls.urlpatterns if pattern.name]
+
+
+def uncovered_routes():
+    """URL names in core/urls.py without a scenario"""
+    covered = {name.split('[')[0] for name in SCENARIOS}
+    return [name for name in route_names() if name not in covered]
+
+
+def baseline_path():
+    return Path(getattr(settings, 'PARCELBEE_QUERY_BUDGET_BASELINE', settings.BASE_DIR / 'query_budgets.json'))
+
+
+def measure(client, dataset, scenario, trace_memory=False):
+    """Run a scenario once; returns (status, queries, seconds, peak bytes or None)"""
+    target = scenario['prepare'](dataset, client) if 'prepare' in scenario else None
+    path = scenario['path'](dataset, target) if callable(scenario['path']) else scenario['path']
+    headers = {}
+    if scenario.get('role'):
+        headers['HTTP_AUTHORIZATION'] = f"Bearer {dataset.tokens[scenario['role']]}"
+    elif 'token' in scenario:
+        headers['HTTP_AUTHORIZATION'] = f"Bearer {scenario['token'](dataset, target)}"
+    body = json.dumps(scenario['body'](dataset, target)) if 'body' in scenario else ''
+    if scenario.get('session'):
+        client.force_login(dataset.staff)
+    # A due revocation refresh would otherwise be counted against this request
+    revocations.refresh()
+
+    with ExitStack() as stack:
+        captures = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        response = client.generic(scenario.get('method', 'GET'), path, body, content_type='application/json', **headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    if scenario.get('session'):
+        client.logout()
+    return response.status_code, sum(len(capture) for capture in captures), elapsed, peak
+
+
+def run_scenarios(scenarios, sizes, repeat=3, trace_memory=True):
+    """
+    {scenario: {size: {'status', 'queries', 'ms', 'kb'}}}, measured against the test databases
+    already in place, which are flushed for every size. kb is None without trace_memory.
+    """
+    profiles = tempfile.TemporaryDirectory()
+    results = {name: {} for name in scenarios}
+    try:
+        with override_settings(PARCELBEE_RATE_LIMITS={}, PARCELBEE_PROFILE_DIR=Path(profiles.name)), \
+                mock.patch('core.api_views.geocode_nominatim', fake_geocode):
+            for size in sizes:
+                for alias in connections:
+                    call_command('flush', database=alias, interactive=False, verbosity=0)
+                dataset = Dataset(size)
+                client = Client()
+                for name, scenario in scenarios.items():
+                    measure(client, dataset, scenario)  # warm caches and lazy imports
+                    runs = [measure(client, dataset, scenario) for _ in range(repeat)]
+                    peak = measure(client, dataset, scenario, trace_memory=True)[3] if trace_memory else None
+                    results[name][str(size)] = {
+                        'status': runs[-1][0],
+                        'queries': max(run[1] for run in runs),
+                        'ms': round(statistics.median(run[2] for run in runs) * 1000, 2),
+                        'kb': round(peak / 1024, 1) if peak is not None else None,
+                    }
+    finally:
+        profiles.cleanup()
+    return results
+
+
+def budget_problems(current, base, latency_tolerance=None, memory_tolerance=None):
+    """
+    Why one measurement fails against its baseline entry. Query counts are always compared;
+    latency and peak memory depend on the machine and are only checked when given a tolerance.
+    """
+    problems = []
+    if current['status'] >= 400:
+        problems.append(f"status {current['status']}")
+    if not base:
+        return problems
+    if current['queries'] > base['queries']:
+        problems.append(f"{current['queries']} queries, baseline {base['queries']}")
+    if latency_tolerance is not None and current['ms'] > base['ms'] * latency_tolerance + 5:
+        problems.append(f"{current['ms']} ms, baseline {base['ms']}")
+    if memory_tolerance is not None and current['kb'] is not None and current['kb'] > base['kb'] * memory_tolerance + 64:
+        problems.append(f"{current['kb']} KB, baseline {base['kb']}")
+    return problems
+
+
+def growth_problem(name, by_size, sizes):
+    """A failure when the scenario's query count rises with the dataset size, else None"""
+    counts = [by_size[str(size)]['queries'] for size in sizes]
+    if len(sizes) > 1 and counts[-1] > counts[0]:
+        return (f'{name}: query count grows with rows ({", ".join(map(str, counts))} '
+                f'at {", ".join(map(str, sizes))} rows)')
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Exercise every route in core/urls.py against throwaway test databases at several dataset '
+        'sizes and report query count, latency and peak allocation (tracemalloc) per route. '
+        '--update-baseline records them in PARCELBEE_QUERY_BUDGET_BASELINE, which QueryBudgetTests in '
+        'core/tests.py checks query counts against. Without it the command fails like those tests, '
+        'plus latency and memory when --check-resources is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,50,200', help='Comma-separated delivery counts')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per route and size (median is kept)')
+        parser.add_argument('--route', action='append', dest='routes', help='Only these scenarios (repeatable)')
+        parser.add_argument('--check-resources', action='store_true',
+                            help='Also fail on latency and memory; their baselines only hold on the machine that recorded them')
+        parser.add_argument('--latency-tolerance', type=float, default=2.0,
+                            help='With --check-resources, fail above baseline * this + 5 ms')
+        parser.add_argument('--memory-tolerance', type=float, default=1.5,
+                            help='With --check-resources, fail above baseline * this + 64 KB')
+        parser.add_argument('--baseline', help='Baseline file (default: PARCELBEE_QUERY_BUDGET_BASELINE)')
+        parser.add_argument('--update-baseline', action='store_true', help='Write the measured numbers as the baseline')
+        parser.add_argument('--report-only', action='store_true', help='Print the comparison without failing')
+
+    def handle(self, *args, **options):
+        sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        scenarios = {name: SCENARIOS[name] for name in (options['routes'] or SCENARIOS)}
+
+        results = self.run(scenarios, sizes, options['repeat'])
+
+        path = Path(options['baseline']) if options['baseline'] else baseline_path()
+        if options['update_baseline']:
+            path.write_text(json.dumps({'sizes': sizes, 'routes': results}, indent=1, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote baseline for {len(results)} scenarios to {path}'))
+            baseline = {}
+        else:
+            baseline = json.loads(path.read_text())['routes'] if path.exists() else {}
+
+        if options['check_resources']:
+            tolerances = options['latency_tolerance'], options['memory_tolerance']
+        else:
+            tolerances = None, None
+        failures = self.report(results, sizes, baseline, *tolerances)
+        for name in uncovered_routes():
+            failures.append(f'{name}: no scenario in check_query_budgets.SCENARIOS')
+        if failures:
+            self.stdout.write(self.style.ERROR(f'\n{len(failures)} budget failures:'))
+            for failure in failures:
+                self.stdout.write(f'  {failure}')
+            if not options['report_only'] and not options['update_baseline']:
+                raise CommandError('Query budgets exceeded')
+        else:
+            self.stdout.write(self.style.SUCCESS('\nAll routes within budget'))
+
+    def run(self, scenarios, sizes, repeat):
+        """run_scenarios on fresh test databases"""
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+        try:
+            return run_scenarios(scenarios, sizes, repeat)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def report(self, results, sizes, baseline, latency_tolerance=None, memory_tolerance=None):
+        failures = []
+        self.stdout.write(f"{'scenario':<40} {'rows':>5} {'status':>6} {'queries':>8} {'base':>5} "
+                          f"{'ms':>8} {'base':>8} {'KB':>8} {'base':>8}")
+        for name, by_size in results.items():
+            for size in sizes:
+                current = by_size[str(size)]
+                base = baseline.get(name, {}).get(str(size))
+                problems = budget_problems(current, base, latency_tolerance, memory_tolerance)
+                failures.extend(f'{name} at {size} rows: {problem}' for problem in problems)
+                self.stdout.write(
+                    f"{name:<40} {size:>5} {current['status']:>6} {current['queries']:>8} "
+                    f"{base['queries'] if base else '-':>5} {current['ms']:>8.2f} {base['ms'] if base else '-':>8} "
+                    f"{current['kb']:>8.1f} {base['kb'] if base else '-':>8}"
+                    + ('  <-' if problems else '')
+                )
+
+            growth = growth_problem(name, by_size, sizes)
+            if growth:
+                failures.append(growth)
+        return failures
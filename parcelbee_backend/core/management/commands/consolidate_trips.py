@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.consolidation import consolidate
+
+
+class Command(BaseCommand):
+    help = 'Cluster pending deliveries into trip offers, replacing the previous offers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-weight', type=float, help='kg per trip (default PARCELBEE_TRIP_MAX_WEIGHT)')
+        parser.add_argument('--max-parcels', type=int, help='Parcels per trip (default PARCELBEE_TRIP_MAX_PARCELS)')
+        parser.add_argument('--loop', action='store_true', help='Keep re-clustering')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            trips, parcels = consolidate(max_weight=options['max_weight'], max_parcels=options['max_parcels'])
+            self.stdout.write(
+                f'Offered {trips} trips covering {parcels} deliveries in {time.perf_counter() - started:.2f}s'
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, filter_deliveries, stream_deliveries
+
+
+class Command(BaseCommand):
+    help = 'Export deliveries as CSV or NDJSON without loading them all into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--status', help='Comma separated statuses, e.g. delivered,cancelled')
+        parser.add_argument('--date-from', help='Created on or after (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Created on or before (YYYY-MM-DD)')
+        parser.add_argument('--partner', help='Partner user id')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help='Output file (defaults to stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            deliveries = filter_deliveries(
+                status=options['status'],
+                date_from=options['date_from'],
+                date_to=options['date_to'],
+                partner=options['partner'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = stream_deliveries(deliveries, options['format'], chunk_size=options['chunk_size'])
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+            for line in lines:
+                out.write(line)
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.geocoding import geocode_missing
+
+
+class Command(BaseCommand):
+    help = 'Geocode delivery addresses that were saved without coordinates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--limit', type=int, help='Stop after this many deliveries')
+        parser.add_argument('--rate', type=float, help='Geocoder requests per second (default PARCELBEE_GEOCODE_RATE)')
+        parser.add_argument('--max-attempts', type=int, default=3, help='Give up on an address after this many failures')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new deliveries')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            updated, unresolved = geocode_missing(
+                batch_size=options['batch_size'],
+                limit=options['limit'],
+                rate=options['rate'],
+                max_attempts=options['max_attempts'],
+            )
+            self.stdout.write(f'Updated {updated} deliveries, {unresolved} addresses unresolved')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
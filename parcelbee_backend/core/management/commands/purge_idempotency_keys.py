@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete stored idempotency responses past their TTL'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Deleted {purge_expired()} expired idempotency keys'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.locations import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete persisted partner positions older than PARCELBEE_LOCATION_RETENTION_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Override the retention period')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Deleted {purge_expired(options["days"])} partner positions'))
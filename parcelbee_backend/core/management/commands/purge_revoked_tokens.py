@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core.tokens import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked-token records whose tokens have expired'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Deleted {purge_expired()} expired revoked tokens'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.sharding import delivery_databases, rebalance
+
+
+class Command(BaseCommand):
+    help = (
+        'Move deliveries to the database of their region. Run after changing PARCELBEE_REGIONS or '
+        'PARCELBEE_REGION_DATABASES, including the first split of the single database. '
+        'Create new region databases first with migrate --database=<alias>.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', dest='databases',
+                            help='Only move deliveries out of this database (repeatable); '
+                                 'use it to drain a database no region maps to any more')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report what would move without moving it')
+
+    def handle(self, *args, **options):
+        databases = options['databases'] or delivery_databases()
+        for alias in databases:
+            if alias not in connections:
+                raise CommandError(f'Unknown database {alias}')
+
+        moved = rebalance(databases, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write(f'{verb} {count} deliveries from {source} to {target}')
+        if not moved:
+            self.stdout.write('Every delivery is already in its region database')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core.events import rebuild_state
+
+
+class Command(BaseCommand):
+    help = 'Rebuild delivery status columns by replaying the delivery event log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('delivery_ids', nargs='*', type=int, help='Only rebuild these deliveries')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        skipped = []
+        changed = rebuild_state(
+            delivery_ids=options['delivery_ids'] or None,
+            chunk_size=options['chunk_size'],
+            apply=not options['dry_run'],
+            skipped=skipped,
+        )
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(changed)} deliveries'))
+        for delivery_id in changed:
+            self.stdout.write(f'  #{delivery_id}')
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Left {len(skipped)} deliveries alone: they changed after the last event logged for them'
+            ))
+            for delivery_id in skipped:
+                self.stdout.write(f'  #{delivery_id}')
@@ -0,0 +1,21 @@
+from django.db import connections, transaction
+from django.core.management.base import BaseCommand
+
+from core.search import get_backend, has_users
+
+
+class Command(BaseCommand):
+    help = 'Recreate the delivery full-text search index from delivery_requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias, e.g. a region database')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        backend = get_backend(connection.vendor)
+        names = has_users(connection)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            backend.install(cursor, names)
+            backend.rebuild(cursor, names)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt search index in {connection.alias} with {type(backend).__name__}'))
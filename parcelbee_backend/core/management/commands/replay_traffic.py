@@ -0,0 +1,229 @@
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from core.models import DeliveryRequest, User
+from core.traffic import LatencyLog, read_trace, rehydrate
+from core.utils import generate_jwt
+
+
+DELIVERY_KEYS = ('delivery_id', 'id')
+# Status a delivery must have had for a partner to move it to the key status
+PRIOR_STATUS = {'accepted': 'accepted', 'in_transit': 'accepted', 'delivered': 'in_transit', 'cancelled': 'accepted'}
+
+
+class Fixtures:
+    """
+    Local stand-ins for what a trace refers to: one user per recorded caller pseudonym
+    (same role) and one delivery per recorded delivery id, owned by the first customer that
+    used it. Each delivery starts in the state the trace implies: pending and unassigned when
+    its first successful partner request accepts it, otherwise assigned to that partner with
+    the status preceding the one the partner set. Users are reused across replays;
+    deliveries are created afresh.
+    """
+    def __init__(self, entries):
+        self.tokens = {}
+        self.deliveries = {}
+        owners = {}
+        states = {}
+        for entry in entries:
+            actor = entry.get('a')
+            if actor and actor not in self.tokens:
+                self.tokens[actor] = generate_jwt(self.user(actor, entry.get('role') or 'customer'))
+            writes = self.status_writes(entry)
+            succeeded = entry.get('s', 200) < 400
+            for delivery_id in self.referenced_ids(entry):
+                if entry.get('role') == 'customer' and actor:
+                    owners.setdefault(delivery_id, actor)
+                else:
+                    owners.setdefault(delivery_id, None)
+                if delivery_id in states or not succeeded or entry.get('role') != 'partner' or not actor:
+                    continue
+                if entry['r'] in ('accept_delivery', 'accept_trip'):
+                    states[delivery_id] = ('pending', None)
+                else:
+                    states[delivery_id] = (PRIOR_STATUS.get(writes.get(delivery_id), 'accepted'), actor)
+
+        default_owner = None
+        now = timezone.now()
+        for delivery_id, actor in owners.items():
+            if actor is None:
+                default_owner = default_owner or self.user('replay-customer', 'customer')
+                customer = default_owner
+            else:
+                customer = User.objects.get(email=self.email(actor))
+            status, partner = states.get(delivery_id, ('pending', None))
+            self.deliveries[delivery_id] = DeliveryRequest.objects.create(
+                customer=customer, pickup_address='Replay pickup', drop_address='Replay drop',
+                description='Replay fixture', weight=2, pickup_lat=12.97, pickup_lng=77.59,
+                drop_lat=12.99, drop_lng=77.61, estimated_price=100, status=status,
+                partner=User.objects.get(email=self.email(partner)) if partner else None,
+                accepted_at=now if partner else None,
+            ).id
+
+    @staticmethod
+    def email(actor):
+        return f'{actor}@replay.invalid'
+
+    def user(self, actor, role):
+        user = User.objects.filter(email=self.email(actor)).first()
+        if user is None:
+            user = User.objects.create_user(email=self.email(actor), password=None, name=f'Replay {role}', role=role)
+        return user
+
+    @staticmethod
+    def referenced_ids(entry):
+        ids = []
+        for key, value in (entry.get('k') or {}).items():
+            if key in DELIVERY_KEYS and isinstance(value, int):
+                ids.append(value)
+
+        def walk(value, key=None):
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    walk(v, k)
+            elif isinstance(value, list):
+                for v in value:
+                    walk(v)
+            elif key in DELIVERY_KEYS and isinstance(value, int):
+                ids.append(value)
+        walk(entry.get('b'))
+        return ids
+
+    @staticmethod
+    def status_writes(entry):
+        """{delivery_id: status} this request asked for, from its URL and body"""
+        writes = {}
+        body = entry.get('b')
+        kwargs = entry.get('k') or {}
+        if isinstance(body, dict) and isinstance(body.get('status'), str):
+            for key in DELIVERY_KEYS:
+                if isinstance(kwargs.get(key), int):
+                    writes[kwargs[key]] = body['status']
+
+        def walk(value):
+            if isinstance(value, dict):
+                status = value.get('status')
+                for key in DELIVERY_KEYS:
+                    if isinstance(value.get(key), int) and isinstance(status, str):
+                        writes[value[key]] = status
+                for v in value.values():
+                    walk(v)
+            elif isinstance(value, list):
+                for v in value:
+                    walk(v)
+        walk(body)
+        return writes
+
+    def fill(self, key, value):
+        if key in DELIVERY_KEYS and isinstance(value, int):
+            return self.deliveries.get(value, value)
+        return value
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a trace captured by TrafficCaptureMiddleware (PARCELBEE_TRAFFIC_CAPTURE) against a '
+        'running server, keeping the recorded spacing divided by --speed, and report latency '
+        'percentiles per route. Fixture users and deliveries are created in the database this '
+        'command is configured with, which must be the one the target server uses.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--speed', type=float, default=1.0, help='1 = recorded pace, 4 = four times faster')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--limit', type=int, help='Replay only the first N requests')
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        if options['speed'] <= 0:
+            raise CommandError('--speed must be positive')
+        try:
+            entries = list(read_trace(options['trace']))
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {options["trace"]}: {e}')
+        entries.sort(key=lambda entry: entry['t'])
+        if options['limit']:
+            entries = entries[:options['limit']]
+        if not entries:
+            raise CommandError('The trace is empty')
+
+        fixtures = Fixtures(entries)
+        self.stdout.write(f'{len(entries)} requests, {len(fixtures.tokens)} callers, '
+                          f'{len(fixtures.deliveries)} fixture deliveries')
+
+        requests, skipped = [], 0
+        for entry in entries:
+            request = self.build(entry, fixtures, options['base_url'])
+            if request is None:
+                skipped += 1
+            else:
+                requests.append((entry['t'], entry['r'], request))
+
+        log = LatencyLog()
+        late = []
+        timeout = options['timeout']
+
+        def send(route, request):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                e.read()
+                status = e.code
+            except (urllib.error.URLError, OSError):
+                status = 'error'
+            log.add(route, status, time.perf_counter() - started)
+
+        first = requests[0][0]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for recorded, route, request in requests:
+                due = (recorded - first) / options['speed']
+                delay = due - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -0.01:
+                    late.append(-delay)
+                pool.submit(send, route, request)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'Replayed {len(requests)} requests in {elapsed:.1f}s at {options["speed"]}x'
+                          + (f', skipped {skipped} with unknown routes' if skipped else ''))
+        if late:
+            self.stdout.write(f'{len(late)} requests were dispatched behind schedule (worst {max(late) * 1000:.0f} ms); '
+                              'raise --concurrency if this is large')
+        self.stdout.write(f"\n{'route':<32} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+        for route, count, p50, p90, p99, worst, statuses in log.report():
+            codes = ' '.join(f'{code}:{n}' for code, n in sorted(statuses.items(), key=lambda item: str(item[0])))
+            self.stdout.write(f'{route:<32} {count:>7} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f} {worst:>9.1f}  {codes}')
+
+    def build(self, entry, fixtures, base_url):
+        kwargs = {key: fixtures.fill(key, value) for key, value in (entry.get('k') or {}).items()}
+        try:
+            path = reverse(entry['r'], kwargs=kwargs)
+        except NoReverseMatch:
+            return None
+        query = rehydrate(entry.get('q') or {}, fixtures.fill)
+        url = base_url.rstrip('/') + path + ('?' + urllib.parse.urlencode(query) if query else '')
+
+        headers = {}
+        data = None
+        if 'b' in entry:
+            data = json.dumps(rehydrate(entry['b'], fixtures.fill)).encode()
+            headers['Content-Type'] = 'application/json'
+        token = fixtures.tokens.get(entry.get('a'))
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return urllib.request.Request(url, data=data, headers=headers, method=entry['m'])
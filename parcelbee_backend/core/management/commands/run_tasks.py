@@ -0,0 +1,61 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.tasks import Worker, lease_seconds, renew_leases, requeue_stale
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background tasks with N concurrent workers. While running, the leases on '
+        'this process\'s tasks are renewed and tasks whose worker died elsewhere are taken back '
+        '(PARCELBEE_TASK_LEASE_SECONDS).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale tasks')
+
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping after the current tasks...')
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        workers = [Worker(n, stop, options['poll_interval'], options['burst']) for n in range(options['workers'])]
+        worker_ids = [worker.worker_id for worker in workers]
+        # Renew well inside the lease so a slow query never lets a live task be taken back
+        renew_every = lease_seconds() / 3
+        started = time.perf_counter()
+        renewed_at = time.monotonic()
+        for worker in workers:
+            worker.start()
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=0.5)
+                if time.monotonic() - renewed_at >= renew_every:
+                    renew_leases(worker_ids)
+                    requeued = requeue_stale()
+                    if requeued:
+                        self.stdout.write(f'Requeued {requeued} stale tasks')
+                    renewed_at = time.monotonic()
+        finally:
+            connection.close()
+
+        processed = sum(worker.processed for worker in workers)
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} tasks in {time.perf_counter() - started:.1f}s'
+        ))
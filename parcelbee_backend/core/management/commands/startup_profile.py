@@ -0,0 +1,167 @@
+import ast
+import importlib.util
+import inspect
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+HTTP_METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output into (module, self_us, cumulative_us, depth) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def _route_examples(patterns, prefix=''):
+    """(path, name, callback) for every route, with converters filled by sample values"""
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if hasattr(pattern, 'url_patterns'):
+            yield from _route_examples(pattern.url_patterns, route)
+        else:
+            path = re.sub(r'<(?:int:)?[^>]+>', '1', route)
+            yield '/' + path.lstrip('^').rstrip('$'), pattern.name or route, pattern.callback
+
+
+def _lazy_view_methods(dotted_path):
+    """Handlers a lazily loaded class-based view defines, read from its source so the view stays unimported"""
+    module_path, name = dotted_path.rsplit('.', 1)
+    tree = ast.parse(Path(importlib.util.find_spec(module_path).origin).read_text())
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == name:
+            return [item.name.upper() for item in node.body
+                    if isinstance(item, ast.FunctionDef) and item.name in HTTP_METHODS]
+    return []
+
+
+def route_method(callback):
+    """The method to time a route with: GET when the view accepts it, else the first one it does"""
+    if hasattr(callback, 'lazy_view_path'):
+        methods = _lazy_view_methods(callback.lazy_view_path)
+    elif hasattr(callback, 'view_class'):
+        methods = [method.upper() for method in HTTP_METHODS if hasattr(callback.view_class, method)]
+    else:
+        # Function views: the list given to @require_http_methods, found through the decorators
+        methods, func = [], callback
+        while func is not None and not methods:
+            methods = inspect.getclosurevars(func).nonlocals.get('request_method_list', [])
+            func = getattr(func, '__wrapped__', None)
+    return 'GET' if 'GET' in methods or not methods else methods[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Report import time per module and first-request latency per route for a cold worker. '
+        'Routes are called as a throwaway admin, with each view\'s own method and an empty JSON '
+        'body, in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Modules to list, by cumulative import time')
+        parser.add_argument('--prefix', default='api/', help='Only time routes under this prefix')
+        parser.add_argument('--child', action='store_true', help='Internal: run the measurement in this process')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.measure(options['prefix'])
+
+        env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+        command = [sys.executable, '-X', 'importtime', sys.argv[0], 'startup_profile', '--child',
+                   '--prefix', options['prefix']]
+        started = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True, env=env)
+        wall = time.perf_counter() - started
+        if result.returncode != 0:
+            raise CommandError(result.stderr[-2000:])
+
+        imports = parse_importtime(result.stderr)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Cold process wall time: {wall * 1000:.1f} ms'))
+        self.stdout.write(f"URLconf import and resolve: {report['urlconf_ms']:.1f} ms")
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nSlowest imports (cumulative us | self us | module)'))
+        top_level = [row for row in imports if row[3] == 0]
+        for module, self_us, cumulative_us, _ in sorted(top_level, key=lambda row: -row[2])[:options['top']]:
+            self.stdout.write(f'{cumulative_us:>10} | {self_us:>8} | {module}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nProject modules'))
+        for module, self_us, cumulative_us, depth in imports:
+            if module.split('.')[0] in ('core', 'parcelbee'):
+                self.stdout.write(f'{cumulative_us:>10} | {self_us:>8} | {"  " * depth}{module}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\nFirst vs warm request (ms)'))
+        for route in report['routes']:
+            self.stdout.write(
+                f"{route['first_ms']:>8.2f} {route['warm_ms']:>8.2f}  {route['status']}  "
+                f"{route['method']:<6} {route['path']} ({route['name']})"
+            )
+
+    def measure(self, prefix):
+        """Runs inside the child process started with -X importtime"""
+        from django.conf import settings
+        from django.db import connections, transaction
+        from django.urls import get_resolver
+
+        # manage.py already ran django.setup(); the URLconf is loaded on the first request
+        started = time.perf_counter()
+        resolver = get_resolver()
+        resolver.reverse_dict  # builds the resolver's lookup tables
+        urlconf_ms = (time.perf_counter() - started) * 1000
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(transaction.atomic(using=alias))
+            routes = self.time_routes(resolver, prefix)
+            for alias in connections:
+                transaction.set_rollback(True, using=alias)
+
+        sys.stdout.write(json.dumps({
+            'settings': settings.SETTINGS_MODULE,
+            'urlconf_ms': urlconf_ms,
+            'routes': routes,
+        }) + '\n')
+
+    def time_routes(self, resolver, prefix):
+        from django.test import Client
+
+        from core.models import User
+        from core.utils import generate_jwt
+
+        admin = User.objects.create_user(email='startup-profile@profile.invalid', password=None,
+                                         name='Startup profile', role='admin')
+        client = Client()
+        routes = []
+        for path, name, callback in _route_examples(resolver.url_patterns):
+            if not path.startswith('/' + prefix):
+                continue
+            method = route_method(callback)
+            body = '' if method == 'GET' else '{}'
+            timings = []
+            for _ in range(2):
+                # A token per request: the logout route revokes the one it is called with
+                token = generate_jwt(admin)
+                started = time.perf_counter()
+                response = client.generic(method, path, body, content_type='application/json',
+                                          HTTP_AUTHORIZATION=f'Bearer {token}')
+                timings.append((time.perf_counter() - started) * 1000)
+            routes.append({'path': path, 'name': name, 'method': method, 'status': response.status_code,
+                           'first_ms': timings[0], 'warm_ms': timings[1]})
+        return routes
+
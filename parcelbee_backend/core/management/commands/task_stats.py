@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.tasks import task_metrics
+
+
+def _ms(value):
+    return f'{value:.1f}' if value is not None else '-'
+
+
+class Command(BaseCommand):
+    help = 'Show counts and timing per background task'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'task':<50} {'queued':>6} {'run':>4} {'done':>6} {'failed':>6} "
+                          f"{'avg ms':>9} {'max ms':>9} {'avg wait':>9} {'max wait':>9}")
+        for row in task_metrics():
+            self.stdout.write(
+                f"{row['name']:<50} {row['queued']:>6} {row['running']:>4} {row['done']:>6} {row['failed']:>6} "
+                f"{_ms(row['avg_duration_ms']):>9} {_ms(row['max_duration_ms']):>9} "
+                f"{_ms(row['avg_wait_ms']):>9} {_ms(row['max_wait_ms']):>9}"
+            )
@@ -0,0 +1,68 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.eta import EtaModel, features, model_path, train
+from core.utils import optional_numpy
+
+
+class Command(BaseCommand):
+    help = (
+        'Fit the delivery ETA model on completed deliveries and write it to PARCELBEE_ETA_MODEL. '
+        'Workers load the file at start, so restart them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Model file (default: PARCELBEE_ETA_MODEL)')
+        parser.add_argument('--holdout-every', type=int, default=10,
+                            help='Hold out deliveries whose id is a multiple of this for evaluation; 0 disables')
+        parser.add_argument('--min-samples', type=int, default=50)
+        parser.add_argument('--bench', action='store_true', help='Time single and batch scoring with the written model')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        model, report = train(holdout_every=options['holdout_every'])
+        elapsed = time.perf_counter() - started
+
+        samples = report['samples']
+        self.stdout.write(f"Trained on {samples['accept']} deliveries in {elapsed:.1f}s "
+                          f"({'numpy' if optional_numpy() is not None else 'pure Python'})")
+        if min(samples.values()) < options['min_samples']:
+            raise CommandError(f"Only {min(samples.values())} completed deliveries; need {options['min_samples']}")
+        if report['holdout_mae_minutes'] is not None:
+            self.stdout.write(f"Holdout: {report['holdout']} deliveries, mean absolute error "
+                              f"{report['holdout_mae_minutes']:.1f} min")
+        self.stdout.write(f"Partner offsets: {len(model.stages['transit']['partners'])}")
+
+        output = options['output'] or model_path()
+        model.save(output)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {output}'))
+
+        if options['bench']:
+            self.bench(EtaModel.load(output))
+
+    def bench(self, model, rounds=20_000, batch=1000):
+        rng = random.Random(0)
+        now = timezone.now()
+        rows = [features(rng.uniform(0.5, 25), rng.uniform(0.2, 20), now - timedelta(minutes=rng.randrange(1440)))
+                for _ in range(batch)]
+
+        started = time.perf_counter()
+        for n in range(rounds):
+            model.predict_seconds('transit', rows[n % batch])
+        single = (time.perf_counter() - started) / rounds
+
+        started = time.perf_counter()
+        model.predict_many('transit', rows)
+        many = (time.perf_counter() - started) / batch
+
+        started = time.perf_counter()
+        for _ in range(batch):
+            features(3.2, 1.5, now)
+        featurize = (time.perf_counter() - started) / batch
+
+        self.stdout.write(f'Scoring: {single * 1e6:.2f} us single, {many * 1e6:.2f} us per row batched '
+                          f'({batch} rows), {featurize * 1e6:.2f} us to build features')
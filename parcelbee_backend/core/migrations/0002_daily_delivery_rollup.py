@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDeliveryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('accepted_count', models.PositiveIntegerField(default=0)),
+                ('delivered_count', models.PositiveIntegerField(default=0)),
+                ('cancelled_count', models.PositiveIntegerField(default=0)),
+                ('accept_latency_total', models.FloatField(default=0)),
+                ('delivery_duration_total', models.FloatField(default=0)),
+                ('delivery_duration_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('partner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'delivery_daily_rollups',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailydeliveryrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'partner'), name='unique_rollup_day_partner'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailydeliveryrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('partner__isnull', True)), fields=('day',), name='unique_rollup_day_unassigned'),
+        ),
+    ]
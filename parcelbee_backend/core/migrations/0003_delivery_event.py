@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_daily_delivery_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('accepted', 'Accepted'), ('in_transit', 'In Transit'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('lat', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('lng', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivery_events', to=settings.AUTH_USER_MODEL)),
+                ('delivery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='core.deliveryrequest')),
+            ],
+            options={
+                'db_table': 'delivery_events',
+                'ordering': ['created_at', 'id'],
+                'indexes': [models.Index(fields=['delivery', 'created_at'], name='delivery_events_history_idx')],
+            },
+        ),
+    ]
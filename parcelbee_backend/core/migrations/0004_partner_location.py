@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_delivery_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartnerLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lat', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('lng', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('recorded_at', models.DateTimeField()),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='locations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'partner_locations',
+                'ordering': ['-recorded_at'],
+                'indexes': [models.Index(fields=['partner', '-recorded_at'], name='partner_locations_latest_idx')],
+            },
+        ),
+    ]
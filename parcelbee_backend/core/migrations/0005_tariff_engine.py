@@ -0,0 +1,77 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_partner_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TariffZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('min_lat', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('min_lng', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('max_lat', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('max_lng', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('priority', models.IntegerField(default=0, help_text='Higher wins where zones overlap')),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'tariff_zones',
+                'ordering': ['-priority', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeightSlab',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_weight', models.DecimalField(decimal_places=2, max_digits=6, unique=True)),
+                ('fee', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'tariff_weight_slabs',
+                'ordering': ['max_weight'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TariffRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_fee', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('per_km', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('drop_zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='drop_rules', to='core.tariffzone')),
+                ('pickup_zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pickup_rules', to='core.tariffzone')),
+            ],
+            options={
+                'db_table': 'tariff_rules',
+            },
+        ),
+        migrations.CreateModel(
+            name='SurgeWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_hour', models.PositiveSmallIntegerField(help_text='0-23, local time')),
+                ('end_hour', models.PositiveSmallIntegerField(help_text='1-24, exclusive; may wrap past midnight')),
+                ('multiplier', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('zone', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='surge_windows', to='core.tariffzone')),
+            ],
+            options={
+                'db_table': 'tariff_surge_windows',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='tariffrule',
+            constraint=models.UniqueConstraint(fields=('pickup_zone', 'drop_zone'), name='unique_tariff_rule_zones'),
+        ),
+    ]
@@ -0,0 +1,14 @@
+from django.db import migrations
+
+from core.search import SEARCH_HINTS, install_search, uninstall_search
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_tariff_engine'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search, hints=SEARCH_HINTS),
+    ]
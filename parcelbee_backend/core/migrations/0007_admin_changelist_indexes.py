@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_delivery_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliveryrequest',
+            index=models.Index(fields=['-created_at'], name='delivery_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryrequest',
+            index=models.Index(fields=['status', '-created_at'], name='delivery_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-date_joined'], name='users_date_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['role', '-date_joined'], name='users_role_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodedAddress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.TextField(unique=True)),
+                ('lat', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('lng', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('failed', 'Failed')], max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=1)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'geocoded_addresses',
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_geocoded_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Dotted path of the task function', max_length=255)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('priority', models.SmallIntegerField(default=0, help_text='Lower runs first')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=3)),
+                ('last_error', models.TextField(blank=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('wait_ms', models.FloatField(blank=True, help_text='Time from run_at to start of the last attempt', null=True)),
+                ('duration_ms', models.FloatField(blank=True, help_text='Run time of the last attempt', null=True)),
+            ],
+            options={
+                'db_table': 'tasks',
+                'indexes': [models.Index(fields=['status', 'priority', 'run_at'], name='tasks_claim_idx'), models.Index(fields=['name', 'status'], name='tasks_name_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.core.management.color import no_style
+
+from core.search import SEARCH_HINTS, install_search, uninstall_search
+
+
+def seed_directory(apps, schema_editor):
+    """Register existing deliveries in the directory so new ids continue after them"""
+    from core.sharding import region_for
+    DeliveryRequest = apps.get_model('core', 'DeliveryRequest')
+    DeliveryShard = apps.get_model('core', 'DeliveryShard')
+    alias = schema_editor.connection.alias
+
+    rows = DeliveryRequest.objects.using(alias).order_by('id').values_list('id', 'pickup_lat', 'pickup_lng')
+    batch = []
+    for delivery_id, lat, lng in rows.iterator(chunk_size=2000):
+        batch.append(DeliveryShard(id=delivery_id, region=region_for(lat, lng), database=alias))
+        if len(batch) >= 2000:
+            DeliveryShard.objects.using(alias).bulk_create(batch)
+            batch = []
+    DeliveryShard.objects.using(alias).bulk_create(batch)
+
+    for region in DeliveryShard.objects.using(alias).exclude(region='').values_list('region', flat=True).distinct():
+        ids = DeliveryShard.objects.using(alias).filter(region=region).values('id')
+        DeliveryRequest.objects.using(alias).filter(id__in=ids).update(region=region)
+
+    # Explicit ids do not advance a PostgreSQL sequence
+    with schema_editor.connection.cursor() as cursor:
+        for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [DeliveryShard]):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_idempotency_key'),
+    ]
+
+    operations = [
+        # SQLite rebuilds delivery_requests to alter it, which the search triggers do not survive
+        migrations.RunPython(uninstall_search, install_search, hints=SEARCH_HINTS),
+        migrations.CreateModel(
+            name='DeliveryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.CharField(blank=True, default='', max_length=32)),
+                ('database', models.CharField(default='default', max_length=100)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'delivery_shards',
+            },
+        ),
+        migrations.AddField(
+            model_name='deliveryrequest',
+            name='region',
+            field=models.CharField(blank=True, default='', help_text='Shard region derived from the pickup point', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='deliveryevent',
+            name='actor',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='delivery_events', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='deliveryrequest',
+            name='customer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='customer_deliveries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='deliveryrequest',
+            name='partner',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='partner_deliveries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryrequest',
+            index=models.Index(fields=['region'], name='delivery_region_idx'),
+        ),
+        migrations.RunPython(seed_directory, migrations.RunPython.noop, hints={'model_name': 'deliveryshard'}),
+        migrations.RunPython(install_search, uninstall_search, hints=SEARCH_HINTS),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_delivery_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_ids', models.JSONField(help_text='Deliveries, nearest drop first; all in one region database')),
+                ('parcel_count', models.PositiveSmallIntegerField()),
+                ('total_weight', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('estimated_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('pickup_lat', models.DecimalField(decimal_places=6, help_text='Centroid of the pickups', max_digits=9)),
+                ('pickup_lng', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('bearing', models.PositiveSmallIntegerField(help_text='Drop direction from the pickups, degrees from north')),
+                ('region', models.CharField(blank=True, default='', max_length=32)),
+                ('status', models.CharField(choices=[('offered', 'Offered'), ('accepted', 'Accepted'), ('withdrawn', 'Withdrawn')], default='offered', max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('accepted_at', models.DateTimeField(blank=True, null=True)),
+                ('partner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trips', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'trips',
+                'ordering': ['-parcel_count', 'created_at'],
+                'indexes': [models.Index(fields=['status', '-parcel_count'], name='trips_offered_idx')],
+            },
+        ),
+    ]
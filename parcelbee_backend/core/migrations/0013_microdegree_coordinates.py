@@ -0,0 +1,76 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:59
+
+import core.models
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, Value
+from django.db.models.functions import Cast, Round
+
+from core.search import SEARCH_HINTS, install_search, uninstall_search
+
+
+COORDINATES = ('pickup_lat', 'pickup_lng', 'drop_lat', 'drop_lng')
+
+
+def to_microdegrees(apps, schema_editor):
+    DeliveryRequest = apps.get_model('core', 'DeliveryRequest')
+    DeliveryRequest.objects.using(schema_editor.connection.alias).update(**{
+        f'{name}_e6': Cast(Round(F(name) * 1000000), models.IntegerField()) for name in COORDINATES
+    })
+
+
+def to_decimal(apps, schema_editor):
+    DeliveryRequest = apps.get_model('core', 'DeliveryRequest')
+    decimal = models.DecimalField(max_digits=9, decimal_places=6)
+    DeliveryRequest.objects.using(schema_editor.connection.alias).update(**{
+        # A float divisor so SQLite does not divide as integers
+        name: ExpressionWrapper(F(f'{name}_e6') / Value(1e6), output_field=decimal) for name in COORDINATES
+    })
+
+
+def add_microdegree_fields():
+    return [
+        migrations.AddField(
+            model_name='deliveryrequest',
+            name=f'{name}_e6',
+            field=models.IntegerField(blank=True, null=True),
+        )
+        for name in COORDINATES
+    ]
+
+
+def swap_fields():
+    # Drop the decimal columns, then give the integer ones the old field names while
+    # keeping their *_e6 column names
+    operations = []
+    for name in COORDINATES:
+        operations += [
+            migrations.RemoveField(model_name='deliveryrequest', name=name),
+            migrations.AlterField(
+                model_name='deliveryrequest',
+                name=f'{name}_e6',
+                field=models.IntegerField(blank=True, null=True, db_column=f'{name}_e6'),
+            ),
+            migrations.RenameField(model_name='deliveryrequest', old_name=f'{name}_e6', new_name=name),
+            migrations.AlterField(
+                model_name='deliveryrequest',
+                name=name,
+                field=core.models.MicrodegreeField(blank=True, null=True, db_column=f'{name}_e6'),
+            ),
+        ]
+    return operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_trip_consolidation'),
+    ]
+
+    operations = [
+        # SQLite rebuilds delivery_requests to drop columns, which the search triggers do not survive
+        migrations.RunPython(uninstall_search, install_search, hints=SEARCH_HINTS),
+        *add_microdegree_fields(),
+        migrations.RunPython(to_microdegrees, to_decimal, hints={'model_name': 'deliveryrequest'}),
+        *swap_fields(),
+        migrations.RunPython(install_search, uninstall_search, hints=SEARCH_HINTS),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_microdegree_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='tokens_valid_after',
+            field=models.DateTimeField(blank=True, help_text='Tokens issued before this are refused (password reset, logout everywhere)', null=True),
+        ),
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='BLAKE2b-128 of the token, hex', max_length=32, unique=True)),
+                ('revoked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revoked_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'revoked_tokens',
+                'indexes': [models.Index(fields=['expires_at'], name='revoked_token_expires_idx'), models.Index(fields=['revoked_at'], name='revoked_token_revoked_idx')],
+            },
+        ),
+    ]
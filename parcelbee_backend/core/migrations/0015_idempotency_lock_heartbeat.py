@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_token_revocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='locked_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Refreshed while the first request runs; older in-progress records are abandoned'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_idempotency_lock_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailydeliveryrollup',
+            name='partner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='daily_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
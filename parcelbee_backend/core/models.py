@@ -1,8 +1,14 @@
 from django.db import models
 
 # Create your models here.
-from django.db import models
+import math
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import lookups
+from django import forms
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 
@@ -37,6 +43,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(default=timezone.now)
+    tokens_valid_after = models.DateTimeField(null=True, blank=True,
+                                              help_text="Tokens issued before this are refused (password reset, logout everywhere)")
     
     objects = UserManager()
     
@@ -48,6 +56,60 @@ class User(AbstractBaseUser, PermissionsMixin):
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['-date_joined'], name='users_date_joined_idx'),
+            models.Index(fields=['role', '-date_joined'], name='users_role_joined_idx'),
+        ]
+
+
+class MicrodegreeField(models.IntegerField):
+    """
+    A coordinate stored as an integer number of microdegrees and read back as a float in
+    degrees. It holds exactly what DecimalField(max_digits=9, decimal_places=6) held, and
+    the float is the same one float(Decimal) gave, but rows load without building Decimals.
+    Lookups take degrees. core.coordinates.load_coordinates reads the raw integers in bulk.
+    """
+    SCALE = 1_000_000
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else value / self.SCALE
+
+    def to_python(self, value):
+        if value is None or isinstance(value, float):
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValidationError(f'"{value}" is not a coordinate', code='invalid')
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return round(float(value) * self.SCALE)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'form_class': forms.FloatField, **kwargs})
+
+
+# IntegerField rounds float lookup values to whole numbers before get_prep_value scales them
+MicrodegreeField.register_lookup(lookups.GreaterThanOrEqual)
+MicrodegreeField.register_lookup(lookups.LessThan)
+
+
+class DeliveryRequestQuerySet(models.QuerySet):
+    def located(self, delivery_id):
+        """This queryset on the region database holding delivery_id"""
+        from core.sharding import database_for_delivery
+        return self.using(database_for_delivery(delivery_id))
+
+    def create(self, **kwargs):
+        # QuerySet.create() saves with using=self.db, which would pin every new delivery to
+        # 'default'; only pass a database that was chosen explicitly with .using()
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
 
 
 class DeliveryRequest(models.Model):
@@ -59,15 +121,17 @@ class DeliveryRequest(models.Model):
         ('cancelled', 'Cancelled'),
     )
     
-    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='customer_deliveries')
-    partner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='partner_deliveries')
+    # No database constraints: users stay in 'default' while deliveries live in their region's database
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='customer_deliveries', db_constraint=False)
+    partner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='partner_deliveries', db_constraint=False)
     
     pickup_address = models.TextField()
     drop_address = models.TextField()
-    pickup_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    pickup_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    drop_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    drop_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    pickup_lat = MicrodegreeField(null=True, blank=True, db_column='pickup_lat_e6')
+    pickup_lng = MicrodegreeField(null=True, blank=True, db_column='pickup_lng_e6')
+    drop_lat = MicrodegreeField(null=True, blank=True, db_column='drop_lat_e6')
+    drop_lng = MicrodegreeField(null=True, blank=True, db_column='drop_lng_e6')
+    region = models.CharField(max_length=32, blank=True, default='', help_text="Shard region derived from the pickup point")
     
     description = models.TextField()
     weight = models.DecimalField(max_digits=5, decimal_places=2, help_text="Weight in kg")
@@ -80,9 +144,368 @@ class DeliveryRequest(models.Model):
     accepted_at = models.DateTimeField(null=True, blank=True)
     delivered_at = models.DateTimeField(null=True, blank=True)
     
+    objects = DeliveryRequestQuerySet.as_manager()
+    
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            # Ids come from the shard directory so they stay unique across region databases
+            from core.sharding import allocate_delivery_id, database_for_region, region_for
+            if not self.region:
+                self.region = region_for(self.pickup_lat, self.pickup_lng)
+            using = kwargs['using'] = kwargs.get('using') or database_for_region(self.region)
+            kwargs['force_insert'] = True
+            # The directory row and the delivery are written together; the directory commits
+            # first, so a failed region commit can only leave an unused id behind
+            with transaction.atomic(using=using, savepoint=False), transaction.atomic(using='default', savepoint=False):
+                self.pk = allocate_delivery_id(self.region, using)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return f"Delivery #{self.id} - {self.status}"
     
     class Meta:
         db_table = 'delivery_requests'
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='delivery_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='delivery_status_created_idx'),
+            models.Index(fields=['region'], name='delivery_region_idx'),
+        ]
+
+
+class DeliveryShard(models.Model):
+    """
+    Directory of the database holding each delivery, kept in 'default'. A delivery takes
+    the id of its directory row, which keeps ids unique across region databases.
+    """
+    region = models.CharField(max_length=32, blank=True, default='')
+    database = models.CharField(max_length=100, default='default')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Delivery #{self.id} in {self.database}"
+
+    class Meta:
+        db_table = 'delivery_shards'
+
+class DailyDeliveryRollup(models.Model):
+    """
+    Pre-aggregated delivery metrics per day and partner.
+    Rows with partner=NULL hold events that have no partner yet (deliveries created).
+    """
+    day = models.DateField()
+    partner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='daily_rollups')
+
+    created_count = models.PositiveIntegerField(default=0)
+    accepted_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+
+    # Sums in seconds; averages are sum / count of the matching event
+    accept_latency_total = models.FloatField(default=0)
+    delivery_duration_total = models.FloatField(default=0)
+    delivery_duration_count = models.PositiveIntegerField(default=0)
+
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Rollup {self.day} - partner {self.partner_id}"
+
+    class Meta:
+        db_table = 'delivery_daily_rollups'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'partner'], name='unique_rollup_day_partner'),
+            # NULLs never collide in a unique index, so the unassigned row needs its own
+            models.UniqueConstraint(fields=['day'], condition=models.Q(partner__isnull=True), name='unique_rollup_day_unassigned'),
+        ]
+
+
+class DeliveryEvent(models.Model):
+    """Append-only log of delivery status transitions"""
+    delivery = models.ForeignKey(DeliveryRequest, on_delete=models.CASCADE, related_name='events')
+    status = models.CharField(max_length=20, choices=DeliveryRequest.STATUS_CHOICES)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='delivery_events', db_constraint=False)
+    lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Delivery events are append-only')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Delivery #{self.delivery_id} -> {self.status}"
+
+    class Meta:
+        db_table = 'delivery_events'
+        ordering = ['created_at', 'id']
+        indexes = [
+            models.Index(fields=['delivery', 'created_at'], name='delivery_events_history_idx'),
+        ]
+
+
+class PartnerLocation(models.Model):
+    """Downsampled partner GPS positions persisted from the in-memory location store"""
+    partner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='locations')
+    lat = models.DecimalField(max_digits=9, decimal_places=6)
+    lng = models.DecimalField(max_digits=9, decimal_places=6)
+    recorded_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Partner {self.partner_id} @ {self.lat},{self.lng}"
+
+    class Meta:
+        db_table = 'partner_locations'
+        ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['partner', '-recorded_at'], name='partner_locations_latest_idx'),
+        ]
+
+
+class TariffZone(models.Model):
+    """Rectangular pricing zone; overlapping zones resolve by priority"""
+    name = models.CharField(max_length=100, unique=True)
+    min_lat = models.DecimalField(max_digits=9, decimal_places=6)
+    min_lng = models.DecimalField(max_digits=9, decimal_places=6)
+    max_lat = models.DecimalField(max_digits=9, decimal_places=6)
+    max_lng = models.DecimalField(max_digits=9, decimal_places=6)
+    priority = models.IntegerField(default=0, help_text="Higher wins where zones overlap")
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def cell_count(self, cell_size):
+        """Grid cells the compiled tariff table spends on this zone"""
+        lat_cells = math.floor(float(self.max_lat) / cell_size) - math.floor(float(self.min_lat) / cell_size) + 1
+        lng_cells = math.floor(float(self.max_lng) / cell_size) - math.floor(float(self.min_lng) / cell_size) + 1
+        return max(lat_cells, 0) * max(lng_cells, 0)
+
+    def clean(self):
+        super().clean()
+        if None in (self.min_lat, self.min_lng, self.max_lat, self.max_lng):
+            return
+        if self.min_lat > self.max_lat or self.min_lng > self.max_lng:
+            raise ValidationError('The minimum latitude and longitude must not exceed the maximums.')
+        if not self.is_active:
+            return
+        # Refuse what compile_tariffs would refuse, instead of breaking every price estimate
+        cell_size = getattr(settings, 'PARCELBEE_TARIFF_CELL_DEG', 0.01)
+        max_cells = getattr(settings, 'PARCELBEE_TARIFF_MAX_CELLS', 2_000_000)
+        others = TariffZone.objects.filter(is_active=True).exclude(pk=self.pk)
+        total = self.cell_count(cell_size) + sum(zone.cell_count(cell_size) for zone in others)
+        if total > max_cells:
+            raise ValidationError(
+                f'Active tariff zones would need {total:,} grid cells of {cell_size} degrees; '
+                f'the limit (PARCELBEE_TARIFF_MAX_CELLS) is {max_cells:,}. Make the zone smaller.'
+            )
+
+    class Meta:
+        db_table = 'tariff_zones'
+        ordering = ['-priority', 'name']
+
+
+class TariffRule(models.Model):
+    """Base fee and per-km rate between zones; a blank zone matches anywhere"""
+    pickup_zone = models.ForeignKey(TariffZone, on_delete=models.CASCADE, null=True, blank=True, related_name='pickup_rules')
+    drop_zone = models.ForeignKey(TariffZone, on_delete=models.CASCADE, null=True, blank=True, related_name='drop_rules')
+    base_fee = models.DecimalField(max_digits=8, decimal_places=2)
+    per_km = models.DecimalField(max_digits=8, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.pickup_zone or 'Any'} -> {self.drop_zone or 'Any'}"
+
+    class Meta:
+        db_table = 'tariff_rules'
+        constraints = [
+            models.UniqueConstraint(fields=['pickup_zone', 'drop_zone'], name='unique_tariff_rule_zones'),
+        ]
+
+
+class SurgeWindow(models.Model):
+    """Time-of-day multiplier for quotes picked up in a zone (or anywhere when zone is blank)"""
+    zone = models.ForeignKey(TariffZone, on_delete=models.CASCADE, null=True, blank=True, related_name='surge_windows')
+    start_hour = models.PositiveSmallIntegerField(help_text="0-23, local time")
+    end_hour = models.PositiveSmallIntegerField(help_text="1-24, exclusive; may wrap past midnight")
+    multiplier = models.DecimalField(max_digits=4, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"x{self.multiplier} {self.start_hour}:00-{self.end_hour}:00"
+
+    def clean(self):
+        super().clean()
+        errors = {}
+        if self.start_hour is not None and not 0 <= self.start_hour <= 23:
+            errors['start_hour'] = 'Must be between 0 and 23.'
+        if self.end_hour is not None and not 1 <= self.end_hour <= 24:
+            errors['end_hour'] = 'Must be between 1 and 24.'
+        if not errors and self.start_hour is not None and self.start_hour == self.end_hour:
+            errors['end_hour'] = 'Must differ from the start hour; use 0-24 for a whole day.'
+        if errors:
+            raise ValidationError(errors)
+
+    class Meta:
+        db_table = 'tariff_surge_windows'
+
+
+class WeightSlab(models.Model):
+    """Flat weight fee for parcels up to max_weight kg"""
+    max_weight = models.DecimalField(max_digits=6, decimal_places=2, unique=True)
+    fee = models.DecimalField(max_digits=8, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"<= {self.max_weight} kg: {self.fee}"
+
+    class Meta:
+        db_table = 'tariff_weight_slabs'
+        ordering = ['max_weight']
+
+
+class GeocodedAddress(models.Model):
+    """
+    Geocoding results keyed by normalized address. Shared across deliveries so each
+    unique address is looked up once, and kept across runs so the pipeline can resume.
+    """
+    STATUS_CHOICES = (
+        ('ok', 'OK'),
+        ('failed', 'Failed'),
+    )
+
+    address = models.TextField(unique=True)
+    lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    attempts = models.PositiveSmallIntegerField(default=1)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.address[:40]} ({self.status})"
+
+    class Meta:
+        db_table = 'geocoded_addresses'
+
+
+class Task(models.Model):
+    """Deferred function call stored in the database and run by manage.py run_tasks"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    name = models.CharField(max_length=255, help_text="Dotted path of the task function")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    priority = models.SmallIntegerField(default=0, help_text="Lower runs first")
+    run_at = models.DateTimeField(default=timezone.now)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    wait_ms = models.FloatField(null=True, blank=True, help_text="Time from run_at to start of the last attempt")
+    duration_ms = models.FloatField(null=True, blank=True, help_text="Run time of the last attempt")
+
+    def __str__(self):
+        return f"Task #{self.id} {self.name} ({self.status})"
+
+    class Meta:
+        db_table = 'tasks'
+        indexes = [
+            models.Index(fields=['status', 'priority', 'run_at'], name='tasks_claim_idx'),
+            models.Index(fields=['name', 'status'], name='tasks_name_status_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Stored response for a client-supplied Idempotency-Key, replayed on retries until it expires"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of method, path and body")
+    in_progress = models.BooleanField(default=True)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_content_type = models.CharField(max_length=100, blank=True)
+    response_body = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(default=timezone.now,
+                                     help_text="Refreshed while the first request runs; older in-progress records are abandoned")
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id}:{self.key}"
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_user_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+
+class RevokedToken(models.Model):
+    """A bearer token refused before its expiry (logout, used reset link); kept until it would have expired"""
+    digest = models.CharField(max_length=32, unique=True, help_text="BLAKE2b-128 of the token, hex")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='revoked_tokens')
+    revoked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.digest} (until {self.expires_at:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        db_table = 'revoked_tokens'
+        indexes = [
+            models.Index(fields=['expires_at'], name='revoked_token_expires_idx'),
+            models.Index(fields=['revoked_at'], name='revoked_token_revoked_idx'),
+        ]
+
+
+class Trip(models.Model):
+    """Pending deliveries with nearby pickups heading the same way, offered to partners as one job"""
+    STATUS_CHOICES = (
+        ('offered', 'Offered'),
+        ('accepted', 'Accepted'),
+        ('withdrawn', 'Withdrawn'),
+    )
+
+    delivery_ids = models.JSONField(help_text="Deliveries, nearest drop first; all in one region database")
+    parcel_count = models.PositiveSmallIntegerField()
+    total_weight = models.DecimalField(max_digits=8, decimal_places=2)
+    estimated_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    pickup_lat = models.DecimalField(max_digits=9, decimal_places=6, help_text="Centroid of the pickups")
+    pickup_lng = models.DecimalField(max_digits=9, decimal_places=6)
+    bearing = models.PositiveSmallIntegerField(help_text="Drop direction from the pickups, degrees from north")
+    region = models.CharField(max_length=32, blank=True, default='')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='offered')
+    partner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='trips')
+    created_at = models.DateTimeField(default=timezone.now)
+    accepted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Trip #{self.id} - {self.parcel_count} parcels ({self.status})"
+
+    class Meta:
+        db_table = 'trips'
+        ordering = ['-parcel_count', 'created_at']
+        indexes = [
+            models.Index(fields=['status', '-parcel_count'], name='trips_offered_idx'),
+        ]
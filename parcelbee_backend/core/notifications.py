@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.mail import send_mail
+
+from core.tasks import background_task
+from core.utils import generate_reset_token_payload
+
+
+@background_task
+def send_password_reset_email(email):
+    """
+    Email the password reset link; runs on the task queue, off the request path.
+    The token is minted here so it is never stored in the task's arguments.
+    """
+    reset_token = generate_reset_token_payload(email)
+    frontend_url = getattr(settings, 'PARCELBEE_FRONTEND_URL', 'http://localhost:3000')
+    send_mail(
+        subject='Reset your ParcelBee password',
+        message=(
+            'We received a request to reset your ParcelBee password.\n\n'
+            f'Reset it here (the link expires in 1 hour):\n{frontend_url}/reset-password.html?token={reset_token}\n\n'
+            'If you did not ask for this, you can ignore this email.'
+        ),
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        recipient_list=[email],
+    )
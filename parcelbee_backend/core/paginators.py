@@ -0,0 +1,63 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class CappedCount(int):
+    """A row count that stopped short of the end; templates show it as 10000+"""
+    def __str__(self):
+        return f'{int(self)}+'
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an exact COUNT(*) over a large table.
+    Unfiltered querysets use the database's own row estimate; filtered ones
+    count at most PARCELBEE_ADMIN_COUNT_LIMIT rows past the start of the current
+    page (1-based `page`), so every page up to there stays reachable and the
+    pages further on appear as the user moves forward.
+    """
+    count_limit = 10000
+
+    def __init__(self, object_list, *args, page=None, **kwargs):
+        from django.conf import settings
+        self.count_limit = getattr(settings, 'PARCELBEE_ADMIN_COUNT_LIMIT', self.count_limit)
+        super().__init__(object_list, *args, **kwargs)
+        try:
+            self.count_from = max(int(page) - 1, 0) * self.per_page
+        except (TypeError, ValueError):
+            self.count_from = 0
+
+    def _table_estimate(self):
+        queryset = self.object_list
+        table = queryset.model._meta.db_table
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            elif connection.vendor == 'sqlite':
+                # Rows are rarely deleted here, so the highest rowid is a close upper bound
+                cursor.execute(f'SELECT max(rowid) FROM "{table}"')
+            else:
+                return None
+            row = cursor.fetchone()
+        return row[0] if row and row[0] and row[0] > 0 else None
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+
+        if not queryset.query.where:
+            estimate = self._table_estimate()
+            if estimate is not None and estimate > self.count_limit:
+                return estimate
+
+        # Filtered results: stop counting once the limit is reached
+        limit = self.count_from + self.count_limit
+        count = queryset.order_by()[:limit + 1].count()
+        return CappedCount(limit) if count > limit else count
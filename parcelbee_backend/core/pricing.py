@@ -0,0 +1,235 @@
+import bisect
+import logging
+import math
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from core.models import SurgeWindow, TariffRule, TariffZone, WeightSlab
+
+
+logger = logging.getLogger(__name__)
+
+TARIFF_MODELS = (TariffZone, TariffRule, SurgeWindow, WeightSlab)
+
+# Zone index 0 is "outside every zone"
+NO_ZONE = 0
+
+
+class TariffTable:
+    """
+    Tariff rules compiled for O(1) quotes:
+    - cells: grid cell (lat, lng) -> zone index
+    - rates: rates[pickup_zone][drop_zone] -> (base_fee, per_km)
+    - surge: surge[pickup_zone][hour] -> multiplier
+    - slab_limits / slab_fees: sorted weight slabs
+    """
+    def __init__(self, cell_size, zone_names, cells, rates, surge, slab_limits, slab_fees, per_kg, version):
+        self.cell_size = cell_size
+        self.zone_names = zone_names
+        self.cells = cells
+        self.rates = rates
+        self.surge = surge
+        self.slab_limits = slab_limits
+        self.slab_fees = slab_fees
+        self.per_kg = per_kg
+        self.version = version
+
+    def cell(self, lat, lng):
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def zone_at(self, lat, lng):
+        if lat is None or lng is None:
+            return NO_ZONE
+        return self.cells.get(self.cell(lat, lng), NO_ZONE)
+
+    def weight_fee(self, weight):
+        if not self.slab_limits:
+            return weight * self.per_kg
+        i = bisect.bisect_left(self.slab_limits, weight)
+        if i < len(self.slab_limits):
+            return self.slab_fees[i]
+        # Heavier than the top slab: top slab fee plus the per-kg rate for the excess
+        return self.slab_fees[-1] + (weight - self.slab_limits[-1]) * self.per_kg
+
+    def quote(self, distance_km, weight, pickup=(None, None), drop=(None, None), hour=None):
+        """Price a trip; pickup/drop are (lat, lng) or (None, None) when geocoding failed"""
+        pickup_zone = self.zone_at(*pickup)
+        drop_zone = self.zone_at(*drop)
+        base_fee, per_km = self.rates[pickup_zone][drop_zone]
+        if hour is None:
+            hour = timezone.localtime().hour
+        multiplier = self.surge[pickup_zone][hour]
+
+        distance_fee = distance_km * per_km
+        weight_fee = self.weight_fee(weight)
+        subtotal = (base_fee + distance_fee + weight_fee) * multiplier
+
+        return {
+            "base_fee": base_fee,
+            "distance_km": round(distance_km, 3),
+            "distance_fee": round(distance_fee, 2),
+            "weight_fee": round(weight_fee, 2),
+            "surge_multiplier": multiplier,
+            "pickup_zone": self.zone_names[pickup_zone],
+            "drop_zone": self.zone_names[drop_zone],
+            "subtotal": round(subtotal, 2),
+            "tariff_version": self.version,
+        }
+
+
+def _hours(start, end):
+    """Hours covered by [start, end), wrapping past midnight"""
+    start, end = start % 24, end % 24 or 24
+    if start < end:
+        return range(start, end)
+    return list(range(start, 24)) + list(range(0, end))
+
+
+def current_version():
+    """Cheap fingerprint of the tariff tables: row count and last change per table"""
+    signature = []
+    for model in TARIFF_MODELS:
+        stats = model.objects.aggregate(rows=Count('id'), changed=Max('updated_at'))
+        signature.append((stats['rows'], stats['changed'].isoformat() if stats['changed'] else None))
+    return format(zlib.crc32(repr(signature).encode()), '08x')
+
+
+def compile_tariffs(version=None):
+    """Load every tariff rule and compile the lookup tables"""
+    cell_size = getattr(settings, "PARCELBEE_TARIFF_CELL_DEG", 0.01)
+    max_cells = getattr(settings, "PARCELBEE_TARIFF_MAX_CELLS", 2_000_000)
+    default_base = getattr(settings, "PARCELBEE_BASE_FEE", 30.0)
+    default_per_km = getattr(settings, "PARCELBEE_PER_KM", 10.0)
+    per_kg = getattr(settings, "PARCELBEE_PER_KG", 5.0)
+
+    zones = list(TariffZone.objects.filter(is_active=True).order_by('priority', 'id'))
+    index = {zone.id: i + 1 for i, zone in enumerate(zones)}
+    zone_names = [None] + [zone.name for zone in zones]
+
+    # Paint low priority first so higher priority zones overwrite overlapping cells
+    cells = {}
+    for zone in zones:
+        lat0 = math.floor(float(zone.min_lat) / cell_size)
+        lat1 = math.floor(float(zone.max_lat) / cell_size)
+        lng0 = math.floor(float(zone.min_lng) / cell_size)
+        lng1 = math.floor(float(zone.max_lng) / cell_size)
+        if zone.cell_count(cell_size) + len(cells) > max_cells:
+            raise ValueError(f"Tariff zone {zone.name} exceeds PARCELBEE_TARIFF_MAX_CELLS")
+        for lat_cell in range(lat0, lat1 + 1):
+            for lng_cell in range(lng0, lng1 + 1):
+                cells[(lat_cell, lng_cell)] = index[zone.id]
+
+    size = len(zone_names)
+    default_rate = (float(default_base), float(default_per_km))
+    rates = [[default_rate] * size for _ in range(size)]
+
+    # Apply rules from least to most specific: any->any, any->zone, zone->any, zone->zone
+    def specificity(rule):
+        return (rule.pickup_zone_id is not None) * 2 + (rule.drop_zone_id is not None)
+
+    rules = [rule for rule in TariffRule.objects.all()
+             if rule.pickup_zone_id in index or rule.pickup_zone_id is None
+             if rule.drop_zone_id in index or rule.drop_zone_id is None]
+    for rule in sorted(rules, key=specificity):
+        rate = (float(rule.base_fee), float(rule.per_km))
+        pickups = [index[rule.pickup_zone_id]] if rule.pickup_zone_id else range(size)
+        drops = [index[rule.drop_zone_id]] if rule.drop_zone_id else range(size)
+        for p in pickups:
+            for d in drops:
+                rates[p][d] = rate
+
+    surge = [[1.0] * 24 for _ in range(size)]
+    windows = sorted(SurgeWindow.objects.all(), key=lambda w: w.zone_id is not None)
+    for window in windows:
+        if window.zone_id is not None and window.zone_id not in index:
+            continue
+        if window.start_hour == window.end_hour:
+            # Empty, not all day; SurgeWindow.clean() refuses these but older rows may exist
+            continue
+        targets = [index[window.zone_id]] if window.zone_id else range(size)
+        for z in targets:
+            for hour in _hours(window.start_hour, window.end_hour):
+                surge[z][hour] = float(window.multiplier)
+
+    slabs = list(WeightSlab.objects.order_by('max_weight'))
+
+    return TariffTable(
+        cell_size=cell_size,
+        zone_names=zone_names,
+        cells=cells,
+        rates=rates,
+        surge=surge,
+        slab_limits=[float(slab.max_weight) for slab in slabs],
+        slab_fees=[float(slab.fee) for slab in slabs],
+        per_kg=float(per_kg),
+        version=version or current_version(),
+    )
+
+
+def default_table():
+    """Settings-only tariffs: no zones, surge or slabs; quoted while no compiled table exists"""
+    default_rate = (float(getattr(settings, "PARCELBEE_BASE_FEE", 30.0)),
+                    float(getattr(settings, "PARCELBEE_PER_KM", 10.0)))
+    return TariffTable(
+        cell_size=getattr(settings, "PARCELBEE_TARIFF_CELL_DEG", 0.01),
+        zone_names=[None],
+        cells={},
+        rates=[[default_rate]],
+        surge=[[1.0] * 24],
+        slab_limits=[],
+        slab_fees=[],
+        per_kg=float(getattr(settings, "PARCELBEE_PER_KG", 5.0)),
+        version="defaults",
+    )
+
+
+class TariffEngine:
+    """
+    Holds the compiled table for this process.
+    Local admin edits invalidate it through model signals; edits made by other
+    workers are picked up by re-checking the version every reload_interval seconds.
+    If a new version fails to compile, the previous table keeps serving quotes and
+    compilation is retried at the next check.
+    """
+    def __init__(self, reload_interval=10.0):
+        self.reload_interval = reload_interval
+        self._table = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def invalidate(self, **kwargs):
+        self._checked_at = float('-inf')
+
+    def table(self):
+        now = time.monotonic()
+        if self._table is not None and now - self._checked_at < self.reload_interval:
+            return self._table
+        with self._lock:
+            if self._table is not None and now - self._checked_at < self.reload_interval:
+                return self._table
+            version = current_version()
+            if self._table is None or self._table.version != version:
+                try:
+                    self._table = compile_tariffs(version)
+                except Exception:
+                    logger.exception("Could not compile tariff version %s; keeping the previous table", version)
+                    if self._table is None:
+                        self._table = default_table()
+            self._checked_at = now
+        return self._table
+
+    def quote(self, distance_km, weight, pickup=(None, None), drop=(None, None), hour=None):
+        return self.table().quote(distance_km, weight, pickup, drop, hour)
+
+
+engine = TariffEngine(reload_interval=getattr(settings, "PARCELBEE_TARIFF_RELOAD_SECONDS", 10.0))
+
+for _model in TARIFF_MODELS:
+    post_save.connect(engine.invalidate, sender=_model, dispatch_uid=f'tariff_reload_{_model.__name__}')
+    post_delete.connect(engine.invalidate, sender=_model, dispatch_uid=f'tariff_delete_{_model.__name__}')
@@ -0,0 +1,218 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+from core.utils import authenticate_request
+
+
+PROFILE_ID = re.compile(r'^\d{10}-[0-9a-f]{8}$')
+# cProfile allows one active profiler per process, so profiled requests take turns
+_profiling = threading.Lock()
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PARCELBEE_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def profile_paths(profile_id):
+    """(summary .json, raw .prof) for a profile id; None for anything that is not one"""
+    if not PROFILE_ID.match(profile_id or ''):
+        return None
+    base = profile_dir() / profile_id
+    return base.with_suffix('.json'), base.with_suffix('.prof')
+
+
+class QueryLog:
+    """execute_wrapper recording each statement's SQL (not its parameters) and duration"""
+    def __init__(self):
+        self.queries = []
+
+    def wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.queries.append({
+                    'database': alias,
+                    'sql': sql,
+                    'many': many,
+                    'ms': round((time.perf_counter() - started) * 1000, 3),
+                })
+        return record
+
+
+def _label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return f'{name} ({os.path.basename(filename)}:{lineno})'
+
+
+def _stack(frame):
+    """Labels of frame and its callers, outermost first"""
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(_label((code.co_filename, code.co_firstlineno, code.co_name)))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample another thread's Python stack every interval seconds. cProfile only keeps
+    caller->callee totals, so these samples are what the flamegraph ('folded' stacks) is built from.
+    """
+    def __init__(self, thread_id, interval, skip):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.skip = skip  # frames above the middleware, identical in every sample
+        self.samples = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[';'.join(_stack(frame)[self.skip:])] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def folded(self):
+        return [f'{stack} {count}' for stack, count in self.samples.most_common()]
+
+
+def top_functions(stats, limit=40):
+    rows = []
+    for func, (cc, nc, own, total, _) in stats.stats.items():
+        rows.append({
+            'function': _label(func),
+            'calls': nc,
+            'primitive_calls': cc,
+            'own_ms': round(own * 1000, 3),
+            'cumulative_ms': round(total * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+def save_profile(profiler, sampler, queries, request, response, user, elapsed):
+    """Write the summary and raw stats; returns the profile id"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f'{int(time.time())}-{secrets.token_hex(4)}'
+    summary_path, stats_path = profile_paths(profile_id)
+
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(stats_path)
+    summary = {
+        'id': profile_id,
+        'created_at': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'route': request.resolver_match.url_name if request.resolver_match else None,
+        'status': response.status_code,
+        'user_id': user.id,
+        'duration_ms': round(elapsed * 1000, 3),
+        'sql_count': len(queries),
+        'sql_ms': round(sum(query['ms'] for query in queries), 3),
+        'sql': queries,
+        'functions': top_functions(stats),
+        'sample_interval_ms': sampler.interval * 1000,
+        'folded': sampler.folded(),
+    }
+    summary_path.write_text(json.dumps(summary), encoding='utf-8')
+    prune_profiles(directory, getattr(settings, 'PARCELBEE_PROFILE_KEEP', 50))
+    return profile_id
+
+
+def prune_profiles(directory, keep):
+    summaries = sorted(directory.glob('*.json'), key=lambda path: path.name, reverse=True)
+    for path in summaries[keep:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.prof').unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Summaries of stored profiles without their call data, newest first"""
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), key=lambda path: path.name, reverse=True):
+        try:
+            summary = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        for key in ('sql', 'functions', 'folded'):
+            summary.pop(key, None)
+        profiles.append(summary)
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Profile a single request when it carries PARCELBEE_PROFILE_HEADER and an admin JWT:
+    the request runs under cProfile and a stack sampler with every SQL statement timed, and
+    the result is saved under PARCELBEE_PROFILE_DIR. The response carries X-Profile-Id; fetch the profile from
+    /api/admin/profiles/<id>/. Requests without the header pay for one dict lookup.
+    Only the request thread is profiled: scatter-gather shard queries and the body of a
+    streaming response are not included.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'PARCELBEE_PROFILING', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        header = getattr(settings, 'PARCELBEE_PROFILE_HEADER', 'X-Parcelbee-Profile')
+        self.meta_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.sample_interval = getattr(settings, 'PARCELBEE_PROFILE_SAMPLE_MS', 1) / 1000
+
+    def __call__(self, request):
+        if not request.META.get(self.meta_key):
+            return self.get_response(request)
+
+        user, error = authenticate_request(request)
+        if error is not None or user.role != 'admin':
+            # Not ours to reject: the view answers as it would without the header
+            return self.get_response(request)
+        if not _profiling.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Profile-Skipped'] = 'busy'
+            return response
+
+        try:
+            log = QueryLog()
+            profiler = cProfile.Profile()
+            sampler = StackSampler(threading.get_ident(), self.sample_interval, len(_stack(sys._getframe())))
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(log.wrapper(alias)))
+                started = time.perf_counter()
+                sampler.start()
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+                    sampler.stop()
+                elapsed = time.perf_counter() - started
+            response['X-Profile-Id'] = save_profile(profiler, sampler, log.queries, request, response, user, elapsed)
+        finally:
+            _profiling.release()
+        return response
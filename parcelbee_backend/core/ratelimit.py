@@ -0,0 +1,165 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from core.utils import json_response
+
+
+class LocalBackend:
+    """
+    Sliding-window counters in a per-process dict, least recently used first:
+    key -> [window_start, previous, current, window]. Cheapest option; limits are per worker process.
+    Never holds more than max_keys counters: when full, counters two of their own windows
+    old are dropped, and if that frees too little the least recently used ones are evicted.
+    """
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, window, now):
+        """Count one request and return (previous, current) for the window containing now"""
+        start = now - now % window
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None:
+                if len(self._counters) >= self.max_keys:
+                    self._purge(now)
+                entry = self._counters[key] = [start, 0, 0, window]
+            else:
+                self._counters.move_to_end(key)
+                if entry[0] != start:
+                    entry[1] = entry[2] if entry[0] == start - window else 0
+                    entry[2] = 0
+                    entry[0] = start
+            entry[2] += 1
+            return entry[1], entry[2]
+
+    def undo(self, key, window, now):
+        """Take back a hit() made with the same arguments"""
+        start = now - now % window
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is not None and entry[0] == start and entry[2] > 0:
+                entry[2] -= 1
+
+    def _purge(self, now):
+        # A counter two of its own windows old no longer affects any count
+        self._counters = OrderedDict((k, v) for k, v in self._counters.items() if v[0] > now - 2 * v[3])
+        # Still (nearly) full of live counters: evict the least recently used, leaving
+        # enough room that the next full scan is max_keys / 10 new keys away
+        keep = self.max_keys - max(self.max_keys // 10, 1)
+        while len(self._counters) > keep:
+            self._counters.popitem(last=False)
+
+
+class CacheBackend:
+    """Counters in a Django cache (PARCELBEE_RATE_LIMIT_CACHE), shared by every worker using it"""
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def hit(self, key, window, now):
+        start = int(now - now % window)
+        current_key = f'rl:{key}:{start}'
+        previous_key = f'rl:{key}:{start - int(window)}'
+        # add() is a no-op when the key exists; incr() is atomic in memcached/redis
+        self.cache.add(current_key, 0, timeout=int(window * 2) + 1)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            self.cache.set(current_key, 1, timeout=int(window * 2) + 1)
+            current = 1
+        return self.cache.get(previous_key, 0), current
+
+    def undo(self, key, window, now):
+        start = int(now - now % window)
+        try:
+            self.cache.decr(f'rl:{key}:{start}')
+        except ValueError:
+            pass
+
+
+def sliding_window(previous, current, limit, window, elapsed):
+    """
+    Sliding-window counter check. The previous window's count is weighted by how much
+    of it still overlaps the sliding window. Returns (allowed, retry_after_seconds).
+    """
+    estimated = previous * (1 - elapsed / window) + current
+    if estimated <= limit:
+        return True, 0
+    if current > limit or not previous:
+        return False, max(math.ceil(window - elapsed), 1)
+    # Time until the previous window's share decays enough to admit this request
+    needed = window * (1 - (limit - current) / previous)
+    return False, max(math.ceil(needed - elapsed), 1)
+
+
+class RateLimitMiddleware:
+    """
+    Per-route limits from PARCELBEE_RATE_LIMITS, keyed by URL name:
+        {'login': [{'scope': 'ip', 'limit': 10, 'window': 60}], ...}
+    scope is 'ip' (client address), 'user' (JWT user id, falls back to ip) or 'route' (all callers).
+    Requests over a limit get 429 with Retry-After and never reach the view; they are
+    not counted, so a client retrying too early does not push its own limit further out.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = getattr(settings, 'PARCELBEE_RATE_LIMITS', {})
+        self.trust_forwarded = getattr(settings, 'PARCELBEE_RATE_LIMIT_TRUST_XFF', False)
+        backend = getattr(settings, 'PARCELBEE_RATE_LIMIT_BACKEND', 'core.ratelimit.LocalBackend')
+        options = getattr(settings, 'PARCELBEE_RATE_LIMIT_BACKEND_OPTIONS', {})
+        self.backend = import_string(backend)(**options)
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def client_ip(self, request):
+        if self.trust_forwarded:
+            forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+            if forwarded:
+                return forwarded.split(',')[0].strip()
+        return request.META.get('REMOTE_ADDR', '')
+
+    def user_key(self, request):
+        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+        if auth_header.startswith('Bearer '):
+            from core.utils import decode_jwt
+            payload = decode_jwt(auth_header[7:])
+            if payload:
+                return f"user:{payload['user_id']}"
+        return f'ip:{self.client_ip(request)}'
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        rules = self.rules.get(match.url_name) if match else None
+        if not rules:
+            return None
+
+        now = time.time()
+        counted = []
+        for rule in rules:
+            scope = rule.get('scope', 'ip')
+            if scope == 'ip':
+                subject = f'ip:{self.client_ip(request)}'
+            elif scope == 'user':
+                subject = self.user_key(request)
+            else:
+                subject = 'route'
+            key, window = f'{match.url_name}:{subject}', rule['window']
+            # Count first and take it back on rejection: with a shared cache, incr() is
+            # what stops concurrent requests from all fitting under the limit
+            previous, current = self.backend.hit(key, window, now)
+            counted.append((key, window))
+            allowed, retry_after = sliding_window(previous, current, rule['limit'], window, now % window)
+            if not allowed:
+                for key, window in counted:
+                    self.backend.undo(key, window, now)
+                response = json_response({'error': 'Too many requests', 'retry_after': retry_after}, status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+        return None
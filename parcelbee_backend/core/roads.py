@@ -0,0 +1,332 @@
+import csv
+import heapq
+import logging
+import math
+import pickle
+import random
+import threading
+from array import array
+from pathlib import Path
+
+from django.conf import settings
+
+from core.utils import haversine_km
+
+
+logger = logging.getLogger(__name__)
+
+INF = float('inf')
+FORMAT_VERSION = 1
+
+
+def _csr(node_count, edges):
+    """Compressed sparse rows from (u, v, w) edges: offsets[u]..offsets[u+1] index targets/weights"""
+    counts = [0] * (node_count + 1)
+    for u, _, _ in edges:
+        counts[u + 1] += 1
+    for i in range(node_count):
+        counts[i + 1] += counts[i]
+    offsets = array('q', counts)
+    targets = array('q', bytes(8 * len(edges)))
+    weights = array('f', bytes(4 * len(edges)))
+    cursor = list(counts[:-1])
+    for u, v, w in edges:
+        position = cursor[u]
+        targets[position] = v
+        weights[position] = w
+        cursor[u] += 1
+    return offsets, targets, weights
+
+
+def _dijkstra(offsets, targets, weights, source, node_count):
+    """Full single-source shortest paths; used to precompute landmark distances"""
+    dist = array('d', [INF]) * node_count
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for i in range(offsets[u], offsets[u + 1]):
+            v = targets[i]
+            nd = d + weights[i]
+            if nd < dist[v]:
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    # Stored as float32 to halve the table size; the rounding is far below a metre
+    return array('f', dist)
+
+
+class RoadGraph:
+    """
+    Directed road graph in array-backed CSR form, with ALT (A*, landmarks and the
+    triangle inequality) distance tables and a grid index for snapping coordinates.
+    Edge weights are metres.
+    """
+    def __init__(self, lat, lng, forward, reverse, landmarks=(), from_landmark=(), to_landmark=(), cell_deg=0.005):
+        self.lat = lat
+        self.lng = lng
+        self.forward = forward
+        self.reverse = reverse
+        self.landmarks = list(landmarks)
+        self.from_landmark = list(from_landmark)  # d(L, v)
+        self.to_landmark = list(to_landmark)      # d(v, L)
+        self.cell_deg = cell_deg
+        self._build_grid()
+
+    @property
+    def node_count(self):
+        return len(self.lat)
+
+    # Loading and saving
+
+    @classmethod
+    def from_edge_list(cls, path, landmarks=16, seed=0):
+        """
+        Build from a CSV edge list with header u,v,u_lat,u_lng,v_lat,v_lng[,length_m][,oneway].
+        Missing lengths are the straight-line distance; oneway is 1/true/yes for one-way streets.
+        """
+        index = {}
+        lat = array('d')
+        lng = array('d')
+
+        def node(external_id, node_lat, node_lng):
+            internal = index.get(external_id)
+            if internal is None:
+                internal = index[external_id] = len(lat)
+                lat.append(float(node_lat))
+                lng.append(float(node_lng))
+            return internal
+
+        forward_edges = []
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                u = node(row['u'], row['u_lat'], row['u_lng'])
+                v = node(row['v'], row['v_lat'], row['v_lng'])
+                if u == v:
+                    continue
+                length = row.get('length_m')
+                length = float(length) if length else haversine_km(lat[u], lng[u], lat[v], lng[v]) * 1000
+                forward_edges.append((u, v, length))
+                if str(row.get('oneway', '')).strip().lower() not in ('1', 'true', 'yes'):
+                    forward_edges.append((v, u, length))
+
+        count = len(lat)
+        forward = _csr(count, forward_edges)
+        reverse = _csr(count, [(v, u, w) for u, v, w in forward_edges])
+        graph = cls(lat, lng, forward, reverse)
+        graph.build_landmarks(landmarks, seed=seed)
+        return graph
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'version': FORMAT_VERSION,
+                'lat': self.lat, 'lng': self.lng,
+                'forward': self.forward, 'reverse': self.reverse,
+                'landmarks': self.landmarks,
+                'from_landmark': self.from_landmark, 'to_landmark': self.to_landmark,
+                'cell_deg': self.cell_deg,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Load a graph compiled by build_road_graph (a trusted local file), or build from a .csv"""
+        if Path(path).suffix == '.csv':
+            return cls.from_edge_list(path)
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError(f'{path} was built by an incompatible version; rebuild it')
+        data.pop('version')
+        return cls(**data)
+
+    # Landmarks
+
+    def build_landmarks(self, count, seed=0):
+        """Farthest-first landmark selection, then forward and reverse Dijkstra from each"""
+        n = self.node_count
+        if n == 0 or count <= 0:
+            return
+        rng = random.Random(seed)
+        current = rng.randrange(n)
+        self.landmarks, self.from_landmark, self.to_landmark = [], [], []
+        nearest = array('f', [INF]) * n
+        for _ in range(min(count, n)):
+            self.landmarks.append(current)
+            from_dist = _dijkstra(*self.forward, current, n)
+            self.from_landmark.append(from_dist)
+            self.to_landmark.append(_dijkstra(*self.reverse, current, n))
+            best, best_distance = None, -1.0
+            for v in range(n):
+                d = from_dist[v]
+                if d < nearest[v]:
+                    nearest[v] = d
+                if nearest[v] != INF and nearest[v] > best_distance and v not in self.landmarks:
+                    best, best_distance = v, nearest[v]
+            if best is None:
+                break
+            current = best
+
+    def _heuristic(self, target, active):
+        to_t = [self.to_landmark[i][target] for i in active]
+        from_t = [self.from_landmark[i][target] for i in active]
+        pairs = list(zip(active, to_t, from_t))
+
+        def h(v):
+            best = 0.0
+            for i, to_target, from_target in pairs:
+                a = self.to_landmark[i][v] - to_target      # d(v,L) - d(t,L)
+                b = from_target - self.from_landmark[i][v]  # d(L,t) - d(L,v)
+                bound = a if a > b else b
+                if bound > best and bound != INF:
+                    best = bound
+            return best
+        return h
+
+    def _active_landmarks(self, source, target, k=4):
+        """The k landmarks giving the tightest bound for this pair"""
+        scored = []
+        for i in range(len(self.landmarks)):
+            a = self.to_landmark[i][source] - self.to_landmark[i][target]
+            b = self.from_landmark[i][target] - self.from_landmark[i][source]
+            bound = max(a, b)
+            if bound != INF and bound == bound:
+                scored.append((bound, i))
+        scored.sort(reverse=True)
+        return [i for _, i in scored[:k]]
+
+    # Snapping
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def _build_grid(self):
+        grid = {}
+        for v in range(self.node_count):
+            grid.setdefault(self._cell(self.lat[v], self.lng[v]), array('q')).append(v)
+        self._grid = grid
+
+    def nearest_node(self, lat, lng, max_rings=20):
+        """(node, distance_km) of the closest node, searching grid rings outward"""
+        row, col = self._cell(lat, lng)
+        best, best_km = None, INF
+        for ring in range(max_rings + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    for v in self._grid.get((r, c), ()):
+                        km = haversine_km(lat, lng, self.lat[v], self.lng[v])
+                        if km < best_km:
+                            best, best_km = v, km
+            # Anything in a further ring is at least `ring` cells away
+            if best is not None and best_km <= ring * self.cell_deg * 111.0 * math.cos(math.radians(lat)):
+                break
+        return best, best_km
+
+    # Queries
+
+    def node_distance(self, source, target):
+        """Shortest path length in metres between two nodes with ALT A*; INF if unreachable"""
+        if source == target:
+            return 0.0
+        offsets, targets, weights = self.forward
+        h = self._heuristic(target, self._active_landmarks(source, target)) if self.landmarks else (lambda v: 0.0)
+        dist = {source: 0.0}
+        heap = [(h(source), 0.0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u == target:
+                return d
+            if d > dist.get(u, INF):
+                continue
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                nd = d + weights[i]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd + h(v), nd, v))
+        return INF
+
+    def node_distances(self, source, destinations):
+        """One-to-many: one Dijkstra that stops once every destination is settled"""
+        offsets, targets, weights = self.forward
+        remaining = set(destinations)
+        found = {}
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if d > dist.get(u, INF):
+                continue
+            if u in remaining:
+                remaining.discard(u)
+                found[u] = d
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                nd = d + weights[i]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return [found.get(v, INF) for v in destinations]
+
+    def distance_km(self, origin, destination, max_snap_km=1.0):
+        """
+        Road distance between two (lat, lng) points, including the straight-line hop
+        to the snapped nodes. None when a point is off the network or unreachable.
+        """
+        return self.distances_km(origin, [destination], max_snap_km)[0]
+
+    def distances_km(self, origin, destinations, max_snap_km=1.0):
+        source, source_km = self.nearest_node(*origin)
+        if source is None or source_km > max_snap_km:
+            return [None] * len(destinations)
+        snapped = [self.nearest_node(*point) for point in destinations]
+        nodes = [node for node, km in snapped if node is not None and km <= max_snap_km]
+        if len(nodes) == 1:
+            metres = {nodes[0]: self.node_distance(source, nodes[0])}
+        else:
+            metres = dict(zip(nodes, self.node_distances(source, nodes)))
+
+        results = []
+        for node, km in snapped:
+            if node is None or km > max_snap_km or metres.get(node, INF) == INF:
+                results.append(None)
+            else:
+                results.append(source_km + metres[node] / 1000 + km)
+        return results
+
+
+_graph = None
+_graph_lock = threading.Lock()
+_graph_failed = False
+
+
+def get_graph():
+    """The graph from PARCELBEE_ROAD_GRAPH, loaded once per worker; None when not configured"""
+    global _graph, _graph_failed
+    if _graph is not None or _graph_failed:
+        return _graph
+    path = getattr(settings, 'PARCELBEE_ROAD_GRAPH', None)
+    if not path:
+        return None
+    with _graph_lock:
+        if _graph is None and not _graph_failed:
+            try:
+                _graph = RoadGraph.load(path)
+            except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+                logger.exception('Could not load road graph %s; using straight-line distances', path)
+                _graph_failed = True
+    return _graph
+
+
+def trip_distance_km(p_lat, p_lng, d_lat, d_lng):
+    """(km, source): road distance when the graph covers both points, else haversine"""
+    graph = get_graph()
+    if graph is not None:
+        max_snap = getattr(settings, 'PARCELBEE_ROAD_SNAP_MAX_KM', 1.0)
+        km = graph.distance_km((p_lat, p_lng), (d_lat, d_lng), max_snap_km=max_snap)
+        if km is not None:
+            return km, 'road'
+    return haversine_km(p_lat, p_lng, d_lat, d_lng), 'haversine'
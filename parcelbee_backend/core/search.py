@@ -0,0 +1,308 @@
+import abc
+import heapq
+import itertools
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from core.models import DeliveryRequest, User
+from core.sharding import delivery_databases, is_sharded, scatter
+
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN.findall(query.lower())[:10]
+
+
+class SearchBackend(abc.ABC):
+    """
+    Full-text search over delivery addresses, descriptions and customer/partner names.
+    search() returns (total_matches, [(rank, delivery id)] best first) for one page of one
+    database; ranks from the same backend compare across databases, lower is better.
+    Region databases have no users table, so install(names=False) indexes them without names.
+    """
+    def install(self, cursor, names=True):
+        """Create the index structures; called from the migration"""
+
+    def uninstall(self, cursor):
+        """Drop what install() created"""
+
+    def rebuild(self, cursor, names=True):
+        """Re-index every delivery"""
+
+    @abc.abstractmethod
+    def search(self, query, limit=20, offset=0, using='default'):
+        """(total matches, [(rank, delivery id)] best first) for one page"""
+
+    def filter(self, queryset, query):
+        """Restrict a DeliveryRequest queryset to matches, e.g. for the admin changelist"""
+        total, hits = self.search(query, limit=getattr(settings, 'PARCELBEE_SEARCH_FILTER_LIMIT', 1000))
+        return queryset.filter(id__in=[delivery_id for _, delivery_id in hits])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    FTS5 table delivery_search whose rowid is the delivery id. Triggers on
+    delivery_requests and users keep it current on every write, including
+    queryset.update() and bulk_update(), which model signals would miss.
+    In a region database the name columns stay empty: it holds no users to join.
+    """
+    TABLE = 'delivery_search'
+
+    COLUMNS = "pickup_address, drop_address, description, customer_name, partner_name"
+
+    SELECT_ROW = """
+        SELECT d.id, d.pickup_address, d.drop_address, d.description, c.name, COALESCE(p.name, '')
+        FROM delivery_requests d
+        JOIN users c ON c.id = d.customer_id
+        LEFT JOIN users p ON p.id = d.partner_id
+    """
+
+    SELECT_ROW_WITHOUT_NAMES = """
+        SELECT d.id, d.pickup_address, d.drop_address, d.description, '', ''
+        FROM delivery_requests d
+    """
+
+    def install(self, cursor, names=True):
+        select_row = self.SELECT_ROW if names else self.SELECT_ROW_WITHOUT_NAMES
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} USING fts5(
+                {self.COLUMNS}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS delivery_search_insert AFTER INSERT ON delivery_requests BEGIN
+                INSERT INTO {self.TABLE}(rowid, {self.COLUMNS}) {select_row} WHERE d.id = new.id;
+            END
+        """)
+        # Status updates are the hottest write path and do not touch indexed text
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS delivery_search_update
+            AFTER UPDATE OF pickup_address, drop_address, description, customer_id, partner_id ON delivery_requests BEGIN
+                DELETE FROM {self.TABLE} WHERE rowid = old.id;
+                INSERT INTO {self.TABLE}(rowid, {self.COLUMNS}) {select_row} WHERE d.id = new.id;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS delivery_search_delete AFTER DELETE ON delivery_requests BEGIN
+                DELETE FROM {self.TABLE} WHERE rowid = old.id;
+            END
+        """)
+        if not names:
+            return
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS delivery_search_user_rename AFTER UPDATE OF name ON users BEGIN
+                DELETE FROM {self.TABLE} WHERE rowid IN (
+                    SELECT id FROM delivery_requests WHERE customer_id = new.id OR partner_id = new.id
+                );
+                INSERT INTO {self.TABLE}(rowid, {self.COLUMNS}) {select_row}
+                    WHERE d.customer_id = new.id OR d.partner_id = new.id;
+            END
+        """)
+
+    def uninstall(self, cursor):
+        for trigger in ('delivery_search_insert', 'delivery_search_update',
+                        'delivery_search_delete', 'delivery_search_user_rename'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cursor.execute(f"DROP TABLE IF EXISTS {self.TABLE}")
+
+    def rebuild(self, cursor, names=True):
+        select_row = self.SELECT_ROW if names else self.SELECT_ROW_WITHOUT_NAMES
+        cursor.execute(f"DELETE FROM {self.TABLE}")
+        cursor.execute(f"INSERT INTO {self.TABLE}(rowid, {self.COLUMNS}) {select_row}")
+
+    def match_expression(self, query):
+        """Quote every token so user input cannot inject FTS syntax; the last one matches as a prefix"""
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        quoted = [f'"{token}"' for token in tokens]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if expression is None:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {self.TABLE} WHERE {self.TABLE} MATCH %s", [expression]
+        ))
+
+    def search(self, query, limit=20, offset=0, using='default'):
+        expression = self.match_expression(query)
+        if expression is None:
+            return 0, []
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {self.TABLE} WHERE {self.TABLE} MATCH %s", [expression])
+            total = cursor.fetchone()[0]
+            # bm25 column weights: addresses matter most, then names, then description
+            cursor.execute(
+                f"SELECT bm25({self.TABLE}, 4.0, 4.0, 1.0, 2.0, 2.0) AS rank, rowid FROM {self.TABLE} "
+                f"WHERE {self.TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s",
+                [expression, limit, offset]
+            )
+            hits = [tuple(row) for row in cursor.fetchall()]
+        return total, hits
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    tsvector search backed by a GIN expression index on delivery_requests.
+    Names live in another table and cannot be part of an expression index, so they are not searched.
+    """
+    VECTOR = ("to_tsvector('simple', coalesce(pickup_address, '') || ' ' || "
+              "coalesce(drop_address, '') || ' ' || coalesce(description, ''))")
+
+    def install(self, cursor, names=True):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS delivery_search_gin ON delivery_requests USING gin ({self.VECTOR})")
+
+    def uninstall(self, cursor):
+        cursor.execute("DROP INDEX IF EXISTS delivery_search_gin")
+
+    def tsquery(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        return ' & '.join(tokens[:-1] + [tokens[-1] + ':*'])
+
+    def filter(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if tsquery is None:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT id FROM delivery_requests WHERE {self.VECTOR} @@ to_tsquery('simple', %s)", [tsquery]
+        ))
+
+    def search(self, query, limit=20, offset=0, using='default'):
+        tsquery = self.tsquery(query)
+        if tsquery is None:
+            return 0, []
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM delivery_requests WHERE {self.VECTOR} @@ to_tsquery('simple', %s)",
+                [tsquery]
+            )
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                f"SELECT -ts_rank({self.VECTOR}, to_tsquery('simple', %s)) AS rank, id FROM delivery_requests "
+                f"WHERE {self.VECTOR} @@ to_tsquery('simple', %s) ORDER BY rank, id DESC LIMIT %s OFFSET %s",
+                [tsquery, tsquery, limit, offset]
+            )
+            hits = [tuple(row) for row in cursor.fetchall()]
+        return total, hits
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Unindexed fallback: every token must appear in one of the searched columns, newest first.
+    With region databases, names are matched in 'default' first and the deliveries by user id.
+    """
+    FIELDS = ('pickup_address', 'drop_address', 'description')
+    NAME_FIELDS = ('customer', 'partner')
+
+    def filter(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        for token in tokens:
+            condition = Q()
+            for field in self.FIELDS:
+                condition |= Q(**{f'{field}__icontains': token})
+            if is_sharded():
+                users = list(User.objects.filter(name__icontains=token).values_list('id', flat=True))
+                for field in self.NAME_FIELDS:
+                    condition |= Q(**{f'{field}_id__in': users})
+            else:
+                for field in self.NAME_FIELDS:
+                    condition |= Q(**{f'{field}__name__icontains': token})
+            queryset = queryset.filter(condition)
+        return queryset
+
+    def search(self, query, limit=20, offset=0, using='default'):
+        deliveries = self.filter(DeliveryRequest.objects.using(using), query)
+        total = deliveries.count()
+        rows = deliveries.order_by('-created_at', '-id').values_list('created_at', 'id')[offset:offset + limit]
+        return total, [(-created_at.timestamp(), delivery_id) for created_at, delivery_id in rows]
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    """PARCELBEE_SEARCH_BACKEND (dotted path) wins, otherwise pick by database vendor"""
+    path = getattr(settings, 'PARCELBEE_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS.get(vendor or connection.vendor, LikeSearchBackend)()
+
+
+# Lets the router run the search migration steps in region databases too
+SEARCH_HINTS = {'model_name': 'deliveryrequest'}
+
+
+def has_users(db_connection):
+    """False for region databases, which hold deliveries but not the users table"""
+    return User._meta.db_table in db_connection.introspection.table_names()
+
+
+def install_search(apps, schema_editor):
+    """Migration step: create the index on the database being migrated and fill it"""
+    backend = get_backend(schema_editor.connection.vendor)
+    names = has_users(schema_editor.connection)
+    with schema_editor.connection.cursor() as cursor:
+        backend.install(cursor, names)
+        backend.rebuild(cursor, names)
+
+
+def uninstall_search(apps, schema_editor):
+    """Migration step: drop the index, e.g. before SQLite rebuilds delivery_requests"""
+    backend = get_backend(schema_editor.connection.vendor)
+    with schema_editor.connection.cursor() as cursor:
+        backend.uninstall(cursor)
+
+
+def search_deliveries(query, page=1, page_size=20):
+    """
+    One page of ranked results as (total, [DeliveryRequest]) with customer/partner loaded.
+    Every delivery database returns its best hits up to the end of the page; the ranked
+    lists are merged and the page cut from the merge.
+    """
+    backend = get_backend()
+    offset = (page - 1) * page_size
+    databases = delivery_databases()
+    if len(databases) == 1:
+        total, hits = backend.search(query, limit=page_size, offset=offset)
+        hits = [(rank, delivery_id, 'default') for rank, delivery_id in hits]
+    else:
+        def search(alias):
+            total, hits = backend.search(query, limit=offset + page_size, using=alias)
+            return total, [(rank, delivery_id, alias) for rank, delivery_id in hits]
+
+        parts = scatter(search, databases)
+        total = sum(part[0] for part in parts)
+        merged = heapq.merge(*(part[1] for part in parts), key=lambda hit: hit[0])
+        hits = list(itertools.islice(merged, offset, offset + page_size))
+
+    by_database = defaultdict(list)
+    for _, delivery_id, alias in hits:
+        by_database[alias].append(delivery_id)
+    found = {}
+    for alias, ids in by_database.items():
+        deliveries = DeliveryRequest.objects.using(alias)
+        # Users live in 'default'; region databases are joined to them by a second query
+        if alias == 'default':
+            deliveries = deliveries.select_related('customer', 'partner')
+        else:
+            deliveries = deliveries.prefetch_related('customer', 'partner')
+        found.update(deliveries.in_bulk(ids))
+    return total, [found[delivery_id] for _, delivery_id, _ in hits if delivery_id in found]
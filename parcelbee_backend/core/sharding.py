@@ -0,0 +1,240 @@
+import heapq
+import itertools
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+
+from core.models import DeliveryEvent, DeliveryRequest, DeliveryShard
+
+
+# Models stored in the region databases; everything else lives in 'default'
+SHARDED_MODELS = {'deliveryrequest', 'deliveryevent'}
+
+_executor = None
+
+
+def region_for(lat, lng):
+    """Key of the PARCELBEE_REGIONS box containing the pickup point; '' when none does"""
+    if lat is None or lng is None:
+        return ''
+    lat, lng = float(lat), float(lng)
+    for key, (min_lat, min_lng, max_lat, max_lng) in getattr(settings, 'PARCELBEE_REGIONS', {}).items():
+        if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+            return key
+    return ''
+
+
+def database_for_region(region):
+    return getattr(settings, 'PARCELBEE_REGION_DATABASES', {}).get(region, 'default')
+
+
+def delivery_databases():
+    """Every database that holds deliveries, 'default' first"""
+    databases = ['default']
+    for alias in getattr(settings, 'PARCELBEE_REGION_DATABASES', {}).values():
+        if alias not in databases:
+            databases.append(alias)
+    return databases
+
+
+def is_sharded():
+    return len(delivery_databases()) > 1
+
+
+def allocate_delivery_id(region, database=None):
+    """
+    Reserve a delivery id in the shard directory. Ids come from one table in 'default'
+    so they stay unique across region databases and keep working as API identifiers.
+    """
+    return DeliveryShard.objects.using('default').create(
+        region=region, database=database or database_for_region(region)
+    ).id
+
+
+def database_for_delivery(delivery_id):
+    """Database holding delivery_id; deliveries missing from the directory predate sharding"""
+    if not is_sharded():
+        return 'default'
+    database = DeliveryShard.objects.using('default').filter(id=delivery_id).values_list('database', flat=True).first()
+    return database or 'default'
+
+
+def databases_for_deliveries(delivery_ids):
+    """Group ids by the database holding them: {alias: [ids]}"""
+    if not is_sharded():
+        return {'default': list(delivery_ids)} if delivery_ids else {}
+    located = dict(
+        DeliveryShard.objects.using('default').filter(id__in=delivery_ids).values_list('id', 'database')
+    )
+    grouped = defaultdict(list)
+    for delivery_id in delivery_ids:
+        grouped[located.get(delivery_id, 'default')].append(delivery_id)
+    return dict(grouped)
+
+
+def _run_on(func, alias):
+    # Pool threads own their connections; close them on the same terms as a request would
+    close_old_connections()
+    try:
+        return func(alias)
+    finally:
+        close_old_connections()
+
+
+def scatter(func, databases=None):
+    """Call func(alias) for every delivery database, concurrently when there are several"""
+    global _executor
+    databases = databases or delivery_databases()
+    if len(databases) == 1:
+        return [func(databases[0])]
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'PARCELBEE_SHARD_WORKERS', 8), thread_name_prefix='shard'
+        )
+    return list(_executor.map(lambda alias: _run_on(func, alias), databases))
+
+
+def gather(queryset, key, reverse=False, limit=None):
+    """
+    Evaluate an ordered queryset on every delivery database and merge the results.
+    key must produce the same order the queryset sorts by. With a limit, each database
+    returns at most that many rows and only the first limit of the merge are kept.
+    """
+    if limit is not None:
+        queryset = queryset[:limit]
+    parts = scatter(lambda alias: list(queryset.using(alias)))
+    if len(parts) == 1:
+        return parts[0]
+    return list(itertools.islice(heapq.merge(*parts, key=key, reverse=reverse), limit))
+
+
+def status_counts():
+    """Delivery counts per status summed over every delivery database"""
+    def count(alias):
+        return DeliveryRequest.objects.using(alias).order_by().values_list('status').annotate(total=Count('id'))
+
+    totals = Counter()
+    for rows in scatter(lambda alias: list(count(alias))):
+        for status, total in rows:
+            totals[status] += total
+    return totals
+
+
+def move_deliveries(deliveries, source, target):
+    """
+    Copy deliveries (loaded from source) and their events to target, repoint the
+    directory and delete the originals. Not safe against concurrent writes to the
+    same deliveries, so run rebalancing when the affected regions are quiet.
+    """
+    ids = [delivery.id for delivery in deliveries]
+    events = list(DeliveryEvent.objects.using(source).filter(delivery_id__in=ids).order_by('id'))
+    for event in events:
+        # Event ids are only unique within one database
+        event.pk = None
+    updated_at = {delivery.id: delivery.updated_at for delivery in deliveries}
+
+    with transaction.atomic(using=target):
+        DeliveryRequest.objects.using(target).bulk_create(deliveries)
+        # bulk_create stamps auto_now fields; keep the original modification times
+        for delivery in deliveries:
+            delivery.updated_at = updated_at[delivery.id]
+        DeliveryRequest.objects.using(target).bulk_update(deliveries, ['updated_at'])
+        DeliveryEvent.objects.using(target).bulk_create(events)
+
+    located = set(DeliveryShard.objects.using('default').filter(id__in=ids).values_list('id', flat=True))
+    by_region = defaultdict(list)
+    for delivery in deliveries:
+        by_region[delivery.region].append(delivery.id)
+    for region, region_ids in by_region.items():
+        DeliveryShard.objects.using('default').filter(id__in=region_ids).update(region=region, database=target)
+    DeliveryShard.objects.using('default').bulk_create([
+        DeliveryShard(id=delivery.id, region=delivery.region, database=target)
+        for delivery in deliveries if delivery.id not in located
+    ])
+
+    with transaction.atomic(using=source):
+        DeliveryRequest.objects.using(source).filter(id__in=ids).delete()
+    return len(ids)
+
+
+def rebalance(databases=None, batch_size=500, dry_run=False):
+    """
+    Recompute every delivery's region from its pickup coordinates and move the ones
+    whose region now maps to a different database. Also used for the initial split of
+    the single database into regions. Returns {(source, target): deliveries}.
+    """
+    moved = Counter()
+    for source in databases or delivery_databases():
+        last_id = 0
+        while True:
+            batch = list(DeliveryRequest.objects.using(source).filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            relabelled = []
+            outgoing = defaultdict(list)
+            for delivery in batch:
+                region = region_for(delivery.pickup_lat, delivery.pickup_lng)
+                target = database_for_region(region)
+                if region != delivery.region:
+                    delivery.region = region
+                    relabelled.append(delivery)
+                if target != source:
+                    outgoing[target].append(delivery)
+                    moved[(source, target)] += 1
+
+            if dry_run:
+                continue
+            staying = [delivery for delivery in relabelled if database_for_region(delivery.region) == source]
+            if staying:
+                DeliveryRequest.objects.using(source).bulk_update(staying, ['region'])
+                by_region = defaultdict(list)
+                for delivery in staying:
+                    by_region[delivery.region].append(delivery.id)
+                for region, region_ids in by_region.items():
+                    DeliveryShard.objects.using('default').filter(id__in=region_ids).update(region=region)
+            for target, deliveries in outgoing.items():
+                move_deliveries(deliveries, source, target)
+    return dict(moved)
+
+
+class DeliveryRouter:
+    """
+    Routes DeliveryRequest, and the DeliveryEvent rows stored beside it, to the database of
+    the delivery's region (PARCELBEE_REGION_DATABASES); every other model uses 'default'.
+    Saving an instance finds its database on its own. Queries have nothing to route by,
+    so they read 'default' unless pointed at a shard with DeliveryRequest.objects.located()
+    or .using(); the admin-wide views use scatter()/gather() to read every region.
+    """
+    def _route(self, model, hints):
+        if model._meta.model_name not in SHARDED_MODELS:
+            return 'default' if is_sharded() else None
+        instance = hints.get('instance')
+        if instance is None or instance._meta.model_name not in SHARDED_MODELS:
+            return None
+        if instance._state.db:
+            return instance._state.db
+        if isinstance(instance, DeliveryRequest):
+            return database_for_region(instance.region or region_for(instance.pickup_lat, instance.pickup_lng))
+        return database_for_delivery(instance.delivery_id)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users live in 'default' while their deliveries may not
+        if obj1._meta.model_name in SHARDED_MODELS or obj2._meta.model_name in SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db not in delivery_databases():
+            return None
+        return app_label == 'core' and model_name in SHARDED_MODELS
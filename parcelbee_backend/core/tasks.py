@@ -0,0 +1,204 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Avg, Count, F, Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Task
+
+
+logger = logging.getLogger(__name__)
+
+
+def _task_path(func):
+    if isinstance(func, str):
+        return func
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, priority=0, delay=None, max_attempts=3, **kwargs):
+    """
+    Store a call to func(*args, **kwargs) for a worker to run.
+    func is a module-level function or its dotted path; arguments must be JSON serializable.
+    """
+    run_at = timezone.now() + timedelta(seconds=delay) if delay else timezone.now()
+    return Task.objects.create(
+        name=_task_path(func),
+        args=list(args),
+        kwargs=kwargs,
+        priority=priority,
+        run_at=run_at,
+        max_attempts=max_attempts,
+    )
+
+
+def background_task(func):
+    """Decorator adding func.delay(*args, **kwargs) as a shortcut for enqueue(func, ...)"""
+    def delay(*args, **kwargs):
+        return enqueue(func, *args, **kwargs)
+    func.delay = delay
+    return func
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter: base, 2*base, 4*base ... capped"""
+    base = getattr(settings, 'PARCELBEE_TASK_RETRY_BASE_SECONDS', 5.0)
+    cap = getattr(settings, 'PARCELBEE_TASK_RETRY_MAX_SECONDS', 600.0)
+    return min(base * 2 ** (attempts - 1), cap) * random.uniform(0.8, 1.2)
+
+
+def lease_seconds():
+    return getattr(settings, 'PARCELBEE_TASK_LEASE_SECONDS', 300)
+
+
+def renew_leases(worker_ids):
+    """Extend the lease on every task these (live) workers are running"""
+    return Task.objects.filter(status='running', locked_by__in=worker_ids).update(locked_at=timezone.now())
+
+
+def requeue_stale(lease=None):
+    """
+    Take back tasks whose lease expired because their worker died mid-run.
+    attempts was counted when the task was claimed, so a task that keeps killing
+    its worker fails once it has used up max_attempts instead of looping forever.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=lease or lease_seconds())
+    stale = Task.objects.filter(status='running', locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_by='', locked_at=None, finished_at=now,
+        last_error='Worker died or stopped renewing its lease on the last attempt',
+    )
+    if failed:
+        logger.warning('%s tasks failed: their worker died on the last attempt', failed)
+    return stale.update(status='queued', locked_by='', locked_at=None, last_error='Worker lease expired')
+
+
+def claim(worker_id, limit=1):
+    """
+    Atomically move up to `limit` due tasks to running and return them.
+    Uses SELECT ... FOR UPDATE SKIP LOCKED where supported; elsewhere (SQLite)
+    each candidate is claimed with a conditional UPDATE that only one worker can win.
+    The attempt is counted here, before the task runs, so it counts even if the worker dies.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status='queued', run_at__lte=now).order_by('priority', 'run_at', 'id')
+    claimed_fields = {'status': 'running', 'locked_by': worker_id, 'locked_at': now, 'started_at': now}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            tasks = list(due.select_for_update(skip_locked=True)[:limit])
+            if tasks:
+                Task.objects.filter(id__in=[task.id for task in tasks]).update(
+                    attempts=F('attempts') + 1, **claimed_fields)
+    else:
+        tasks = []
+        for task in due[:limit * 4]:
+            if Task.objects.filter(id=task.id, status='queued').update(attempts=F('attempts') + 1, **claimed_fields):
+                tasks.append(task)
+                if len(tasks) >= limit:
+                    break
+
+    for task in tasks:
+        for field, value in claimed_fields.items():
+            setattr(task, field, value)
+        task.attempts += 1
+    return tasks
+
+
+def execute(task):
+    """
+    Run one claimed task and record the outcome and its timings. The outcome is only saved while
+    this worker still holds the lease; if requeue_stale took the task back meanwhile (the run
+    outlived the lease without renewals), it belongs to its next claim and None is returned.
+    """
+    started = time.perf_counter()
+    task.wait_ms = max((task.started_at - task.run_at).total_seconds() * 1000, 0.0)
+    try:
+        func = import_string(task.name)
+        func(*task.args, **task.kwargs)
+    except Exception as e:
+        task.duration_ms = (time.perf_counter() - started) * 1000
+        task.last_error = ''.join(traceback.format_exception_only(type(e), e)).strip()[:2000]
+        if task.attempts < task.max_attempts:
+            task.status = 'queued'
+            task.run_at = timezone.now() + timedelta(seconds=backoff_seconds(task.attempts))
+        else:
+            task.status = 'failed'
+            task.finished_at = timezone.now()
+        logger.warning('Task #%s %s failed (attempt %s/%s): %s',
+                       task.id, task.name, task.attempts, task.max_attempts, task.last_error)
+    else:
+        task.duration_ms = (time.perf_counter() - started) * 1000
+        task.status = 'done'
+        task.finished_at = timezone.now()
+        task.last_error = ''
+
+    # The same guard as renew_leases: only the worker running the task may touch it
+    held = Task.objects.filter(id=task.id, status='running', locked_by=task.locked_by).update(
+        status=task.status, run_at=task.run_at, last_error=task.last_error, locked_by='', locked_at=None,
+        finished_at=task.finished_at, wait_ms=task.wait_ms, duration_ms=task.duration_ms,
+    )
+    task.locked_by = ''
+    task.locked_at = None
+    if not held:
+        logger.warning('Task #%s %s lost its lease while running; its outcome (%s) was not saved',
+                       task.id, task.name, task.status)
+        return None
+    return task.status
+
+
+class Worker(threading.Thread):
+    """Polls for due tasks and runs them one at a time"""
+    def __init__(self, number, stop_event, poll_interval=1.0, burst=False):
+        super().__init__(name=f'task-worker-{number}', daemon=True)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{number}'
+        self.stop_event = stop_event
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.processed = 0
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                tasks = claim(self.worker_id)
+                if not tasks:
+                    if self.burst:
+                        break
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                for task in tasks:
+                    execute(task)
+                    self.processed += 1
+        finally:
+            connection.close()
+
+
+def task_metrics(since=None):
+    """Per task name: counts by status and timing of finished attempts"""
+    tasks = Task.objects.all()
+    if since:
+        tasks = tasks.filter(created_at__gte=since)
+    return list(
+        tasks.values('name').annotate(
+            total=Count('id'),
+            queued=Count('id', filter=Q(status='queued')),
+            running=Count('id', filter=Q(status='running')),
+            done=Count('id', filter=Q(status='done')),
+            failed=Count('id', filter=Q(status='failed')),
+            avg_duration_ms=Avg('duration_ms'),
+            max_duration_ms=Max('duration_ms'),
+            avg_wait_ms=Avg('wait_ms'),
+            max_wait_ms=Max('wait_ms'),
+        ).order_by('name')
+    )
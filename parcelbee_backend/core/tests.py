@@ -1,3 +1,1103 @@
-from django.test import TestCase
+import csv
+import json
+import pstats
+import tempfile
+import threading
+import time
+from pathlib import Path
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+
+from core.admin import DeliveryRequestAdmin
+from core.admission import RouteGate
+from core.analytics import rebuild_rollups
+from core.assets import minify_css, minify_js
+from core.consolidation import PendingJobs, cluster, consolidate
+from core.eta import EtaModel, FEATURES, iter_history
+from core.events import build_event, record_events, rebuild_state
+from core.exports import filter_deliveries, stream_deliveries
+from core.geocoding import geocode_missing
+from core.idempotency import _refresh_lock, idempotent, purge_expired as purge_idempotency_keys
+from core.locations import LocationStore, latest_location, purge_expired as purge_locations
+from core.management.commands.check_query_budgets import (
+    SCENARIOS, baseline_path, budget_problems, growth_problem, run_scenarios, uncovered_routes,
+)
+from core.management.commands.replay_traffic import Fixtures
+from core.management.commands.startup_profile import parse_importtime, route_method
+from core.models import (
+    DailyDeliveryRollup, DeliveryEvent, DeliveryRequest, DeliveryShard, GeocodedAddress, IdempotencyKey, PartnerLocation, RevokedToken, SurgeWindow, Task, TariffZone, Trip, User,
+)
+from core.pricing import TariffEngine
+from core.profiling import StackSampler, profile_dir
+from core.search import search_deliveries
+from core.ratelimit import LocalBackend, RateLimitMiddleware
+from core.tasks import claim, enqueue, execute, renew_leases, requeue_stale
+from core.tokens import cache as token_cache, revocations
+from core.traffic import rehydrate, sanitize
+from core.utils import generate_jwt, generate_reset_token_payload, lazy_view, verify_reset_token
+from core.warmup import _close_connections_before_fork, warmup
+
+
+@override_settings(PARCELBEE_RATE_LIMITS={})
+class ApiTestCase(TestCase):
+    """Users of each role and helpers for calling the JSON API as one of them"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = User.objects.create_user(email='customer@test.invalid', password='secret12',
+                                                name='Customer', role='customer')
+        cls.partner = User.objects.create_user(email='partner@test.invalid', password='secret12',
+                                               name='Partner', role='partner')
+        cls.admin = User.objects.create_user(email='admin@test.invalid', password='secret12',
+                                             name='Admin', role='admin')
+
+    def call(self, method, path, body=None, user=None, token=None, **extra):
+        token = token or (generate_jwt(user) if user else None)
+        if token:
+            extra['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+        data = json.dumps(body) if body is not None else ''
+        return self.client.generic(method, path, data, content_type='application/json', **extra)
+
+    def delivery(self, status='pending', partner=None, **fields):
+        delivery = DeliveryRequest.objects.create(**{
+            'customer': self.customer, 'partner': partner, 'status': status,
+            'pickup_address': '1 Test Road', 'drop_address': '2 Test Street', 'description': 'Test parcel',
+            'weight': 2, 'estimated_price': 100, 'pickup_lat': 12.97, 'pickup_lng': 77.59, 'drop_lat': 12.99, 'drop_lng': 77.61,
+            **fields,
+        })
+        record_events([build_event(delivery, 'pending', actor=self.customer, at=delivery.created_at)])
+        if status != 'pending':
+            record_events([build_event(delivery, status, actor=partner, at=delivery.updated_at)])
+        return delivery
+
+
+class DeliveryEventTests(ApiTestCase):
+    def update_status(self, delivery, **body):
+        return self.call('PUT', f'/api/delivery/{delivery.id}/update-status/', body, user=self.partner)
+
+    def test_invalid_coordinates_are_rejected_before_saving(self):
+        delivery = self.delivery('accepted', partner=self.partner)
+        for lat, lng in (('abc', 77.6), (1000, 77.6), (12.9, None), (float('nan'), 77.6), ({'x': 1}, 77.6)):
+            with self.subTest(lat=lat, lng=lng):
+                # NaN is not valid JSON, so send it the way a sloppy client would
+                body = json.dumps({'status': 'in_transit', 'lat': lat, 'lng': lng})
+                response = self.client.put(f'/api/delivery/{delivery.id}/update-status/', body,
+                                           content_type='application/json',
+                                           HTTP_AUTHORIZATION=f'Bearer {generate_jwt(self.partner)}')
+                self.assertEqual(response.status_code, 400)
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, 'accepted')
+        self.assertEqual(DeliveryEvent.objects.filter(delivery_id=delivery.id).count(), 2)
+
+    def test_event_is_readable_as_soon_as_the_request_returns(self):
+        delivery = self.delivery('accepted', partner=self.partner)
+        self.assertEqual(self.update_status(delivery, status='in_transit', lat=12.98, lng=77.6).status_code, 200)
+
+        history = self.call('GET', f'/api/delivery/{delivery.id}/history/', user=self.customer).json()
+        self.assertEqual([event['status'] for event in history['events']], ['pending', 'accepted', 'in_transit'])
+        self.assertEqual(history['events'][-1]['lat'], 12.98)
+
+    def test_status_change_rolls_back_when_its_event_cannot_be_written(self):
+        delivery = self.delivery('accepted', partner=self.partner)
+        with mock.patch('core.views.record_event', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.update_status(delivery, status='in_transit')
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, 'accepted')
+
+    def test_rebuild_agrees_with_status_updates(self):
+        delivery = self.delivery('accepted', partner=self.partner)
+        DeliveryRequest.objects.filter(id=delivery.id).update(accepted_at=delivery.updated_at)
+        for status in ('in_transit', 'delivered'):
+            self.assertEqual(self.update_status(delivery, status=status).status_code, 200)
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.delivered_at, DeliveryEvent.objects.filter(delivery_id=delivery.id).last().created_at)
+        self.assertEqual(rebuild_state([delivery.id]), [])
+
+    def test_rebuild_leaves_rows_changed_after_their_last_event(self):
+        drifted = self.delivery('accepted', partner=self.partner)
+        # A write the log never saw, e.g. an edit in the admin
+        DeliveryRequest.objects.filter(id=drifted.id).update(
+            status='delivered', updated_at=timezone.now() + timedelta(minutes=5))
+        stale = self.delivery('accepted', partner=self.partner)
+        DeliveryRequest.objects.filter(id=stale.id).update(
+            status='pending', partner=None, updated_at=stale.updated_at)
+
+        skipped = []
+        changed = rebuild_state(skipped=skipped)
+
+        self.assertEqual(changed, [stale.id])
+        self.assertEqual(skipped, [drifted.id])
+        self.assertEqual(DeliveryRequest.objects.get(id=drifted.id).status, 'delivered')
+        self.assertEqual(DeliveryRequest.objects.get(id=stale.id).status, 'accepted')
+
+
+class PartnerLocationTests(ApiTestCase):
+    def setUp(self):
+        # The location store is per process; give each test an empty one
+        patcher = mock.patch('core.locations.store', LocationStore())
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.driver = self.partner
+
+    def post_fixes(self, body):
+        return self.client.post('/api/partner/location/', body, content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {generate_jwt(self.driver)}')
+
+    def test_bad_timestamps_are_rejected(self):
+        for ts in ('NaN', 'Infinity', '-1e20', '-1', '"soon"'):
+            with self.subTest(ts=ts):
+                response = self.post_fixes(f'{{"fixes": [{{"lat": 12.9, "lng": 77.6, "ts": {ts}}}]}}')
+                self.assertEqual(response.status_code, 400)
+        self.assertIsNone(self.store.get(self.driver.id))
+
+    def test_future_timestamps_are_clamped(self):
+        self.assertEqual(self.post_fixes(json.dumps({'fixes': [{'lat': 12.9, 'lng': 77.6, 'ts': 1e15}]})).status_code, 202)
+        self.assertLessEqual(self.store.get(self.driver.id)[2], time.time())
+
+    def test_newer_persisted_sample_beats_this_workers_fix(self):
+        now = time.time()
+        self.store.update(self.driver.id, 12.90, 77.60, now - 120)
+        PartnerLocation.objects.create(partner=self.driver, lat=12.95, lng=77.65,
+                                       recorded_at=timezone.now() - timedelta(seconds=10))
+        location = latest_location(self.driver.id)
+        self.assertEqual((location['source'], location['lat']), ('persisted', 12.95))
+
+        self.store.update(self.driver.id, 12.99, 77.69, now)
+        location = latest_location(self.driver.id)
+        self.assertEqual((location['source'], location['lat']), ('live', 12.99))
+
+    def test_purge_keeps_recent_samples(self):
+        PartnerLocation.objects.create(partner=self.driver, lat=1, lng=1, recorded_at=timezone.now() - timedelta(days=40))
+        recent = PartnerLocation.objects.create(partner=self.driver, lat=2, lng=2, recorded_at=timezone.now())
+        self.assertEqual(purge_locations(days=30), 1)
+        self.assertEqual(list(PartnerLocation.objects.filter(partner=self.driver)), [recent])
+
+
+class BulkStatusUpdateTests(ApiTestCase):
+    def test_bad_coordinates_fail_only_their_item(self):
+        good = self.delivery('accepted', partner=self.partner)
+        bad = self.delivery('accepted', partner=self.partner)
+        far = self.delivery('accepted', partner=self.partner)
+        response = self.call('PATCH', '/api/delivery/bulk-update-status/', {'updates': [
+            {'delivery_id': good.id, 'status': 'in_transit', 'lat': 12.98, 'lng': 77.6},
+            {'delivery_id': bad.id, 'status': 'in_transit', 'lat': 'abc', 'lng': 77.6},
+            {'delivery_id': far.id, 'status': 'in_transit', 'lat': 1000, 'lng': 77.6},
+        ]}, user=self.partner)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['updated'], body['failed']), (1, 2))
+        self.assertEqual([result['ok'] for result in body['results']], [True, False, False])
+        self.assertEqual(DeliveryRequest.objects.get(id=good.id).status, 'in_transit')
+        self.assertEqual(DeliveryRequest.objects.get(id=bad.id).status, 'accepted')
+        self.assertEqual(DeliveryRequest.objects.get(id=far.id).status, 'accepted')
+        self.assertEqual(DeliveryEvent.objects.filter(delivery_id=good.id, status='in_transit').count(), 1)
+
+
+class AnalyticsTests(ApiTestCase):
+    def rollups(self):
+        rows = DailyDeliveryRollup.objects.order_by('day', 'partner_id').values()
+        return [{field: round(value, 3) if isinstance(value, float) else value
+                 for field, value in row.items() if field != 'id'} for row in rows]
+
+    def create(self):
+        response = self.call('POST', '/api/delivery/create/', {
+            'pickup_address': '1 Test Road', 'drop_address': '2 Test Street', 'description': 'Test parcel',
+            'weight': 2, 'estimated_price': 100,
+        }, user=self.customer)
+        return response.json()['delivery']['id']
+
+    def update(self, delivery_id, status):
+        response = self.call('PUT', f'/api/delivery/{delivery_id}/update-status/', {'status': status}, user=self.partner)
+        self.assertEqual(response.status_code, 200)
+
+    def test_incremental_rollups_match_backfill(self):
+        delivered, reopened, cancelled, bulk = (self.create() for _ in range(4))
+        for delivery_id in (delivered, reopened, cancelled, bulk):
+            self.assertEqual(self.call('POST', f'/api/delivery/{delivery_id}/accept/', user=self.partner).status_code, 200)
+        self.update(delivered, 'delivered')
+        for status in ('delivered', 'in_transit', 'delivered'):
+            self.update(reopened, status)
+        for status in ('cancelled', 'accepted'):
+            self.update(cancelled, status)
+        for status in ('delivered', 'in_transit', 'cancelled'):
+            self.call('PATCH', '/api/delivery/bulk-update-status/', {'updates': [
+                {'delivery_id': bulk, 'status': status},
+            ]}, user=self.partner)
+
+        incremental = self.rollups()
+        self.assertEqual(sum(row['delivered_count'] for row in incremental), 2)
+        self.assertEqual(sum(row['cancelled_count'] for row in incremental), 1)
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_rollup_commits_with_the_delivery(self):
+        with mock.patch('core.views.record_transition', side_effect=DatabaseError('disk full')):
+            self.assertEqual(self.call('POST', '/api/delivery/create/', {
+                'pickup_address': '1 Test Road', 'drop_address': '2 Test Street', 'description': 'Test parcel',
+                'weight': 2,
+            }, user=self.customer).status_code, 500)
+        self.assertFalse(DeliveryRequest.objects.exists())
+
+    def test_deleting_a_partner_keeps_their_history_in_the_totals(self):
+        delivery_id = self.create()
+        self.call('POST', f'/api/delivery/{delivery_id}/accept/', user=self.partner)
+        self.update(delivery_id, 'delivered')
+
+        self.partner.delete()
+        totals = DailyDeliveryRollup.objects.get()
+        self.assertIsNone(totals.partner_id)
+        self.assertEqual((totals.created_count, totals.accepted_count, totals.delivered_count), (1, 1, 1))
+        rebuild_rollups()
+        self.assertEqual((totals.created_count, totals.accepted_count, totals.delivered_count),
+                         tuple(DailyDeliveryRollup.objects.values_list(
+                             'created_count', 'accepted_count', 'delivered_count').get()))
+
+
+@override_settings(PARCELBEE_TARIFF_CELL_DEG=0.01, PARCELBEE_TARIFF_MAX_CELLS=10_000)
+class TariffTests(TestCase):
+    def zone(self, name, size, **fields):
+        return TariffZone(name=name, min_lat=12, min_lng=77, max_lat=12 + size, max_lng=77 + size, **fields)
+
+    def test_zone_too_large_for_the_grid_is_refused(self):
+        self.zone('Small', 0.5).full_clean()
+        with self.assertRaises(ValidationError):
+            self.zone('Huge', 5).full_clean()
+        with self.assertRaises(ValidationError):
+            TariffZone(name='Inverted', min_lat=13, min_lng=77, max_lat=12, max_lng=78).full_clean()
+
+    def test_previous_table_keeps_serving_when_compilation_fails(self):
+        engine = TariffEngine(reload_interval=0)
+        self.zone('City', 0.5).save()
+        table = engine.table()
+        self.assertEqual(engine.quote(1, 1, pickup=(12.1, 77.1))['pickup_zone'], 'City')
+
+        # Saved without full_clean(), as a script or shell session would
+        self.zone('Huge', 5, priority=1).save()
+        with self.assertLogs('core.pricing', 'ERROR'):
+            self.assertIs(engine.table(), table)
+            self.assertEqual(engine.quote(1, 1, pickup=(12.1, 77.1))['pickup_zone'], 'City')
+
+    def test_defaults_are_quoted_when_nothing_has_compiled_yet(self):
+        self.zone('Huge', 5).save()
+        with self.assertLogs('core.pricing', 'ERROR'):
+            quote = TariffEngine(reload_interval=0).quote(2, 1)
+        self.assertEqual(quote['tariff_version'], 'defaults')
+
+    def test_surge_window_hours(self):
+        SurgeWindow(start_hour=0, end_hour=24, multiplier=1.5).full_clean()
+        SurgeWindow(start_hour=22, end_hour=2, multiplier=1.5).full_clean()
+        for start, end in ((8, 8), (24, 3), (3, 0)):
+            with self.subTest(start=start, end=end), self.assertRaises(ValidationError):
+                SurgeWindow(start_hour=start, end_hour=end, multiplier=1.5).full_clean()
+
+        SurgeWindow.objects.create(start_hour=8, end_hour=8, multiplier=3)
+        SurgeWindow.objects.create(start_hour=22, end_hour=2, multiplier=1.5)
+        engine = TariffEngine(reload_interval=0)
+        self.assertEqual([engine.quote(1, 1, hour=hour)['surge_multiplier'] for hour in (8, 23, 1, 2)],
+                         [1.0, 1.5, 1.5, 1.0])
+
+
+@override_settings(PARCELBEE_ADMIN_COUNT_LIMIT=3)
+class AdminPaginationTests(ApiTestCase):
+    def setUp(self):
+        for _ in range(8):
+            self.delivery()
+        staff = User.objects.create_user(email='staff@test.invalid', password='secret12', name='Staff',
+                                         role='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        patcher = mock.patch.object(DeliveryRequestAdmin, 'list_per_page', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_capped_count_is_shown_as_a_lower_bound(self):
+        response = self.client.get('/admin/core/deliveryrequest/?status__exact=pending')
+        self.assertContains(response, '3+ delivery requests')
+
+    def test_pages_past_the_count_limit_open(self):
+        response = self.client.get('/admin/core/deliveryrequest/?status__exact=pending&p=4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        self.assertContains(response, '8 delivery requests')
+
+
+def _crash_worker():
+    raise SystemExit('worker killed')
+
+
+def _do_nothing():
+    pass
+
+
+class TaskQueueTests(ApiTestCase):
+    def expire_lease(self, task):
+        Task.objects.filter(id=task.id).update(locked_at=timezone.now() - timedelta(seconds=301))
+
+    def test_reset_email_task_stores_no_token(self):
+        self.call('POST', '/api/password/forgot/', {'email': self.customer.email})
+        task = Task.objects.get(name='core.notifications.send_password_reset_email')
+        self.assertEqual(task.args, [self.customer.email])
+
+        self.assertEqual(execute(claim('test')[0]), 'done')
+        token = mail.outbox[0].body.split('token=')[1].split()[0]
+        self.assertEqual(verify_reset_token(token)['email'], self.customer.email)
+
+    def test_task_that_kills_its_worker_fails_after_max_attempts(self):
+        task = enqueue(_crash_worker, max_attempts=2)
+        self.assertEqual(claim('test')[0].attempts, 1)
+        # The worker dies without recording anything
+        self.expire_lease(task)
+        self.assertEqual(requeue_stale(lease=300), 1)
+
+        self.assertEqual(claim('test')[0].attempts, 2)
+        self.expire_lease(task)
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.assertEqual(requeue_stale(lease=300), 0)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('failed', 2))
+        self.assertEqual(claim('test'), [])
+
+    def test_renewed_lease_is_not_taken_back(self):
+        task = enqueue(_crash_worker)
+        claim('live-worker')
+        self.expire_lease(task)
+        renew_leases(['live-worker'])
+        self.assertEqual(requeue_stale(lease=300), 0)
+        self.assertEqual(Task.objects.get(id=task.id).status, 'running')
+
+    def test_outcome_is_not_saved_after_the_lease_was_lost(self):
+        task = enqueue(_do_nothing, max_attempts=2)
+        stale = claim('slow-worker')[0]
+        self.expire_lease(task)
+        requeue_stale(lease=300)
+        claim('next-worker')
+
+        # The first run finishes after its task was handed to another worker
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.assertIsNone(execute(stale))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.locked_by, task.attempts), ('running', 'next-worker', 2))
+
+
+class IdempotencyTests(ApiTestCase):
+    def create(self, key='order-1', **body):
+        body = {'pickup_address': '1 Test Road', 'drop_address': '2 Test Street', 'description': 'Test parcel',
+                'weight': 2, **body}
+        return self.call('POST', '/api/delivery/create/', body, user=self.customer, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeat_replays_the_stored_response(self):
+        first = self.create()
+        self.assertEqual(first.status_code, 201)
+        repeat = self.create()
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual((repeat.status_code, repeat.content), (first.status_code, first.content))
+        self.assertEqual(DeliveryRequest.objects.count(), 1)
+
+    def test_key_reused_for_a_different_request_is_refused(self):
+        self.create()
+        self.assertEqual(self.create(weight=3).status_code, 422)
+        self.assertEqual(DeliveryRequest.objects.count(), 1)
+
+    def test_repeat_while_the_first_runs_gets_409_until_its_lock_goes_stale(self):
+        self.create()
+        # Put the record back as if the first request were still running
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.filter(id=record.id).update(in_progress=True, locked_at=timezone.now())
+        self.assertEqual(self.create().status_code, 409)
+
+        # A slow request keeps refreshing its lock, so it is not taken over
+        IdempotencyKey.objects.filter(id=record.id).update(locked_at=timezone.now() - timedelta(seconds=61))
+        _refresh_lock(record.id)
+        self.assertEqual(self.create().status_code, 409)
+
+        # One that stopped refreshing it (its worker died) is
+        IdempotencyKey.objects.filter(id=record.id).update(locked_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(self.create().status_code, 201)
+        self.assertEqual(DeliveryRequest.objects.count(), 2)
+
+    @override_settings(PARCELBEE_IDEMPOTENCY_LOCK_SECONDS=0.03)
+    def test_lock_is_refreshed_while_the_view_runs(self):
+        @idempotent
+        def slow_view(request):
+            time.sleep(0.1)
+            return HttpResponse(status=204)
+
+        request = RequestFactory().post('/slow/', HTTP_IDEMPOTENCY_KEY='slow-1')
+        request.user = self.customer
+        with mock.patch('core.idempotency._refresh_lock') as refresh:
+            self.assertEqual(slow_view(request).status_code, 204)
+        record = IdempotencyKey.objects.get(key='slow-1')
+        self.assertGreaterEqual(refresh.call_count, 2)
+        refresh.assert_called_with(record.id)
+        self.assertFalse(record.in_progress)
+
+    def test_expired_records_are_replaced_and_purged(self):
+        self.create()
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.create().status_code, 201)
+        self.assertEqual(DeliveryRequest.objects.count(), 2)
+
+        self.create(key='order-2')
+        IdempotencyKey.objects.filter(key='order-2').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['order-1'])
+
+
+class RateLimitTests(TestCase):
+    def test_purge_drops_each_counter_by_its_own_window(self):
+        backend = LocalBackend(max_keys=3)
+        backend.hit('forgot_password:ip:a', 300, 3000.0)
+        backend.hit('login:ip:b', 60, 3000.0)
+        backend.hit('login:ip:c', 60, 3000.0)
+        # Full, and the login counters are two minutes old: only they go
+        backend.hit('login:ip:d', 60, 3130.0)
+        self.assertEqual(backend.hit('forgot_password:ip:a', 300, 3130.0), (0, 2))
+
+    def test_counters_never_exceed_max_keys(self):
+        backend = LocalBackend(max_keys=10)
+        for n in range(100):
+            backend.hit(f'login:ip:{n}', 60, 3000.0)
+            self.assertLessEqual(len(backend._counters), 10)
+        # The most recently used survive
+        self.assertEqual(backend.hit('login:ip:99', 60, 3000.0), (0, 2))
+
+    @override_settings(PARCELBEE_RATE_LIMITS={'login': [{'scope': 'ip', 'limit': 2, 'window': 60}]})
+    def test_rejected_requests_are_not_counted(self):
+        middleware = RateLimitMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().post('/api/login/')
+        request.resolver_match = resolve('/api/login/')
+
+        def attempt(at):
+            with mock.patch('core.ratelimit.time.time', return_value=at):
+                response = middleware.process_view(request, None, (), {})
+            return 200 if response is None else response.status_code
+
+        self.assertEqual([attempt(6000 + n) for n in range(12)], [200, 200] + [429] * 10)
+        # Half the previous window still counts: 2 * 0.5 + 1 is within the limit, 12 * 0.5 + 1 would not be
+        self.assertEqual(attempt(6090), 200)
+
+
+class WarmupTests(TestCase):
+    def test_lazy_view_imports_its_module_on_first_request(self):
+        view = mock.Mock(spec=['as_view'])
+        view.as_view.return_value = lambda request: HttpResponse('quote')
+        with mock.patch('core.utils.import_string', return_value=view) as import_string:
+            wrapper = lazy_view('core.api_views.PriceEstimateView')
+            import_string.assert_not_called()
+            self.assertTrue(wrapper.csrf_exempt)
+            for _ in range(2):
+                self.assertEqual(wrapper(RequestFactory().post('/')).content, b'quote')
+        import_string.assert_called_once_with('core.api_views.PriceEstimateView')
+        self.assertIs(wrapper.load(), view.as_view.return_value)
+
+    @override_settings(PARCELBEE_WARMUP_LAZY_VIEWS=True)
+    def test_warmup_keeps_connections_open_until_a_fork(self):
+        callback = resolve('/api/price/estimate/').func
+        with mock.patch.object(callback, 'load') as load, \
+                mock.patch('core.warmup.connections.close_all') as close_all:
+            timings = warmup()
+            load.assert_called_once_with()
+            close_all.assert_not_called()
+            # The preloading master forks its workers: the first fork closes them, later ones have nothing to close
+            _close_connections_before_fork()
+            _close_connections_before_fork()
+        close_all.assert_called_once_with()
+        self.assertEqual(list(timings), ['urlconf', 'lazy_views', 'db_connections', 'tariff_table', 'road_graph', 'eta_model'])
+
+    def test_startup_profile_parses_importtime_and_picks_each_routes_method(self):
+        stderr = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       120 |        120 |     core.models\n'
+                  'import time:        80 |        200 |   core\n'
+                  'unrelated line\n')
+        self.assertEqual(parse_importtime(stderr), [('core.models', 120, 120, 2), ('core', 80, 200, 1)])
+        self.assertEqual(route_method(resolve('/api/delivery/1/update-status/').func), 'PUT')
+        self.assertEqual(route_method(resolve('/api/delivery/list/').func), 'GET')
+        # Read from the source, so the lazily loaded view stays unimported
+        self.assertEqual(route_method(resolve('/api/price/estimate/').func), 'POST')
+
+
+class ProfilingTests(ApiTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PARCELBEE_PROFILE_DIR=Path(directory.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def profiled(self, user, path='/api/admin/overview/'):
+        return self.call('GET', path, user=user, HTTP_X_PARCELBEE_PROFILE='1')
+
+    def test_admin_request_is_profiled_stored_and_listed(self):
+        self.delivery()
+        profile_id = self.profiled(self.admin)['X-Profile-Id']
+
+        listed = self.call('GET', '/api/admin/profiles/', user=self.admin).json()['profiles']
+        self.assertEqual([profile['id'] for profile in listed], [profile_id])
+        self.assertEqual((listed[0]['route'], listed[0]['status']), ('admin_overview', 200))
+        self.assertNotIn('sql', listed[0])
+
+        summary = self.call('GET', f'/api/admin/profiles/{profile_id}/', user=self.admin).json()
+        self.assertEqual(summary['sql_count'], len(summary['sql']))
+        self.assertGreater(summary['sql_count'], 0)
+        self.assertTrue(summary['functions'])
+        folded = self.call('GET', f'/api/admin/profiles/{profile_id}/?format=folded', user=self.admin)
+        self.assertEqual(folded['Content-Type'], 'text/plain; charset=utf-8')
+
+        raw = self.call('GET', f'/api/admin/profiles/{profile_id}/?format=pstats', user=self.admin)
+        with tempfile.NamedTemporaryFile(suffix='.prof') as dump:
+            dump.write(b''.join(raw.streaming_content))
+            dump.flush()
+            self.assertGreater(pstats.Stats(dump.name).total_calls, 0)
+
+    def test_only_admins_are_profiled_and_unknown_ids_are_not_found(self):
+        response = self.profiled(self.customer, '/api/delivery/list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertNotIn('X-Profile-Id', self.call('GET', '/api/admin/overview/', user=self.admin))
+        self.assertEqual(self.call('GET', '/api/admin/profiles/', user=self.admin).json()['profiles'], [])
+        for profile_id in ('1700000000-deadbeef', 'latest'):
+            with self.subTest(profile_id=profile_id):
+                self.assertEqual(self.call('GET', f'/api/admin/profiles/{profile_id}/', user=self.admin).status_code, 404)
+
+    @override_settings(PARCELBEE_PROFILE_KEEP=2)
+    def test_oldest_profiles_are_pruned(self):
+        for _ in range(3):
+            self.profiled(self.admin)
+        self.assertEqual(len(self.call('GET', '/api/admin/profiles/', user=self.admin).json()['profiles']), 2)
+        self.assertEqual(len(list(profile_dir().glob('*.prof'))), 2)
+
+    def test_sampler_records_the_stacks_of_the_sampled_thread(self):
+        def busy_wait(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = StackSampler(threading.get_ident(), 0.001, skip=0)
+        sampler.start()
+        busy_wait(0.05)
+        sampler.stop()
+        self.assertTrue(any('busy_wait' in line for line in sampler.folded()))
+        count = sampler.folded()[0].rsplit(' ', 1)[1]
+        self.assertGreater(int(count), 0)
+
+
+class AdmissionTests(ApiTestCase):
+    def test_gate_sheds_when_slots_and_queue_are_full(self):
+        gate = RouteGate(concurrency=1)
+        self.assertIsNone(gate.acquire())
+        self.assertEqual(gate.acquire(), 'full')
+        gate.release()
+        self.assertIsNone(gate.acquire())
+        gate.release()
+
+        metrics = gate.snapshot()
+        self.assertEqual((metrics['admitted'], metrics['rejected_full'], metrics['active']), (2, 1, 0))
+        self.assertEqual((metrics['peak_active'], metrics['queued']), (1, 0))
+
+    def test_queued_request_gets_the_released_slot_or_times_out(self):
+        gate = RouteGate(concurrency=1, queue=1, queue_timeout=0.02)
+        self.assertIsNone(gate.acquire())
+        self.assertEqual(gate.acquire(), 'timeout')
+
+        gate.queue_timeout = 5.0
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(gate.acquire()))
+        waiter.start()
+        while gate.snapshot()['waiting'] == 0:
+            time.sleep(0.001)
+        # The queue holds one request, so a third caller is turned away at once
+        self.assertEqual(gate.acquire(), 'full')
+        gate.release()
+        waiter.join()
+        self.assertEqual(results, [None])
+
+        metrics = gate.snapshot()
+        self.assertEqual((metrics['queued'], metrics['rejected_timeout'], metrics['rejected_full']), (2, 1, 1))
+        self.assertEqual((metrics['active'], metrics['waiting'], metrics['peak_waiting']), (1, 0, 1))
+        self.assertGreaterEqual(metrics['queue_wait_max_ms'], 20)
+
+    @override_settings(PARCELBEE_ADMISSION={
+        'admin_overview': {'concurrency': 0, 'retry_after': 3},
+        'price-estimate': {'concurrency': 0, 'degrade': True},
+    })
+    def test_busy_route_gets_503_or_a_degraded_answer(self):
+        with mock.patch('core.admission._gates', None):
+            response = self.call('GET', '/api/admin/overview/', user=self.admin)
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '3'))
+            self.assertEqual(response.json()['retry_after'], 3)
+
+            quote = self.call('POST', '/api/price/estimate/',
+                              {'pickup_address': '1 Test Road', 'drop_address': '2 Test Street', 'weight': 2})
+            self.assertEqual(quote.status_code, 200)
+            self.assertEqual((quote.json()['degraded'], quote.json()['distance_source']), (True, 'fallback'))
+
+            routes = self.call('GET', '/api/admin/admission/', user=self.admin).json()['routes']
+        self.assertEqual(routes['admin_overview']['rejected_full'], 1)
+        self.assertEqual((routes['price-estimate']['degraded'], routes['price-estimate']['admitted']), (1, 0))
+
+
+class MinifyTests(TestCase):
+    def test_css_keeps_descendant_pseudo_class_selectors(self):
+        css = 'div :first-child , a > b {\n  color : red ;\n}\n@media (max-width: 600px) { p :hover { top : 1px } }'
+        self.assertEqual(minify_css(css),
+                         'div :first-child,a>b{color:red}@media (max-width: 600px){p :hover{top:1px}}')
+
+    def test_js_leaves_template_literals_alone(self):
+        js = (
+            '// header\n'
+            'function row(item) {\n'
+            '    const html = `\n'
+            '        <td>  ${item.name.replace(/ /g, "") + `  ${item.id}`}  </td>\n'
+            '\n'
+            '    `;\n'
+            '    /* block\n'
+            '       comment */ return html;\n'
+            '}\n'
+        )
+        self.assertEqual(minify_js(js), (
+            'function row(item) {\n'
+            'const html = `\n'
+            '        <td>  ${item.name.replace(/ /g, "") + `  ${item.id}`}  </td>\n'
+            '\n'
+            '    `;\n'
+            'return html;\n'
+            '}\n'
+        ))
+
+
+class PriceEstimateTests(ApiTestCase):
+    def estimate(self):
+        return self.call('POST', '/api/price/estimate/',
+                         {'pickup_address': '1 Test Road', 'drop_address': '2 Test Street', 'weight': 2})
+
+    @mock.patch('core.api_views.geocode_nominatim', return_value=(12.97, 77.59))
+    def test_road_graph_errors_are_not_reported_as_geocoding_failures(self, geocode):
+        with mock.patch('core.api_views.trip_distance_km', side_effect=KeyError('node')):
+            with self.assertRaises(KeyError):
+                self.estimate()
+
+    @mock.patch('core.api_views.geocode_nominatim', side_effect=ValueError('Address not found'))
+    def test_geocoding_failure_quotes_the_fallback_distance(self, geocode):
+        body = self.estimate().json()
+        self.assertEqual((body['distance_source'], body['geocoding_used']), ('fallback', False))
+        self.assertEqual(body['geocode_error'], 'Address not found')
+
+
+class DeliveryListTests(ApiTestCase):
+    def test_limit_keeps_the_newest(self):
+        deliveries = [self.delivery(created_at=timezone.now() + timedelta(minutes=n)) for n in range(5)]
+        body = self.call('GET', '/api/delivery/list/?limit=2', user=self.customer).json()
+        self.assertEqual([d['id'] for d in body['deliveries']], [deliveries[4].id, deliveries[3].id])
+        self.assertEqual(self.call('GET', '/api/delivery/list/?limit=-5', user=self.customer).json()['count'], 1)
+        self.assertEqual(self.call('GET', '/api/delivery/list/?limit=x', user=self.customer).status_code, 400)
+
+
+class ExportTests(ApiTestCase):
+    def export(self, query=''):
+        return self.call('GET', f'/api/admin/deliveries/export/{query}', user=self.admin)
+
+    def test_csv_is_streamed_header_first_in_id_order(self):
+        first, second = self.delivery(), self.delivery('accepted', partner=self.partner)
+        response = self.export()
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="deliveries-', response['Content-Disposition'])
+
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([int(row['id']) for row in rows], [first.id, second.id])
+        self.assertEqual((rows[0]['customer_name'], rows[0]['partner_name']), ('Customer', ''))
+        self.assertEqual((rows[1]['partner_name'], rows[1]['status'], rows[1]['weight']), ('Partner', 'accepted', '2.0'))
+
+    def test_ndjson_applies_status_partner_and_date_filters(self):
+        self.delivery()
+        wanted = self.delivery('delivered', partner=self.partner)
+        self.delivery('cancelled', partner=self.partner)
+        today = timezone.localdate().isoformat()
+
+        response = self.export(f'?format=ndjson&status=delivered,accepted&partner={self.partner.id}'
+                               f'&date_from={today}&date_to={today}')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['id'], row['partner_name']) for row in rows], [(wanted.id, 'Partner')])
+
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        self.assertEqual(b''.join(self.export(f'?format=ndjson&date_from={tomorrow}').streaming_content), b'')
+
+    def test_malformed_filters_are_refused(self):
+        for query in ('?format=xml', '?status=lost', '?date_from=19-10-2026', '?partner=someone'):
+            with self.subTest(query=query):
+                self.assertEqual(self.export(query).status_code, 400)
+
+    def test_small_chunks_stream_every_row(self):
+        deliveries = [self.delivery() for _ in range(5)]
+        lines = list(stream_deliveries(filter_deliveries(), 'ndjson', chunk_size=2))
+        self.assertEqual([json.loads(line)['id'] for line in lines], [delivery.id for delivery in deliveries])
+
+
+class SearchTests(ApiTestCase):
+    def search(self, query, **params):
+        response = self.call('GET', '/api/admin/search/', user=self.admin, QUERY_STRING=f'q={query}&' + '&'.join(
+            f'{key}={value}' for key, value in params.items()))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_address_matches_rank_above_description_matches(self):
+        in_description = self.delivery(description='Books for Koramangala')
+        in_address = self.delivery(pickup_address='14 Koramangala Main Road')
+        self.delivery()
+
+        body = self.search('koramangala')
+        self.assertEqual(body['count'], 2)
+        self.assertEqual([row['id'] for row in body['results']], [in_address.id, in_description.id])
+        # The last token matches as a prefix
+        self.assertEqual(self.search('korama')['count'], 2)
+        second_page = self.search('koramangala', page=2, page_size=1)
+        self.assertEqual([row['id'] for row in second_page['results']], [in_description.id])
+
+    def test_index_follows_queryset_updates_and_user_renames(self):
+        delivery = self.delivery()
+        DeliveryRequest.objects.filter(id=delivery.id).update(description='Fragile teapot')
+        self.assertEqual([d.id for d in search_deliveries('teapot')[1]], [delivery.id])
+
+        self.customer.name = 'Ravi Shankar'
+        self.customer.save()
+        self.assertEqual([d.id for d in search_deliveries('shankar')[1]], [delivery.id])
+
+    def test_fts_syntax_in_the_query_is_matched_literally(self):
+        self.delivery()
+        self.assertEqual(search_deliveries('test street')[0], 1)
+        # Operators, column filters and stray quotes are plain words that match nothing here
+        for query in ('test" OR "x', 'NEAR(test street)', 'description:parcel', '***'):
+            with self.subTest(query=query):
+                self.assertEqual(search_deliveries(query), (0, []))
+
+    @override_settings(PARCELBEE_SEARCH_BACKEND='core.search.LikeSearchBackend')
+    def test_like_fallback_needs_every_token_and_lists_newest_first(self):
+        older = self.delivery(description='Blue umbrella')
+        newer = self.delivery(description='Blue umbrella stand')
+        self.delivery(description='Red umbrella')
+        accepted = self.delivery('accepted', partner=self.partner, description='Blue lamp')
+
+        total, deliveries = search_deliveries('blue umbrel')
+        self.assertEqual((total, [d.id for d in deliveries]), (2, [newer.id, older.id]))
+        # Names are searched too
+        self.assertEqual([d.id for d in search_deliveries('partner blue')[1]], [accepted.id])
+        self.assertEqual(search_deliveries('...'), (0, []))
+
+
+class GeocodingTests(ApiTestCase):
+    def geocoder(self, fail=()):
+        """Fake geocoder recording its calls; addresses in fail raise their exception"""
+        calls = []
+
+        def geocode(address):
+            calls.append(address)
+            if address in fail:
+                raise fail[address]
+            return 12.9 + len(calls) / 1000, 77.6
+
+        geocode.calls = calls
+        return geocode
+
+    def missing(self, address):
+        return self.delivery(pickup_address=address, pickup_lat=None, pickup_lng=None)
+
+    def test_each_normalized_address_is_geocoded_once(self):
+        first, second = self.missing('12  MG Road'), self.missing(' 12 mg road ')
+        geocoder = self.geocoder()
+        self.assertEqual(geocode_missing(rate=0, geocoder=geocoder), (2, 0))
+        self.assertEqual(geocoder.calls, ['12 mg road'])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNotNone(first.pickup_lat)
+        self.assertEqual((first.pickup_lat, first.pickup_lng), (second.pickup_lat, second.pickup_lng))
+
+        # A later delivery to the same place is served from the cache
+        self.missing('12 MG ROAD')
+        self.assertEqual(geocode_missing(rate=0, geocoder=geocoder), (1, 0))
+        self.assertEqual(len(geocoder.calls), 1)
+
+    def test_interrupted_run_resumes_without_repeating_lookups(self):
+        self.missing('1 Church Street')
+        stuck = self.missing('2 Brigade Road')
+        geocoder = self.geocoder(fail={'2 brigade road': KeyboardInterrupt()})
+        with self.assertRaises(KeyboardInterrupt):
+            geocode_missing(rate=0, geocoder=geocoder)
+        self.assertEqual(GeocodedAddress.objects.get().address, '1 church street')
+
+        geocoder = self.geocoder()
+        self.assertEqual(geocode_missing(rate=0, geocoder=geocoder), (2, 0))
+        self.assertEqual(geocoder.calls, ['2 brigade road'])
+        stuck.refresh_from_db()
+        self.assertIsNotNone(stuck.pickup_lat)
+
+    def test_failing_address_is_retried_up_to_max_attempts(self):
+        delivery = self.missing('Nowhere Lane')
+        geocoder = self.geocoder(fail={'nowhere lane': ValueError('Address not found')})
+        with self.assertLogs('core.geocoding', 'WARNING'):
+            for _ in range(4):
+                self.assertEqual(geocode_missing(rate=0, max_attempts=2, geocoder=geocoder), (0, 1))
+        self.assertEqual(geocoder.calls, ['nowhere lane'] * 2)
+        row = GeocodedAddress.objects.get()
+        self.assertEqual((row.status, row.attempts, row.error), ('failed', 2, 'Address not found'))
+        delivery.refresh_from_db()
+        self.assertIsNone(delivery.pickup_lat)
+
+
+class DeliveryDirectoryTests(TransactionTestCase):
+    def test_failed_insert_leaves_no_directory_row(self):
+        customer = User.objects.create_user(email='directory@test.invalid', password=None, name='C', role='customer')
+        with mock.patch.object(DeliveryRequest, 'save_base', side_effect=IntegrityError('insert failed')):
+            with self.assertRaises(IntegrityError):
+                DeliveryRequest.objects.create(customer=customer, pickup_address='1 Test Road', drop_address='2 Test Street',
+                                               description='Test parcel', weight=2)
+        self.assertFalse(DeliveryShard.objects.exists())
+
+
+@override_settings(PARCELBEE_RATE_LIMITS={})
+class RegionDatabaseTests(TransactionTestCase):
+    """Deliveries split between 'default' and a region database in a second SQLite file"""
+    databases = '__all__'
+    REGION = 'region_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        connections.settings[cls.REGION] = {**connections.settings['default'],
+                                            'NAME': str(Path(directory.name) / 'region.sqlite3')}
+        cls.addClassCleanup(cls.drop_region)
+        regions = override_settings(PARCELBEE_REGIONS={'blr': (12.7, 77.3, 13.3, 77.9)},
+                                    PARCELBEE_REGION_DATABASES={'blr': cls.REGION})
+        regions.enable()
+        cls.addClassCleanup(regions.disable)
+        call_command('migrate', database=cls.REGION, verbosity=0)
+
+    @classmethod
+    def drop_region(cls):
+        connections[cls.REGION].close()
+        del connections[cls.REGION]
+        del connections.settings[cls.REGION]
+
+    def setUp(self):
+        self.addCleanup(call_command, 'flush', database=self.REGION, interactive=False, verbosity=0)
+        self.admin = User.objects.create_superuser(email='admin@test.invalid', password='secret12', name='Admin')
+        customer = User.objects.create_user(email='customer@test.invalid', password=None, name='Customer', role='customer')
+        fields = dict(customer=customer, drop_address='2 Test Street', description='Region parcel', weight=2)
+        self.regional = DeliveryRequest.objects.create(pickup_address='1 Bengaluru Road', pickup_lat=12.97,
+                                                       pickup_lng=77.59, **fields)
+        self.local = DeliveryRequest.objects.create(pickup_address='1 Mumbai Road', pickup_lat=19.07,
+                                                    pickup_lng=72.87, **fields)
+
+    def test_deliveries_are_stored_by_region(self):
+        self.assertTrue(DeliveryRequest.objects.using(self.REGION).filter(id=self.regional.id).exists())
+        self.assertTrue(DeliveryRequest.objects.using('default').filter(id=self.local.id).exists())
+        self.assertFalse(DeliveryRequest.objects.using('default').filter(id=self.regional.id).exists())
+
+    def test_search_covers_every_database(self):
+        token = generate_jwt(self.admin)
+        response = self.client.get('/api/admin/search/?q=parcel', HTTP_AUTHORIZATION=f'Bearer {token}')
+        body = response.json()
+        self.assertEqual(body['count'], 2)
+        self.assertEqual({result['id'] for result in body['results']}, {self.regional.id, self.local.id})
+        regional = next(result for result in body['results'] if result['id'] == self.regional.id)
+        self.assertEqual(regional['customer_name'], 'Customer')
+
+        body = self.client.get('/api/admin/search/?q=bengaluru', HTTP_AUTHORIZATION=f'Bearer {token}').json()
+        self.assertEqual([result['id'] for result in body['results']], [self.regional.id])
+
+    def test_admin_lists_and_opens_deliveries_from_every_database(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/core/deliveryrequest/')
+        self.assertEqual([d.id for d in response.context['cl'].result_list], [self.local.id, self.regional.id])
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+        response = self.client.get('/admin/core/deliveryrequest/?q=bengaluru')
+        self.assertEqual([d.id for d in response.context['cl'].result_list], [self.regional.id])
+
+        response = self.client.get(f'/admin/core/deliveryrequest/{self.regional.id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['original'].pickup_address, '1 Bengaluru Road')
+
+
+class TripTests(ApiTestCase):
+    def offer(self, *deliveries):
+        consolidate()
+        trip = Trip.objects.get(status='offered')
+        self.assertEqual(sorted(trip.delivery_ids), sorted(d.id for d in deliveries))
+        return trip
+
+    def test_neighbours_across_any_cell_boundary_are_grouped(self):
+        # Pickups 20 m apart on either side of a boundary the coarse grid used to share
+        for boundary in (12.02, 12.03):
+            with self.subTest(boundary=boundary):
+                jobs = PendingJobs()
+                jobs.append(1, boundary - 0.0001, 77.505, 12.2, 77.505, 1, 100)
+                jobs.append(2, boundary + 0.0001, 77.505, 12.2, 77.505, 1, 100)
+                self.assertEqual([sorted(trip) for trip in cluster(jobs, max_weight=20, max_parcels=8)], [[0, 1]])
+
+    def test_accepting_a_trip_assigns_every_delivery(self):
+        first, second = self.delivery(), self.delivery()
+        trip = self.offer(first, second)
+        response = self.call('POST', f'/api/trips/{trip.id}/accept/', user=self.partner)
+        self.assertEqual(response.status_code, 200)
+        for delivery in (first, second):
+            delivery.refresh_from_db()
+            self.assertEqual((delivery.status, delivery.partner_id), ('accepted', self.partner.id))
+        self.assertEqual(DeliveryEvent.objects.filter(delivery_id=first.id, status='accepted').count(), 1)
+        self.assertEqual(self.call('POST', f'/api/trips/{trip.id}/accept/', user=self.partner).status_code, 404)
+
+    def test_trip_is_withdrawn_when_a_delivery_was_taken(self):
+        first, second = self.delivery(), self.delivery()
+        trip = self.offer(first, second)
+        self.call('POST', f'/api/delivery/{second.id}/accept/', user=self.partner)
+
+        response = self.call('POST', f'/api/trips/{trip.id}/accept/', user=self.partner)
+        self.assertEqual(response.status_code, 409)
+        trip.refresh_from_db()
+        self.assertEqual(trip.status, 'withdrawn')
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.partner_id), ('pending', None))
+
+    def test_offer_limit_is_at_least_one(self):
+        self.offer(self.delivery(), self.delivery())
+        body = self.call('GET', '/api/trips/?limit=-5', user=self.partner).json()
+        self.assertEqual(body['count'], 1)
+
+
+class EtaTests(ApiTestCase):
+    def model(self, bias):
+        coef = [bias] + [0.0] * (len(FEATURES) - 1)
+        return EtaModel({'accept': {'coef': coef}, 'transit': {'coef': coef}})
+
+    def test_runaway_model_is_capped(self):
+        delivery = self.delivery()
+        eta = self.model(bias=1e6).estimate(delivery, now=delivery.created_at)
+        self.assertLessEqual(eta - delivery.created_at, timedelta(days=60))
+
+    def test_detail_survives_a_scoring_error(self):
+        delivery = self.delivery()
+        with mock.patch('core.eta.get_model', return_value=self.model(bias=float('nan'))):
+            with self.assertLogs('core.eta', 'ERROR'):
+                response = self.call('GET', f'/api/delivery/{delivery.id}/', user=self.customer)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['estimated_delivery_at'])
+
+    def test_history_rows_carry_bulk_loaded_coordinates(self):
+        now = timezone.now()
+        located = self.delivery('delivered', self.partner, accepted_at=now, delivered_at=now)
+        unlocated = self.delivery('delivered', self.partner, accepted_at=now, delivered_at=now)
+        DeliveryRequest.objects.filter(id=unlocated.id).update(drop_lat=None)
+        self.delivery('in_transit', self.partner, accepted_at=now)
+        rows = {row[0]: row for row in iter_history(chunk_size=1)}
+        self.assertEqual(sorted(rows), [located.id, unlocated.id])
+        self.assertEqual(rows[located.id][1:7], (self.partner.id, 12.97, 77.59, 12.99, 77.61, 2.0))
+        self.assertIsNone(rows[unlocated.id][4])
+
+
+class TokenRevocationTests(ApiTestCase):
+    def setUp(self):
+        revocations.clear()
+        token_cache.clear()
+
+    def reset(self, token, password):
+        return self.call('POST', '/api/password/reset/', {'token': token, 'new_password': password})
+
+    def test_logout_revokes_the_token(self):
+        token = generate_jwt(self.customer)
+        self.assertEqual(self.call('GET', '/api/delivery/list/', token=token).status_code, 200)
+        self.assertEqual(self.call('POST', '/api/logout/', token=token).status_code, 200)
+        self.assertEqual(self.call('GET', '/api/delivery/list/', token=token).status_code, 401)
+
+    def test_reset_link_works_once(self):
+        token = generate_reset_token_payload(self.customer.email)
+        self.assertEqual(self.reset(token, 'first-pass').status_code, 200)
+        self.assertEqual(self.reset(token, 'second-pass').status_code, 400)
+        self.customer.refresh_from_db()
+        self.assertTrue(self.customer.check_password('first-pass'))
+
+    def test_reset_link_is_refused_by_a_worker_that_has_not_seen_it_used(self):
+        token = generate_reset_token_payload(self.customer.email)
+        self.assertEqual(self.reset(token, 'first-pass').status_code, 200)
+        # Another worker: its revocation set has not refreshed since the link was used
+        revocations.clear()
+        with mock.patch.object(revocations, 'refresh'):
+            self.assertIsNotNone(verify_reset_token(token))
+            self.assertEqual(self.reset(token, 'second-pass').status_code, 400)
+        self.customer.refresh_from_db()
+        self.assertTrue(self.customer.check_password('first-pass'))
+        self.assertEqual(RevokedToken.objects.count(), 1)
+
+    def test_failed_reset_leaves_the_link_usable(self):
+        token = generate_reset_token_payload(self.customer.email)
+        with mock.patch.object(User, 'save', side_effect=DatabaseError('disk full')):
+            self.assertEqual(self.reset(token, 'first-pass').status_code, 500)
+        self.assertFalse(RevokedToken.objects.exists())
+        self.assertEqual(self.reset(token, 'first-pass').status_code, 200)
+
+
+class ReplayFixtureTests(ApiTestCase):
+    def test_partner_writes_find_their_delivery_in_the_prior_state(self):
+        entries = [
+            {'m': 'POST', 'r': 'accept_delivery', 'k': {'delivery_id': 7}, 'role': 'partner', 'a': 'p1', 's': 200},
+            {'m': 'PUT', 'r': 'update_delivery_status', 'k': {'delivery_id': 9}, 'b': {'status': 'delivered'},
+             'role': 'partner', 'a': 'p1', 's': 200},
+        ]
+        fixtures = Fixtures(entries)
+        accepted = DeliveryRequest.objects.get(id=fixtures.deliveries[7])
+        self.assertEqual((accepted.status, accepted.partner_id), ('pending', None))
+
+        path = f'/api/delivery/{fixtures.deliveries[9]}/update-status/'
+        response = self.call('PUT', path, {'status': 'delivered'}, token=fixtures.tokens['p1'])
+        self.assertEqual(response.status_code, 200)
+        response = self.call('POST', f'/api/delivery/{accepted.id}/accept/', token=fixtures.tokens['p1'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_update_replays_every_item_against_its_own_fixture(self):
+        body = {'updates': [{'delivery_id': 11, 'status': 'delivered', 'lat': 12.971, 'lng': 77.594},
+                            {'delivery_id': 12, 'status': 'in_transit'}]}
+        entry = {'m': 'PATCH', 'r': 'bulk_update_delivery_status', 'b': sanitize(body),
+                 'role': 'partner', 'a': 'p1', 's': 200}
+        fixtures = Fixtures([entry])
+        self.assertEqual(DeliveryRequest.objects.get(id=fixtures.deliveries[11]).status, 'in_transit')
+        self.assertEqual(DeliveryRequest.objects.get(id=fixtures.deliveries[12]).status, 'accepted')
+
+        replayed = rehydrate(entry['b'], fixtures.fill)
+        self.assertEqual([item['delivery_id'] for item in replayed['updates']],
+                         [fixtures.deliveries[11], fixtures.deliveries[12]])
+        response = self.call('PATCH', '/api/delivery/bulk-update-status/', replayed, token=fixtures.tokens['p1'])
+        self.assertEqual(response.json()['updated'], 2)
+
+
+class QueryBudgetTests(TransactionTestCase):
+    """
+    Every route's query count against the baseline `manage.py check_query_budgets
+    --update-baseline` records. Latency and memory are left to that command.
+    """
+    databases = '__all__'
+
+    def test_routes_stay_within_query_budgets(self):
+        self.assertEqual(uncovered_routes(), [])
+        baseline = json.loads(baseline_path().read_text())
+        sizes = baseline['sizes']
+        results = run_scenarios(SCENARIOS, sizes, repeat=1, trace_memory=False)
+        failures = []
+        for name, by_size in results.items():
+            for size in sizes:
+                base = baseline['routes'].get(name, {}).get(str(size))
+                if base is None:
+                    failures.append(f'{name} at {size} rows: no baseline')
+                failures.extend(f'{name} at {size} rows: {problem}'
+                                for problem in budget_problems(by_size[str(size)], base))
+            failures.append(growth_problem(name, by_size, sizes))
+        self.assertEqual([failure for failure in failures if failure], [])
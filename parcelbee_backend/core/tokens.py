@@ -0,0 +1,179 @@
+import hashlib
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from core.models import RevokedToken
+
+
+REFRESH_OVERLAP_SECONDS = 30
+
+def token_digest(token):
+    """16-byte BLAKE2b of a bearer token; what the cache and the revocation set are keyed by"""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+class TokenCache:
+    """
+    Claims of tokens that already passed signature verification, keyed by token digest.
+    An entry is dropped once its token's exp passes; when full, the token closest to
+    expiry is evicted first, so long-lived sessions stay cached.
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = {}  # digest -> (exp, claims)
+        self._expiry = []   # heap of (exp, digest); may hold entries already dropped
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest, now=None):
+        entry = self._entries.get(digest)
+        if entry is not None:
+            if entry[0] > (now or time.time()):
+                self.hits += 1
+                return entry[1]
+            self.discard(digest)
+        self.misses += 1
+        return None
+
+    def put(self, digest, claims, exp):
+        now = time.time()
+        if self.max_entries <= 0 or exp <= now:
+            return
+        with self._lock:
+            if digest in self._entries:
+                return
+            expiry = self._expiry
+            while expiry and (expiry[0][0] <= now or len(self._entries) >= self.max_entries):
+                stale_exp, stale = heapq.heappop(expiry)
+                entry = self._entries.get(stale)
+                if entry is not None and entry[0] == stale_exp:
+                    del self._entries[stale]
+            self._entries[digest] = (exp, claims)
+            heapq.heappush(expiry, (exp, digest))
+
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiry.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RevocationSet:
+    """
+    Digests of revoked tokens with their exp, mirrored from the revoked_tokens table.
+    Membership is a dict lookup; rows other workers added are pulled in at most every
+    refresh_interval seconds with one indexed query, so a logout reaches every worker
+    within that interval. Entries leave memory (and the table, on purge) once expired.
+    """
+    def __init__(self, refresh_interval=2.0):
+        self.refresh_interval = refresh_interval
+        self._revoked = {}  # digest -> exp, unix seconds
+        self._since = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, digest):
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        return digest in self._revoked
+
+    def refresh(self):
+        """Load rows revoked since the last refresh and forget expired entries"""
+        with self._lock:
+            if time.monotonic() < self._next_refresh:
+                return
+            now = timezone.now()
+            rows = RevokedToken.objects.filter(expires_at__gt=now)
+            if self._since is not None:
+                # Overlap generously: rows commit out of order and worker clocks drift
+                rows = rows.filter(revoked_at__gte=self._since - timedelta(seconds=REFRESH_OVERLAP_SECONDS))
+            for digest, expires_at in rows.values_list('digest', 'expires_at'):
+                self._revoked[bytes.fromhex(digest)] = expires_at.timestamp()
+            self._since = now
+            cutoff = now.timestamp()
+            for digest in [d for d, exp in self._revoked.items() if exp <= cutoff]:
+                del self._revoked[digest]
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def add(self, digest, exp, user=None):
+        """Revoke in this worker at once and record it for the others"""
+        self._revoked[digest] = exp
+        RevokedToken.objects.bulk_create([RevokedToken(
+            digest=digest.hex(), user=user, expires_at=datetime.fromtimestamp(exp, tz=dt_timezone.utc),
+        )], ignore_conflicts=True)
+
+    def claim(self, digest, exp, user=None):
+        """
+        Revoke unless some worker already has; True when this call did. The unique digest
+        column decides, so of two requests racing on one token exactly one gets True. Inside
+        a transaction the revocation (and this worker's copy of it) only lands on commit.
+        """
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(
+                    digest=digest.hex(), user=user, expires_at=datetime.fromtimestamp(exp, tz=dt_timezone.utc),
+                )
+        except IntegrityError:
+            self._revoked[digest] = exp
+            return False
+        transaction.on_commit(lambda: self._revoked.__setitem__(digest, exp))
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._revoked.clear()
+            self._since = None
+            self._next_refresh = 0.0
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+cache = TokenCache(max_entries=getattr(settings, 'PARCELBEE_TOKEN_CACHE_SIZE', 10000))
+revocations = RevocationSet(refresh_interval=getattr(settings, 'PARCELBEE_REVOCATION_REFRESH_SECONDS', 2.0))
+
+
+def revoke_token(token, exp, user=None):
+    """Refuse this token from now until exp (unix seconds)"""
+    digest = token_digest(token)
+    revocations.add(digest, exp, user)
+    cache.discard(digest)
+
+
+def consume_token(token, exp, user=None):
+    """Use up a single-use token; False when another request already did"""
+    digest = token_digest(token)
+    cache.discard(digest)
+    return revocations.claim(digest, exp, user)
+
+
+def revoke_user_tokens(user, save=True):
+    """Refuse every token issued to the user so far, in every worker at once"""
+    user.tokens_valid_after = timezone.now()
+    if save:
+        user.save(update_fields=['tokens_valid_after'])
+
+
+def issued_before_cutoff(user, claims):
+    """True when the token predates the user's last revoke-all. iat has whole-second resolution."""
+    cutoff = user.tokens_valid_after
+    return cutoff is not None and claims.get('iat', 0) < int(cutoff.timestamp())
+
+
+def purge_expired():
+    """Delete rows for tokens that have expired anyway"""
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,186 @@
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core.utils import decode_jwt
+
+
+# Record ids that replay maps onto fixtures
+ID_FIELDS = frozenset({'id', 'delivery_id', 'trip_id'})
+# Values kept verbatim: enumerations, sizes, paging and record ids that shape the load but identify nobody
+KEEP_FIELDS = frozenset({
+    'status', 'role', 'weight', 'estimated_price', 'format', 'group_by', 'page', 'page_size',
+    'limit', 'date_from', 'date_to', 'ts',
+}) | ID_FIELDS
+# Coordinates are kept to two decimals (about a kilometre)
+COARSE_FIELDS = frozenset({'lat', 'lng', 'pickup_lat', 'pickup_lng', 'drop_lat', 'drop_lng'})
+MAX_BODY_BYTES = 64 * 1024
+
+
+def sanitize(value, key=None):
+    """
+    Replace a request value by its shape: strings become "<str:LENGTH>", other scalars
+    "<num>"/"<bool>", lists keep their length and their first item's shape, or every
+    item's when they carry record ids (bulk updates). Fields in KEEP_FIELDS and
+    COARSE_FIELDS keep (rounded) values.
+    """
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        if any(isinstance(item, dict) and not ID_FIELDS.isdisjoint(item) for item in value):
+            return {'<list>': len(value), 'items': [sanitize(item, key) for item in value]}
+        return {'<list>': len(value), 'item': sanitize(value[0], key) if value else None}
+    if value is None:
+        return None
+    if key in KEEP_FIELDS:
+        return value
+    if key in COARSE_FIELDS:
+        try:
+            return round(float(value), 2)
+        except (TypeError, ValueError):
+            return None
+    if isinstance(value, bool):
+        return '<bool>'
+    if isinstance(value, (int, float)):
+        return '<num>'
+    return f'<str:{len(str(value))}>'
+
+
+def rehydrate(shape, fill):
+    """
+    Rebuild a value from sanitize() output. fill(key, value) may substitute kept values
+    (e.g. map recorded delivery ids to fixture ids); placeholders become dummy data.
+    """
+    def build(value, key=None):
+        if isinstance(value, dict):
+            if '<list>' in value:
+                if 'items' in value:
+                    return [build(item, key) for item in value['items']]
+                return [build(value['item'], key) for _ in range(value['<list>'])]
+            return {k: build(v, k) for k, v in value.items()}
+        if value == '<bool>':
+            return False
+        if value == '<num>':
+            return 1
+        if isinstance(value, str) and value.startswith('<str:'):
+            return 'x' * int(value[5:-1])
+        return fill(key, value)
+    return build(shape)
+
+
+def actor_key(user_id):
+    """Stable pseudonym for a user: the same caller replays as the same fixture user"""
+    digest = hmac.new(settings.SECRET_KEY.encode(), str(user_id).encode(), hashlib.sha256)
+    return digest.hexdigest()[:10]
+
+
+class TrafficCaptureMiddleware:
+    """
+    Append one sanitized JSON line per API request to PARCELBEE_TRAFFIC_CAPTURE: arrival
+    time, method, route name and URL kwargs, query and body shapes (see sanitize), caller
+    role and pseudonym, status and duration. Off unless the setting names a file. Each line
+    is a single O_APPEND write, so several workers can share the file. Replay it with
+    `manage.py replay_traffic`.
+    """
+    def __init__(self, get_response):
+        path = getattr(settings, 'PARCELBEE_TRAFFIC_CAPTURE', None)
+        if not path:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PARCELBEE_TRAFFIC_SAMPLE_RATE', 1.0)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def __call__(self, request):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+        arrived = time.time()
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is None or not match.view_name:
+            return response
+        try:
+            os.write(self.fd, self.record(request, response, match, arrived, elapsed))
+        except OSError:
+            pass  # capture must never fail a request
+        return response
+
+    def record(self, request, response, match, arrived, elapsed):
+        entry = {'t': round(arrived, 3), 'm': request.method, 'r': match.view_name}
+        if match.kwargs:
+            entry['k'] = match.kwargs
+        if request.GET:
+            entry['q'] = sanitize({key: request.GET.get(key) for key in request.GET})
+        body = self.body(request)
+        if body is not None:
+            entry['b'] = sanitize(body)
+
+        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+        payload = decode_jwt(auth_header[7:]) if auth_header.startswith('Bearer ') else None
+        if payload:
+            entry['role'] = payload.get('role')
+            entry['a'] = actor_key(payload.get('user_id'))
+        entry['s'] = response.status_code
+        entry['ms'] = round(elapsed * 1000, 2)
+        return (json.dumps(entry, separators=(',', ':'), default=str) + '\n').encode()
+
+    def body(self, request):
+        if request.method in ('GET', 'HEAD') or request.content_type != 'application/json':
+            return None
+        try:
+            if int(request.META.get('CONTENT_LENGTH') or 0) > MAX_BODY_BYTES:
+                return None
+            return json.loads(request.body or b'null')
+        except Exception:
+            # Unreadable (already streamed) or malformed bodies are recorded without a shape
+            return None
+
+
+def read_trace(path):
+    with open(path, encoding='utf-8') as trace:
+        for line in trace:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class LatencyLog:
+    """Thread-safe per-route latency and status collection for a replay"""
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def add(self, route, status, seconds):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds * 1000)
+            counts = self.statuses.setdefault(route, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def report(self):
+        """[(route, count, p50, p90, p99, max, statuses)] busiest route first"""
+        rows = []
+        for route, values in self.latencies.items():
+            values.sort()
+            rows.append((route, len(values), percentile(values, 0.5), percentile(values, 0.9),
+                         percentile(values, 0.99), values[-1], self.statuses[route]))
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows
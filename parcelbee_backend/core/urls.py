@@ -1,6 +1,6 @@
 from django.urls import path
 from core import views
-from .views import PriceEstimateView
+from core.utils import lazy_view
 
 
 
@@ -8,6 +8,7 @@ urlpatterns = [
     # Authentication
     path('register/', views.register, name='register'),
     path('login/', views.login, name='login'),
+    path('logout/', views.logout, name='logout'),
     
     # Password Reset
     path('password/forgot/', views.forgot_password_request, name='forgot_password'),
@@ -16,14 +17,31 @@ urlpatterns = [
     # Delivery Management
     path('delivery/create/', views.create_delivery, name='create_delivery'),
     path('delivery/list/', views.list_deliveries, name='list_deliveries'),
+    path('delivery/bulk-update-status/', views.bulk_update_delivery_status, name='bulk_update_delivery_status'),
     path('delivery/<int:delivery_id>/', views.get_delivery_detail, name='delivery_detail'),
+    path('delivery/<int:delivery_id>/history/', views.get_delivery_history, name='delivery_history'),
+    path('delivery/<int:delivery_id>/location/', views.get_delivery_location, name='delivery_location'),
     path('delivery/<int:delivery_id>/accept/', views.accept_delivery, name='accept_delivery'),
     path('delivery/<int:delivery_id>/update-status/', views.update_delivery_status, name='update_delivery_status'),
     
+    # Consolidated trips
+    path('trips/', views.list_trip_offers, name='trip_offers'),
+    path('trips/<int:trip_id>/accept/', views.accept_trip, name='accept_trip'),
+    
+    # Partner tracking
+    path('partner/location/', views.post_partner_location, name='partner_location'),
+    
     # Admin
     path('admin/overview/', views.admin_overview, name='admin_overview'),
+    path('admin/analytics/', views.admin_analytics, name='admin_analytics'),
+    path('admin/search/', views.search_deliveries_view, name='search_deliveries'),
+    path('admin/deliveries/export/', views.export_deliveries, name='export_deliveries'),
+    path('admin/admission/', views.admission_metrics_view, name='admission_metrics'),
+    path('admin/profiles/', views.list_profiles_view, name='profiles'),
+    path('admin/profiles/<str:profile_id>/', views.get_profile, name='profile_detail'),
 
     #priceEstimationApi
-    path("price/estimate/", PriceEstimateView.as_view(), name="price-estimate"),
+    # DRF is only needed here, so the view module is imported on first use
+    path("price/estimate/", lazy_view("core.api_views.PriceEstimateView"), name="price-estimate"),
 
 ]   
\ No newline at end of file
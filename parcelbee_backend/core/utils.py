@@ -1,36 +1,67 @@
-import jwt
 import json
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.http import JsonResponse
-from functools import wraps
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+from functools import lru_cache, wraps
 from core.models import User
+from core.tokens import cache as token_cache, issued_before_cutoff, revocations, token_digest
 import math
-import requests
+import secrets
+
+# jwt and requests are imported inside the functions that use them so that
+# worker boot does not pay for them; after the first call the import is a dict lookup.
+
+
+@lru_cache(maxsize=None)
+def optional_numpy():
+    """numpy, or None when it is not installed; imported on first use like jwt and requests"""
+    try:
+        import numpy
+    except ImportError:  # optional: pip install numpy for the vectorised paths
+        return None
+    return numpy
 
 
 def generate_jwt(user):
     """Generate JWT token for authenticated user"""
+    import jwt
     payload = {
         'user_id': user.id,
         'email': user.email,
         'role': user.role,
         'exp': datetime.utcnow() + timedelta(days=7),
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        # Tokens issued in the same second must differ so one can be revoked alone
+        'jti': secrets.token_hex(8)
     }
     token = jwt.encode(payload, settings.SECRET_KEY, algorithm='HS256')
     return token
 
 
 def decode_jwt(token):
-    """Decode and verify JWT token"""
+    """
+    Decode and verify JWT token. Revoked tokens are refused; verified claims are cached
+    until the token expires, so repeat calls with the same token skip the HMAC and parsing.
+    """
+    digest = token_digest(token)
+    if revocations.is_revoked(digest):
+        return None
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+    
+    import jwt
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    if isinstance(payload.get('exp'), (int, float)):
+        token_cache.put(digest, payload, payload['exp'])
+    return payload
 
 
 def json_response(data, status=200):
@@ -38,27 +69,38 @@ def json_response(data, status=200):
     return JsonResponse(data, status=status, safe=False)
 
 
+def authenticate_request(request):
+    """Resolve the Bearer token to a user. Returns (user, None) or (None, error response)"""
+    auth_header = request.headers.get('Authorization', '')
+    
+    if not auth_header.startswith('Bearer '):
+        return None, json_response({'error': 'No token provided'}, status=401)
+    
+    token = auth_header.split(' ')[1]
+    payload = decode_jwt(token)
+    
+    if not payload:
+        return None, json_response({'error': 'Invalid or expired token'}, status=401)
+    
+    try:
+        user = User.objects.get(id=payload['user_id'])
+    except User.DoesNotExist:
+        return None, json_response({'error': 'User not found'}, status=401)
+    
+    if issued_before_cutoff(user, payload):
+        return None, json_response({'error': 'Invalid or expired token'}, status=401)
+    return user, None
+
+
 def auth_required(roles=None):
     """Decorator to protect views with JWT authentication"""
     def decorator(view_func):
         @wraps(view_func)
         def wrapper(request, *args, **kwargs):
-            auth_header = request.headers.get('Authorization', '')
-            
-            if not auth_header.startswith('Bearer '):
-                return json_response({'error': 'No token provided'}, status=401)
-            
-            token = auth_header.split(' ')[1]
-            payload = decode_jwt(token)
-            
-            if not payload:
-                return json_response({'error': 'Invalid or expired token'}, status=401)
-            
-            try:
-                user = User.objects.get(id=payload['user_id'])
-                request.user = user
-            except User.DoesNotExist:
-                return json_response({'error': 'User not found'}, status=401)
+            user, error = authenticate_request(request)
+            if error is not None:
+                return error
+            request.user = user
             
             # Check role permissions
             if roles and user.role not in roles:
@@ -69,6 +111,31 @@ def auth_required(roles=None):
     return decorator
 
 
+def lazy_view(dotted_path):
+    """
+    URLconf entry for a view whose module is imported on its first request.
+    Class-based views are resolved through as_view(). Call .load() to resolve eagerly.
+    All API views are csrf exempt, so the wrapper is too.
+    """
+    resolved = None
+
+    def load():
+        nonlocal resolved
+        if resolved is None:
+            view = import_string(dotted_path)
+            resolved = view.as_view() if hasattr(view, 'as_view') else view
+        return resolved
+
+    @csrf_exempt
+    def wrapper(request, *args, **kwargs):
+        return (resolved or load())(request, *args, **kwargs)
+
+    wrapper.load = load
+    wrapper.lazy_view_path = dotted_path
+    wrapper.__name__ = dotted_path.rsplit('.', 1)[-1]
+    return wrapper
+
+
 def get_json_data(request):
     """Parse JSON data from request body"""
     try:
@@ -78,6 +145,22 @@ def get_json_data(request):
     
 
 
+def parse_coordinates(lat, lng):
+    """
+    Validate an optional client-supplied position. Returns (lat, lng) as floats, or
+    (None, None) when neither is given; raises ValueError for anything else.
+    """
+    if lat in (None, '') and lng in (None, ''):
+        return None, None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise ValueError('lat and lng must be numbers')
+    if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('lat must be within [-90, 90] and lng within [-180, 180]')
+    return lat, lng
+
+
 def haversine_km(lat1, lon1, lat2, lon2):
     R = 6371.0
     def to_rad(deg): return deg * math.pi / 180.0
@@ -91,6 +174,7 @@ def geocode_nominatim(address):
     """
     Simple Nominatim forward geocode. Returns (lat, lon) floats.
     """
+    import requests
     url = "https://nominatim.openstreetmap.org/search"
     params = {"q": address, "format": "json", "limit": 1}
     headers = {"User-Agent": "ParcelBee/1.0 (+contact)"}  # set a UA
@@ -104,6 +188,7 @@ def geocode_nominatim(address):
 
 def generate_reset_token_payload(email):
     """Generate JWT token for password reset (expires in 1 hour)"""
+    import jwt
     payload = {
         'email': email,
         'type': 'password_reset',
@@ -116,10 +201,14 @@ def generate_reset_token_payload(email):
 
 def verify_reset_token(token):
     """Verify password reset token"""
+    import jwt
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
         if payload.get('type') != 'password_reset':
             return None
+        # Refuses links already used here; consume_token in reset_password_confirm enforces single use
+        if revocations.is_revoked(token_digest(token)):
+            return None
         return payload
     except jwt.ExpiredSignatureError:
         return None
@@ -1,25 +1,41 @@
-from django.shortcuts import render
+import json
+import math
+import mimetypes
+import os
+import time
+from datetime import datetime
+from decimal import Decimal
 
-# Create your views here.
+from django.conf import settings
+from django.db import router, transaction
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils._os import safe_join
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.contrib.auth import authenticate
-from django.utils import timezone
-from core.models import User, DeliveryRequest
-from core.utils import generate_jwt, json_response, get_json_data, auth_required, generate_reset_token_payload, verify_reset_token
-from decimal import Decimal
 
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from core.models import User, DeliveryRequest, Trip
+from core.utils import generate_jwt, decode_jwt, json_response, get_json_data, auth_required, generate_reset_token_payload, verify_reset_token, parse_coordinates
 
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
-from django.conf import settings
+from .admission import admission_metrics
+from .analytics import record_status_changes, record_transition, query_rollups, rollup_totals
+from .assets import build_dir, is_fingerprinted
+from .compression import accepted_encodings
+from .consolidation import accept_trip as accept_trip_offer
+from .eta import estimated_delivery
+from .events import build_event, record_event, record_events, delivery_history
+from .exports import EXPORT_FORMATS, filter_deliveries, stream_deliveries
+from .idempotency import idempotent
+from .locations import ingest_fixes, latest_location
+from .notifications import send_password_reset_email
+from .profiling import list_profiles, profile_paths
+from .search import search_deliveries
+from .sharding import databases_for_deliveries, gather, status_counts
+from .tokens import consume_token, revoke_token, revoke_user_tokens
 
-from .serializers import PriceEstimateSerializer
-from .utils import geocode_nominatim, haversine_km
-import json
+
+# Statuses a partner may move an accepted delivery to
+PARTNER_STATUS_UPDATES = ['accepted', 'in_transit', 'delivered', 'cancelled']
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -101,9 +117,25 @@ def login(request):
         return json_response({'error': 'Invalid credentials'}, status=401)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+@auth_required()
+def logout(request):
+    """Revoke the token used for this request; {"everywhere": true} revokes all of the user's tokens"""
+    token = request.headers['Authorization'].split(' ')[1]
+    data = get_json_data(request) or {}
+    
+    revoke_token(token, decode_jwt(token)['exp'], user=request.user)
+    if data.get('everywhere'):
+        revoke_user_tokens(request.user)
+    
+    return json_response({'message': 'Logged out'})
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @auth_required(roles=['customer'])
+@idempotent
 def create_delivery(request):
     """Create a new delivery request (customer only)"""
     data = get_json_data(request)
@@ -117,7 +149,7 @@ def create_delivery(request):
             return json_response({'error': f'{field} is required'}, status=400)
     
     try:
-        delivery = DeliveryRequest.objects.create(
+        delivery = DeliveryRequest(
             customer=request.user,
             pickup_address=data['pickup_address'],
             drop_address=data['drop_address'],
@@ -130,6 +162,13 @@ def create_delivery(request):
             estimated_price=data.get('estimated_price'),
             status='pending'
         )
+        # The event commits with the delivery, in the database its region maps to
+        with transaction.atomic(using=router.db_for_write(DeliveryRequest, instance=delivery)):
+            delivery.save()
+            record_event(delivery, 'pending', actor=request.user, at=delivery.created_at)
+            # Rollups live in 'default'; they commit just before the delivery's region does
+            with transaction.atomic(savepoint=False):
+                record_transition(delivery, 'pending')
         
         return json_response({
             'message': 'Delivery request created successfully',
@@ -172,12 +211,25 @@ def list_deliveries(request):
     else:
         deliveries = DeliveryRequest.objects.none()
     
+    max_limit = getattr(settings, 'PARCELBEE_DELIVERY_LIST_MAX', 500)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', max_limit)), max_limit))
+    except ValueError:
+        return json_response({'error': 'limit must be an integer'}, status=400)
+    
+    # Every region database returns its newest `limit` rows, merged in created_at order
+    deliveries = gather(deliveries.order_by('-created_at'), key=lambda d: d.created_at, reverse=True, limit=limit)
+    
+    # Users live in 'default', so names are fetched in one query rather than per row
+    user_ids = {d.customer_id for d in deliveries} | {d.partner_id for d in deliveries if d.partner_id}
+    names = dict(User.objects.filter(id__in=user_ids).values_list('id', 'name'))
+    
     delivery_list = []
     for delivery in deliveries:
         delivery_list.append({
             'id': delivery.id,
-            'customer_name': delivery.customer.name,
-            'partner_name': delivery.partner.name if delivery.partner else None,
+            'customer_name': names.get(delivery.customer_id),
+            'partner_name': names.get(delivery.partner_id) if delivery.partner_id else None,
             'pickup_address': delivery.pickup_address,
             'drop_address': delivery.drop_address,
             'description': delivery.description,
@@ -200,7 +252,7 @@ def list_deliveries(request):
 def get_delivery_detail(request, delivery_id):
     """Get details of a specific delivery"""
     try:
-        delivery = DeliveryRequest.objects.get(id=delivery_id)
+        delivery = DeliveryRequest.objects.located(delivery_id).get(id=delivery_id)
         
         # Check permissions
         user = request.user
@@ -225,10 +277,10 @@ def get_delivery_detail(request, delivery_id):
             } if delivery.partner else None,
             'pickup_address': delivery.pickup_address,
             'drop_address': delivery.drop_address,
-            'pickup_lat': float(delivery.pickup_lat) if delivery.pickup_lat else None,
-            'pickup_lng': float(delivery.pickup_lng) if delivery.pickup_lng else None,
-            'drop_lat': float(delivery.drop_lat) if delivery.drop_lat else None,
-            'drop_lng': float(delivery.drop_lng) if delivery.drop_lng else None,
+            'pickup_lat': delivery.pickup_lat if delivery.pickup_lat else None,
+            'pickup_lng': delivery.pickup_lng if delivery.pickup_lng else None,
+            'drop_lat': delivery.drop_lat if delivery.drop_lat else None,
+            'drop_lng': delivery.drop_lng if delivery.drop_lng else None,
             'description': delivery.description,
             'weight': float(delivery.weight),
             'estimated_price': float(delivery.estimated_price) if delivery.estimated_price else None,
@@ -236,19 +288,56 @@ def get_delivery_detail(request, delivery_id):
             'created_at': delivery.created_at.isoformat(),
             'updated_at': delivery.updated_at.isoformat(),
             'accepted_at': delivery.accepted_at.isoformat() if delivery.accepted_at else None,
-            'delivered_at': delivery.delivered_at.isoformat() if delivery.delivered_at else None
+            'delivered_at': delivery.delivered_at.isoformat() if delivery.delivered_at else None,
+            # Scored from the fields above by the model loaded at worker start; no extra queries
+            'estimated_delivery_at': estimated_delivery(delivery)
         })
     except DeliveryRequest.DoesNotExist:
         return json_response({'error': 'Delivery not found'}, status=404)
 
 
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required()
+def get_delivery_history(request, delivery_id):
+    """Status history of a delivery, oldest first"""
+    try:
+        delivery = DeliveryRequest.objects.located(delivery_id).only('id', 'customer_id', 'partner_id', 'status').get(id=delivery_id)
+    except DeliveryRequest.DoesNotExist:
+        return json_response({'error': 'Delivery not found'}, status=404)
+    
+    user = request.user
+    if user.role == 'customer' and delivery.customer_id != user.id:
+        return json_response({'error': 'Access denied'}, status=403)
+    elif user.role == 'partner' and delivery.partner_id != user.id and delivery.status != 'pending':
+        return json_response({'error': 'Access denied'}, status=403)
+    
+    events = [
+        {
+            'status': status,
+            'actor_id': actor_id,
+            'lat': float(lat) if lat is not None else None,
+            'lng': float(lng) if lng is not None else None,
+            'created_at': created_at.isoformat()
+        }
+        for status, actor_id, lat, lng, created_at in delivery_history(delivery.id, using=delivery._state.db)
+    ]
+    
+    return json_response({
+        'id': delivery.id,
+        'status': delivery.status,
+        'events': events
+    })
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @auth_required(roles=['partner'])
+@idempotent
 def accept_delivery(request, delivery_id):
     """Partner accepts a delivery request"""
     try:
-        delivery = DeliveryRequest.objects.get(id=delivery_id)
+        delivery = DeliveryRequest.objects.located(delivery_id).get(id=delivery_id)
         
         if delivery.status != 'pending':
             return json_response({'error': 'Delivery is not available'}, status=400)
@@ -259,7 +348,11 @@ def accept_delivery(request, delivery_id):
         delivery.partner = request.user
         delivery.status = 'accepted'
         delivery.accepted_at = timezone.now()
-        delivery.save()
+        with transaction.atomic(using=delivery._state.db):
+            delivery.save(update_fields=['partner', 'status', 'accepted_at', 'updated_at'])
+            record_event(delivery, 'accepted', actor=request.user, at=delivery.accepted_at)
+            with transaction.atomic(savepoint=False):
+                record_transition(delivery, 'accepted')
         
         return json_response({
             'message': 'Delivery accepted successfully',
@@ -284,21 +377,38 @@ def update_delivery_status(request, delivery_id):
         return json_response({'error': 'Status is required'}, status=400)
     
     new_status = data['status']
-    valid_statuses = ['accepted', 'in_transit', 'delivered', 'cancelled']
     
-    if new_status not in valid_statuses:
+    if new_status not in PARTNER_STATUS_UPDATES:
         return json_response({'error': 'Invalid status'}, status=400)
     
     try:
-        delivery = DeliveryRequest.objects.get(id=delivery_id)
+        lat, lng = parse_coordinates(data.get('lat'), data.get('lng'))
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    
+    try:
+        delivery = DeliveryRequest.objects.located(delivery_id).get(id=delivery_id)
         
         if delivery.partner != request.user:
             return json_response({'error': 'Access denied'}, status=403)
         
+        # One timestamp for the row and its event, so replaying the log reproduces delivered_at
+        now = timezone.now()
+        previous_status, previous_at = delivery.status, delivery.updated_at
         delivery.status = new_status
+        delivery.updated_at = now
+        update_fields = ['status', 'updated_at']
         if new_status == 'delivered':
-            delivery.delivered_at = timezone.now()
-        delivery.save()
+            delivery.delivered_at = now
+            update_fields.append('delivered_at')
+        with transaction.atomic(using=delivery._state.db):
+            # A queryset update, as in the bulk path: save() would restamp updated_at (auto_now)
+            DeliveryRequest.objects.using(delivery._state.db).filter(id=delivery.id).update(
+                **{field: getattr(delivery, field) for field in update_fields})
+            if previous_status != new_status:
+                record_event(delivery, new_status, actor=request.user, lat=lat, lng=lng, at=now)
+                with transaction.atomic(savepoint=False):
+                    record_status_changes([(delivery, previous_status, previous_at)], at=now)
         
         return json_response({
             'message': 'Status updated successfully',
@@ -312,6 +422,209 @@ def update_delivery_status(request, delivery_id):
         return json_response({'error': 'Delivery not found'}, status=404)
 
 
+@csrf_exempt
+@require_http_methods(["PUT", "PATCH"])
+@auth_required(roles=['partner'])
+def bulk_update_delivery_status(request):
+    """Update the status of many deliveries in one request (partner only)"""
+    data = get_json_data(request)
+    
+    if not data or not isinstance(data.get('updates'), list) or not data['updates']:
+        return json_response({'error': 'updates must be a non-empty list'}, status=400)
+    
+    max_items = getattr(settings, 'PARCELBEE_BULK_STATUS_MAX', 100)
+    if len(data['updates']) > max_items:
+        return json_response({'error': f'At most {max_items} updates per request'}, status=400)
+    
+    results = []
+    wanted = {}
+    for item in data['updates']:
+        try:
+            delivery_id = int(item['delivery_id'])
+            new_status = item['status']
+        except (KeyError, TypeError, ValueError):
+            results.append({'delivery_id': item.get('delivery_id') if isinstance(item, dict) else None,
+                            'ok': False, 'error': 'delivery_id and status are required'})
+            continue
+        try:
+            lat, lng = parse_coordinates(item.get('lat'), item.get('lng'))
+        except ValueError as e:
+            results.append({'delivery_id': delivery_id, 'ok': False, 'error': str(e)})
+            continue
+        if new_status not in PARTNER_STATUS_UPDATES:
+            results.append({'delivery_id': delivery_id, 'ok': False, 'error': 'Invalid status'})
+        elif delivery_id in wanted:
+            results.append({'delivery_id': delivery_id, 'ok': False, 'error': 'Duplicate delivery_id'})
+        else:
+            wanted[delivery_id] = {'status': new_status, 'lat': lat, 'lng': lng}
+            results.append({'delivery_id': delivery_id})
+    
+    now = timezone.now()
+    changed = []
+    pending = {result['delivery_id']: result for result in results if 'ok' not in result}
+    # Each region database is locked and written in its own transaction
+    for alias, delivery_ids in databases_for_deliveries(list(wanted)).items():
+        with transaction.atomic(using=alias):
+            deliveries = DeliveryRequest.objects.using(alias).select_for_update().only(
+                'id', 'partner_id', 'status', 'created_at', 'updated_at', 'accepted_at', 'delivered_at', 'estimated_price'
+            ).in_bulk(delivery_ids)
+            
+            shard_changed = []
+            status_changes = []
+            events = []
+            for delivery_id in delivery_ids:
+                result = pending[delivery_id]
+                delivery = deliveries.get(delivery_id)
+                if delivery is None:
+                    result.update(ok=False, error='Delivery not found')
+                    continue
+                if delivery.partner_id != request.user.id:
+                    result.update(ok=False, error='Access denied')
+                    continue
+                
+                item = wanted[delivery_id]
+                previous_status, previous_at = delivery.status, delivery.updated_at
+                delivery.status = item['status']
+                delivery.updated_at = now
+                if delivery.status == 'delivered':
+                    delivery.delivered_at = now
+                shard_changed.append(delivery)
+                
+                if previous_status != delivery.status:
+                    status_changes.append((delivery, previous_status, previous_at))
+                    events.append(build_event(delivery, delivery.status, actor=request.user,
+                                              lat=item['lat'], lng=item['lng'], at=now))
+                result.update(ok=True, status=delivery.status, updated_at=now.isoformat())
+            
+            if shard_changed:
+                DeliveryRequest.objects.using(alias).bulk_update(shard_changed, ['status', 'updated_at', 'delivered_at'])
+            record_events(events, using=alias)
+            # Rollups live in 'default'; they commit just before this region does
+            with transaction.atomic(savepoint=False):
+                record_status_changes(status_changes, at=now)
+            changed.extend(shard_changed)
+    
+    return json_response({
+        'updated': len(changed),
+        'failed': len(results) - len(changed),
+        'results': results
+    })
+
+
+def serialize_trip(trip):
+    return {
+        'id': trip.id,
+        'delivery_ids': trip.delivery_ids,
+        'parcel_count': trip.parcel_count,
+        'total_weight': float(trip.total_weight),
+        'estimated_price': float(trip.estimated_price) if trip.estimated_price is not None else None,
+        'pickup_lat': float(trip.pickup_lat),
+        'pickup_lng': float(trip.pickup_lng),
+        'bearing': trip.bearing,
+        'status': trip.status,
+        'created_at': trip.created_at.isoformat()
+    }
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['partner'])
+def list_trip_offers(request):
+    """Consolidated trips on offer, biggest first (partner only)"""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+    except ValueError:
+        return json_response({'error': 'limit must be an integer'}, status=400)
+    
+    trips = Trip.objects.filter(status='offered').order_by('-parcel_count', 'created_at')[:limit]
+    return json_response({
+        'count': len(trips),
+        'trips': [serialize_trip(trip) for trip in trips]
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@auth_required(roles=['partner'])
+@idempotent
+def accept_trip(request, trip_id):
+    """Partner accepts every delivery of a consolidated trip as one job"""
+    try:
+        trip, deliveries = accept_trip_offer(trip_id, request.user)
+    except Trip.DoesNotExist:
+        return json_response({'error': 'Trip not found or no longer offered'}, status=404)
+    
+    if deliveries is None:
+        return json_response({'error': 'Some deliveries in this trip were taken; the offer was withdrawn'}, status=409)
+    
+    return json_response({
+        'message': 'Trip accepted successfully',
+        'trip': serialize_trip(trip)
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@auth_required(roles=['partner'])
+def post_partner_location(request):
+    """Ingest a batch of GPS fixes for the authenticated partner"""
+    data = get_json_data(request)
+    
+    if not data or not isinstance(data.get('fixes'), list) or not data['fixes']:
+        return json_response({'error': 'fixes must be a non-empty list'}, status=400)
+    
+    max_batch = getattr(settings, 'PARCELBEE_LOCATION_MAX_BATCH', 500)
+    if len(data['fixes']) > max_batch:
+        return json_response({'error': f'At most {max_batch} fixes per request'}, status=400)
+    
+    now = time.time()
+    fixes = []
+    try:
+        for fix in data['fixes']:
+            lat = float(fix['lat'])
+            lng = float(fix['lng'])
+            ts = float(fix.get('ts', now))
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError
+            # min() below would let NaN through, and times before 1970 cannot be stored
+            if not math.isfinite(ts) or ts < 0:
+                raise ValueError
+            # Clients with skewed clocks must not pin a position into the future
+            fixes.append((lat, lng, min(ts, now)))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return json_response({'error': 'Each fix needs valid lat, lng and optional unix ts'}, status=400)
+    
+    accepted = ingest_fixes(request.user.id, fixes)
+    return json_response({'accepted': accepted}, status=202)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required()
+def get_delivery_location(request, delivery_id):
+    """Where is my parcel: latest position of the partner carrying it"""
+    try:
+        delivery = DeliveryRequest.objects.located(delivery_id).only('id', 'customer_id', 'partner_id', 'status').get(id=delivery_id)
+    except DeliveryRequest.DoesNotExist:
+        return json_response({'error': 'Delivery not found'}, status=404)
+    
+    user = request.user
+    if user.role == 'customer' and delivery.customer_id != user.id:
+        return json_response({'error': 'Access denied'}, status=403)
+    elif user.role == 'partner' and delivery.partner_id != user.id:
+        return json_response({'error': 'Access denied'}, status=403)
+    
+    location = None
+    if delivery.partner_id and delivery.status in ('accepted', 'in_transit'):
+        location = latest_location(delivery.partner_id)
+    
+    return json_response({
+        'id': delivery.id,
+        'status': delivery.status,
+        'location': location
+    })
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 @auth_required(roles=['admin'])
@@ -321,11 +634,13 @@ def admin_overview(request):
     total_customers = User.objects.filter(role='customer').count()
     total_partners = User.objects.filter(role='partner').count()
     
-    total_deliveries = DeliveryRequest.objects.count()
-    pending_deliveries = DeliveryRequest.objects.filter(status='pending').count()
-    accepted_deliveries = DeliveryRequest.objects.filter(status='accepted').count()
-    in_transit_deliveries = DeliveryRequest.objects.filter(status='in_transit').count()
-    delivered_deliveries = DeliveryRequest.objects.filter(status='delivered').count()
+    # One grouped count per region database instead of a count per status
+    counts = status_counts()
+    total_deliveries = sum(counts.values())
+    pending_deliveries = counts['pending']
+    accepted_deliveries = counts['accepted']
+    in_transit_deliveries = counts['in_transit']
+    delivered_deliveries = counts['delivered']
     
     return json_response({
         'users': {
@@ -343,66 +658,143 @@ def admin_overview(request):
     })
 
 
-class PriceEstimateView(APIView):
-    """
-    POST /api/price/estimate/
-    payload: { pickup_address, drop_address, weight }
-    response: { distance_km, estimated_price, breakdown, pickup_lat, pickup_lng, drop_lat, drop_lng }
-    """
-    permission_classes = []  # keep public or add IsAuthenticated if you want auth
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['admin'])
+def admin_analytics(request):
+    """Per-day or per-partner delivery metrics, read from the daily rollups (admin only)"""
+    group_by = request.GET.get('group_by', 'day')
+    if group_by not in ('day', 'partner'):
+        return json_response({'error': 'group_by must be day or partner'}, status=400)
+    
+    try:
+        date_from = request.GET.get('date_from')
+        date_to = request.GET.get('date_to')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+        partner = int(request.GET['partner']) if request.GET.get('partner') else None
+    except ValueError:
+        return json_response({'error': 'Dates must be YYYY-MM-DD and partner a user id'}, status=400)
+    
+    return json_response({
+        'group_by': group_by,
+        'date_from': date_from.isoformat() if date_from else None,
+        'date_to': date_to.isoformat() if date_to else None,
+        'totals': rollup_totals(date_from, date_to, partner),
+        'results': query_rollups(date_from, date_to, group_by, partner)
+    })
 
-    def post(self, request):
-        serializer = PriceEstimateSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
 
-        # try to geocode; if it fails, fall back to a conservative distance so UI can continue
-        try:
-           p_lat, p_lng = geocode_nominatim(data["pickup_address"])
-           d_lat, d_lng = geocode_nominatim(data["drop_address"])
-           geocoding_used = True
-           distance_km = haversine_km(p_lat, p_lng, d_lat, d_lng)
-           geocode_note = None
-        except Exception as e:
-    # Geocoding failed for one or both addresses.
-           geocoding_used = False
-           geocode_error = str(e)
-            # Do NOT call haversine when coords are None
-           p_lat = p_lng = d_lat = d_lng = None
-            
-            # fallback: assume a small city delivery distance. tune this if you want.
-           distance_km = getattr(settings, "PARCELBEE_FALLBACK_KM", 5.0)
-
-        # Rates (override in settings if present)
-        BASE_FEE = getattr(settings, "PARCELBEE_BASE_FEE", 30.0)
-        PER_KM = getattr(settings, "PARCELBEE_PER_KM", 10.0)
-        PER_KG = getattr(settings, "PARCELBEE_PER_KG", 5.0)
-
-        weight_fee = data["weight"] * PER_KG
-        distance_fee = distance_km * PER_KM
-        subtotal = BASE_FEE + distance_fee + weight_fee
-        estimated_price = round(subtotal)
-
-        breakdown = {
-            "base_fee": BASE_FEE,
-            "distance_km": round(distance_km, 3),
-            "distance_fee": round(distance_fee, 2),
-            "weight_fee": round(weight_fee, 2),
-            "subtotal": round(subtotal, 2),
-        }
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['admin'])
+def search_deliveries_view(request):
+    """Ranked full-text search over addresses, descriptions and names (admin only)"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return json_response({'error': 'q is required'}, status=400)
+    
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', 20)), 1), 100)
+    except ValueError:
+        return json_response({'error': 'page and page_size must be integers'}, status=400)
+    
+    total, deliveries = search_deliveries(query, page=page, page_size=page_size)
+    
+    return json_response({
+        'query': query,
+        'count': total,
+        'page': page,
+        'page_size': page_size,
+        'results': [{
+            'id': delivery.id,
+            'customer_name': delivery.customer.name,
+            'partner_name': delivery.partner.name if delivery.partner else None,
+            'pickup_address': delivery.pickup_address,
+            'drop_address': delivery.drop_address,
+            'description': delivery.description,
+            'status': delivery.status,
+            'created_at': delivery.created_at.isoformat()
+        } for delivery in deliveries]
+    })
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['admin'])
+def export_deliveries(request):
+    """Stream deliveries as CSV or NDJSON (admin only)"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return json_response({'error': 'format must be csv or ndjson'}, status=400)
+
+    try:
+        deliveries = filter_deliveries(
+            status=request.GET.get('status'),
+            date_from=request.GET.get('date_from'),
+            date_to=request.GET.get('date_to'),
+            partner=request.GET.get('partner'),
+        )
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+
+    if export_format == 'ndjson':
+        content_type = 'application/x-ndjson'
+    else:
+        content_type = 'text/csv'
+
+    response = StreamingHttpResponse(
+        stream_deliveries(deliveries, export_format),
+        content_type=content_type
+    )
+    filename = f"deliveries-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['admin'])
+def admission_metrics_view(request):
+    """Concurrency-limit occupancy, queue waits and shed requests per route, for this worker (admin only)"""
+    return json_response({'pid': os.getpid(), 'routes': admission_metrics()})
 
-        return Response({
-            "distance_km": round(distance_km, 3),
-            "estimated_price": estimated_price,
-            "breakdown": breakdown,
-            "pickup_lat": p_lat,
-            "pickup_lng": p_lng,
-            "drop_lat": d_lat,
-            "drop_lng": d_lng,
-            "geocoding_used": geocoding_used,
-            "geocode_error": geocode_error if not geocoding_used else None,
-            # "note": geocode_note
-        })
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['admin'])
+def list_profiles_view(request):
+    """Stored request profiles, newest first (admin only)"""
+    return json_response({'profiles': list_profiles()})
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@auth_required(roles=['admin'])
+def get_profile(request, profile_id):
+    """
+    One stored request profile (admin only). format=json (default) has the SQL, top functions
+    and folded stacks; folded is plain text for flamegraph.pl/speedscope; pstats is the raw
+    cProfile dump for snakeviz or pstats.
+    """
+    paths = profile_paths(profile_id)
+    if paths is None or not paths[0].exists():
+        return json_response({'error': 'Profile not found'}, status=404)
+    summary_path, stats_path = paths
+    
+    profile_format = request.GET.get('format', 'json')
+    if profile_format == 'pstats':
+        response = FileResponse(open(stats_path, 'rb'), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{profile_id}.prof"'
+        return response
+    
+    summary = json.loads(summary_path.read_text(encoding='utf-8'))
+    if profile_format == 'folded':
+        return HttpResponse('\n'.join(summary['folded']) + '\n', content_type='text/plain; charset=utf-8')
+    if profile_format != 'json':
+        return json_response({'error': 'format must be json, folded or pstats'}, status=400)
+    return json_response(summary)
 
 
 @csrf_exempt
@@ -421,12 +813,14 @@ def forgot_password_request(request):
     try:
         user = User.objects.get(email=email)
         
+        # Sent by the task queue so SMTP latency never reaches the response;
+        # the task mints its own token so none is stored with the queued task
+        send_password_reset_email.delay(email)
+        
         # Generate reset token
         reset_token = generate_reset_token_payload(email)
         
-        # In production, send email here with reset link
-        # For development, we'll return the token in response
-        # TODO: Send email with reset link: f"{FRONTEND_URL}/reset-password.html?token={reset_token}"
+        # For development, we'll also return the token in response
         
         return json_response({
             'message': 'Password reset instructions have been sent to your email.',
@@ -472,8 +866,14 @@ def reset_password_confirm(request):
     
     try:
         user = User.objects.get(email=email)
-        user.set_password(new_password)
-        user.save()
+        with transaction.atomic():
+            # Using up the link comes first: of two requests racing on it, only one gets past here
+            if not consume_token(token, payload['exp'], user=user):
+                return json_response({'error': 'Invalid or expired reset token'}, status=400)
+            user.set_password(new_password)
+            # Sessions opened with the old password end
+            revoke_user_tokens(user, save=False)
+            user.save()
         
         return json_response({
             'message': 'Password reset successfully. Please login with your new password.'
@@ -482,3 +882,35 @@ def reset_password_confirm(request):
         return json_response({'error': 'User not found'}, status=404)
     except Exception as e:
         return json_response({'error': str(e)}, status=500)
+
+
+
+@require_http_methods(["GET", "HEAD"])
+def serve_frontend(request, path=''):
+    """Serve the built frontend; fingerprinted assets are cached forever, pages revalidate"""
+    path = path or 'public/index.html'
+    try:
+        full_path = safe_join(build_dir(), path)
+    except Exception:
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+    
+    content_type, _ = mimetypes.guess_type(full_path)
+    accepted = accepted_encodings(request)
+    encoding = None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if name in accepted and os.path.isfile(full_path + suffix):
+            full_path += suffix
+            encoding = name
+            break
+    
+    response = FileResponse(open(full_path, 'rb'), content_type=content_type or 'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    if is_fingerprinted(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,97 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+
+logger = logging.getLogger(__name__)
+
+
+def _iter_callbacks(patterns):
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from _iter_callbacks(pattern.url_patterns)
+        else:
+            yield pattern.callback
+
+
+_close_before_fork = False
+
+
+def _close_connections_before_fork():
+    """
+    Under gunicorn --preload warmup runs in the master, and forked workers must not share
+    the sockets it opened: they are closed before the first fork. In a worker nothing
+    forks afterwards, so the connections it warmed up stay open for its first requests.
+    """
+    global _close_before_fork
+    if _close_before_fork:
+        _close_before_fork = False
+        connections.close_all()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_close_connections_before_fork)
+
+
+def warmup():
+    """
+    Pay the cold-start costs before the worker takes traffic: build the URL resolver,
+    check the database connections, compile the tariff table and load the road graph and ETA model.
+    Lazily loaded views are imported too when PARCELBEE_WARMUP_LAZY_VIEWS is set.
+    Returns the seconds spent per step.
+    """
+    global _close_before_fork
+    _close_before_fork = True
+    timings = {}
+
+    started = time.perf_counter()
+    resolver = get_resolver()
+    resolver.reverse_dict  # builds the resolver's lookup tables
+    timings['urlconf'] = time.perf_counter() - started
+
+    if getattr(settings, 'PARCELBEE_WARMUP_LAZY_VIEWS', False):
+        started = time.perf_counter()
+        for callback in _iter_callbacks(resolver.url_patterns):
+            if hasattr(callback, 'load'):
+                callback.load()
+        timings['lazy_views'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for alias in connections:
+        connections[alias].ensure_connection()
+    timings['db_connections'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from core.pricing import engine
+    engine.table()
+    timings['tariff_table'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from core.roads import get_graph
+    get_graph()
+    timings['road_graph'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    from core.eta import get_model
+    get_model()
+    timings['eta_model'] = time.perf_counter() - started
+
+    return timings
+
+
+def warmup_on_boot():
+    """Run warmup() from the WSGI/ASGI entry point when PARCELBEE_WARMUP_ON_BOOT is set"""
+    if not getattr(settings, 'PARCELBEE_WARMUP_ON_BOOT', False):
+        return None
+    try:
+        timings = warmup()
+    except Exception:
+        # A cold worker is still better than one that refuses to start
+        logger.exception('Worker warmup failed')
+        return None
+    logger.info('Worker warmup: %s', ', '.join(f'{step} {seconds * 1000:.1f}ms' for step, seconds in timings.items()))
+    return timings
@@ -167,11 +167,26 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  
     'django.middleware.security.SecurityMiddleware',
     
+    # Sanitized request trace for manage.py replay_traffic when PARCELBEE_TRAFFIC_CAPTURE is set
+    'core.traffic.TrafficCaptureMiddleware',
+    
+    # Admin requests sending PARCELBEE_PROFILE_HEADER are profiled; others pass straight through
+    'core.profiling.ProfilingMiddleware',
+    
+    # gzip/brotli for API responses above PARCELBEE_COMPRESS_MIN_BYTES
+    'core.compression.CompressionMiddleware',
+    
     # Sessions first
     'django.contrib.sessions.middleware.SessionMiddleware',
     
     'django.middleware.common.CommonMiddleware',
     
+    # Per-route request limits (PARCELBEE_RATE_LIMITS)
+    'core.ratelimit.RateLimitMiddleware',
+    
+    # Per-route concurrency limits with bounded queues (PARCELBEE_ADMISSION)
+    'core.admission.AdmissionMiddleware',
+    
     # CSRF protection
     'django.middleware.csrf.CsrfViewMiddleware',
     
@@ -290,4 +305,130 @@ CORS_ALLOW_ALL_ORIGINS = True  # For development only
 
 PARCELBEE_BASE_FEE = 30.0
 PARCELBEE_PER_KM = 10.0
-PARCELBEE_PER_KG = 5.0
\ No newline at end of file
+PARCELBEE_PER_KG = 5.0
+
+# Partner locations: latest fix lives in memory, samples are persisted at this interval
+PARCELBEE_LOCATION_PERSIST_SECONDS = 30.0
+PARCELBEE_LOCATION_MAX_BATCH = 500
+PARCELBEE_LOCATION_RETENTION_DAYS = 30  # manage.py purge_partner_locations deletes older samples
+
+# Largest list accepted by the bulk status update endpoint
+PARCELBEE_BULK_STATUS_MAX = 100
+
+# Most deliveries returned by delivery/list/ (and the default for its ?limit=)
+PARCELBEE_DELIVERY_LIST_MAX = 500
+
+# Tariff engine: grid cell size (degrees) for zone lookup and how often
+# workers re-check the tariff tables for changes made elsewhere
+PARCELBEE_TARIFF_CELL_DEG = 0.01
+PARCELBEE_TARIFF_RELOAD_SECONDS = 10.0
+
+# Resolve the URLconf, check the DB and load the tariff table, road graph and ETA
+# model when the WSGI app is loaded. Importing the lazily loaded views (DRF) as well
+# only pays off with gunicorn --preload, where the forked workers share the import.
+PARCELBEE_WARMUP_ON_BOOT = True
+PARCELBEE_WARMUP_LAZY_VIEWS = False
+
+# Admin changelists stop counting filtered rows past this many
+PARCELBEE_ADMIN_COUNT_LIMIT = 10000
+
+# Background geocoding of deliveries created without coordinates
+PARCELBEE_GEOCODER = 'core.utils.geocode_nominatim'
+PARCELBEE_GEOCODE_RATE = 1.0  # requests per second, Nominatim usage policy
+
+# Background task queue (manage.py run_tasks)
+PARCELBEE_TASK_RETRY_BASE_SECONDS = 5.0
+PARCELBEE_TASK_RETRY_MAX_SECONDS = 600.0
+# A running task's claim lasts this long; run_tasks renews it while the task runs and
+# takes back tasks whose worker died. Not a limit on how long a task may run.
+PARCELBEE_TASK_LEASE_SECONDS = 300
+
+# Email (console backend for development; configure SMTP in production)
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'ParcelBee <no-reply@parcelbee.local>'
+PARCELBEE_FRONTEND_URL = 'http://localhost:3000'
+
+# Sliding-window rate limits per URL name. scope: ip, user (JWT) or route (all callers)
+PARCELBEE_RATE_LIMITS = {
+    'login': [{'scope': 'ip', 'limit': 10, 'window': 60}],
+    'register': [{'scope': 'ip', 'limit': 5, 'window': 60}],
+    'forgot_password': [{'scope': 'ip', 'limit': 5, 'window': 300}],
+    'reset_password': [{'scope': 'ip', 'limit': 10, 'window': 300}],
+    'price-estimate': [
+        {'scope': 'ip', 'limit': 30, 'window': 60},
+        # Protects the shared Nominatim quota
+        {'scope': 'route', 'limit': 600, 'window': 60},
+    ],
+}
+# LocalBackend keeps counters per process; use CacheBackend with a shared cache to limit across workers
+PARCELBEE_RATE_LIMIT_BACKEND = 'core.ratelimit.LocalBackend'
+PARCELBEE_RATE_LIMIT_TRUST_XFF = False
+
+# Idempotency-Key support on create_delivery / accept_delivery
+PARCELBEE_IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+PARCELBEE_IDEMPOTENCY_LOCK_SECONDS = 60  # in-progress records not refreshed for this long are considered abandoned
+
+# Response compression (brotli is used when the optional brotli package is installed)
+PARCELBEE_COMPRESS_MIN_BYTES = 1024
+
+# Frontend build (manage.py build_frontend), served under /app/
+PARCELBEE_FRONTEND_SRC = BASE_DIR.parent / 'parcelbee_frontend' / 'src'
+PARCELBEE_FRONTEND_BUILD = BASE_DIR / 'frontend_build'
+
+# Offline road-network distances for pricing (manage.py build_road_graph). Unset = straight-line distance
+PARCELBEE_ROAD_GRAPH = None
+PARCELBEE_ROAD_SNAP_MAX_KM = 1.0  # points further than this from any road node fall back to haversine
+
+# Region sharding of deliveries. A delivery's region is the PARCELBEE_REGIONS box
+# (min_lat, min_lng, max_lat, max_lng) containing its pickup point; PARCELBEE_REGION_DATABASES
+# maps regions to DATABASES aliases and anything unmapped stays in 'default'. Create a shard with
+# `manage.py migrate --database=<alias>` and move existing rows with `manage.py rebalance_deliveries`.
+# Local example:
+#   DATABASES['deliveries_south'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'deliveries_south.sqlite3'}
+#   PARCELBEE_REGIONS = {'blr': (12.70, 77.30, 13.30, 77.90)}
+#   PARCELBEE_REGION_DATABASES = {'blr': 'deliveries_south'}
+DATABASE_ROUTERS = ['core.sharding.DeliveryRouter']
+PARCELBEE_REGIONS = {}
+PARCELBEE_REGION_DATABASES = {}
+PARCELBEE_SHARD_WORKERS = 8  # threads for scatter-gather queries across region databases
+
+# Trip consolidation (manage.py consolidate_trips): pending deliveries whose pickups share a
+# grid cell and whose drops lie in the same compass sector are offered to partners as one trip
+PARCELBEE_TRIP_MAX_WEIGHT = 20.0  # kg per trip
+PARCELBEE_TRIP_MAX_PARCELS = 8
+PARCELBEE_TRIP_CELL_DEG = 0.01  # ~1.1 km of latitude
+PARCELBEE_TRIP_SECTORS = 8
+
+# Delivery ETA model (manage.py train_eta_model), loaded once per worker. Without the file
+# get_delivery_detail reports estimated_delivery_at as null
+PARCELBEE_ETA_MODEL = BASE_DIR / 'eta_model.json'
+
+# On-demand request profiling: an admin request with this header runs under cProfile with its SQL
+# timed; the response's X-Profile-Id names the result under /api/admin/profiles/<id>/
+PARCELBEE_PROFILING = True
+PARCELBEE_PROFILE_HEADER = 'X-Parcelbee-Profile'
+PARCELBEE_PROFILE_DIR = BASE_DIR / 'profiles'
+PARCELBEE_PROFILE_KEEP = 50  # oldest profiles beyond this are deleted
+PARCELBEE_PROFILE_SAMPLE_MS = 1  # stack sampling interval for the flamegraph
+
+# Traffic capture for load testing: when set, every API request appends one sanitized line
+# (route, body shape, caller role, status, timing) to this file; replay it with manage.py replay_traffic
+PARCELBEE_TRAFFIC_CAPTURE = None
+PARCELBEE_TRAFFIC_SAMPLE_RATE = 1.0
+
+# Admission control, keyed by URL name: at most `concurrency` requests in the route per worker,
+# `queue` more waiting up to `queue_timeout` seconds; the rest get 503 + Retry-After, or with
+# 'degrade' are served a cheap answer (pricing quotes the fallback distance without geocoding).
+# Keep concurrency + queue well under the worker's thread count so other routes always have threads.
+PARCELBEE_ADMISSION = {
+    'price-estimate': {'concurrency': 4, 'queue': 8, 'queue_timeout': 0.25, 'retry_after': 2, 'degrade': True},
+}
+
+# Per-route query/latency/memory baseline checked by `manage.py check_query_budgets`
+PARCELBEE_QUERY_BUDGET_BASELINE = BASE_DIR / 'query_budgets.json'
+
+# Verified JWT claims cached per worker until each token's exp (0 disables the cache).
+# Revocations (logout, used reset links) are shared through the revoked_tokens table and
+# picked up by other workers within PARCELBEE_REVOCATION_REFRESH_SECONDS.
+PARCELBEE_TOKEN_CACHE_SIZE = 10000
+PARCELBEE_REVOCATION_REFRESH_SECONDS = 2.0
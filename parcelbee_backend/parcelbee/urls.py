@@ -25,10 +25,15 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from core.views import serve_frontend
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('core.urls')),
+    
+    # Frontend built by manage.py build_frontend
+    path('app/', serve_frontend, name='frontend_index'),
+    path('app/<path:path>', serve_frontend, name='frontend'),
 ]
 
 # Serve media files in development
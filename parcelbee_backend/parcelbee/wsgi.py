@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parcelbee.settings')
 
 application = get_wsgi_application()
+
+# Build the URLconf and load the pricing and routing data before the worker accepts traffic
+from core.warmup import warmup_on_boot  # noqa: E402
+warmup_on_boot()